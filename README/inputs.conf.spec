@@ -4,4 +4,29 @@
 api_token = <value>
 vcs = <value>
 org = <value>
+max_concurrency = <value>
+pool_size = <value>
+engine = <value>
+checkpoint_batch_size = <value>
+checkpoint_max_age = <value>
+terminal_cache_size = <value>
+response_cache_size = <value>
+job_detail_cache_size = <value>
+job_detail_cache_ttl = <value>
+job_detail = <value>
+rate_limit = <value>
+max_retries = <value>
+org_workers = <value>
+max_run_seconds = <value>
+event_flush_size = <value>
+event_flush_interval = <value>
+output_mode = <value>
+hec_url = <value>
+hec_token = <value>
+hec_ack = <value>
+hec_verify_ssl = <value>
+hec_batch_size = <value>
+hec_queue_size = <value>
+log_level = <value>
+profile = <value>
 python.version = python3
@@ -0,0 +1,369 @@
+#!/usr/bin/env python
+"""End-to-end benchmark of the CircleCI modular input against stub servers.
+
+A stub server in another process replays CircleCI API responses, either
+recorded in a JSON-lines fixture or generated for synthetic organizations,
+and serves a KV Store of splunkd in memory. Each organization is collected by
+``CircleCIScript.run_script`` in a fresh process, like splunkd runs the
+input, with events and logs captured by ``BufferedEventWriter``. The input
+runs again at once until a run writes no events, so the last run measures an
+incremental run over checkpoints. Prints runs, wall time, CircleCI API and KV
+Store requests, events/sec and peak RSS of each organization. Run from the
+root of this app:
+
+    python benchmark/collector.py --jobs 10 1000 50000
+
+Synthetic organization ``jobs-<N>`` has N jobs generated by
+``benchmark/synthetic.py``, in pipelines of 2 workflows with 5 jobs each, 5
+steps per job, and 20 items per page by default. Their shape and the mix of
+job statuses are set by the options of ``benchmark/synthetic.py``:
+
+    python benchmark/collector.py --jobs 1000 --steps 50 --actions 4 \
+        --page-size 5 --statuses success=80,failed=15,running=5
+
+Runs list up to 100 pages of pipelines, so jobs of older pipelines are not
+collected beyond 100 pages, as in an input of ``interval`` 6000. Running jobs
+are collected again each run, up to ``--max-runs``. A recorded fixture has
+one JSON object per line with ``path``, ``params`` and ``body`` of a response
+to CircleCI API, and is collected as organization ``--org``:
+
+    python benchmark/collector.py --fixture recorded.jsonl --org gh/kikeyama
+
+Other input settings are passed with ``--param``, e.g.
+``--param max_concurrency=8 --param engine=async``.
+"""
+
+from __future__ import absolute_import, print_function
+import argparse, hashlib, io, json, os, re, resource, shutil, subprocess, sys, tempfile, threading, time
+
+BIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin')
+sys.path.insert(0, BIN)
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from xml.sax.saxutils import escape
+
+import requests
+
+from synthetic import SyntheticOrg, add_shape_arguments, shape_from_args, shape_to_argv
+
+class Fixtures(object):
+    """Responses of CircleCI API from synthetic organizations of ``shape`` and
+    a recorded fixture."""
+    SYNTHETIC_ORG = re.compile(r'^jobs-([0-9]+)$')
+
+    def __init__(self, shape, recorded=None):
+        self.shape = shape
+        self.orgs = list()
+        self.recorded = dict()
+        if recorded is not None:
+            with open(recorded) as f:
+                for line in f:
+                    if line.strip():
+                        response = json.loads(line)
+                        self.recorded[self._key(response['path'], response.get('params') or {})] = response['body']
+
+    def _key(self, path, params):
+        return path + '?' + json.dumps(sorted(params.items()))
+
+    def respond(self, path, params):
+        # Returns (kind of request, body), where body is None if not found
+        params = dict((name, value) for name, value in params.items() if value)
+        if self._key(path, params) in self.recorded:
+            return 'recorded', self.recorded[self._key(path, params)]
+
+        # Synthetic organizations are created by the first pipelines request
+        if path == '/api/v2/pipeline':
+            vcs, _, org = params.get('org-slug', '').partition('/')
+            match = self.SYNTHETIC_ORG.match(org)
+            if match and not any(synthetic.vcs == vcs and synthetic.org == org for synthetic in self.orgs):
+                self.orgs.append(SyntheticOrg(vcs, org, int(match.group(1)), self.shape))
+        for synthetic in self.orgs:
+            kind, body = synthetic.respond(path, params)
+            if kind is not None:
+                return kind, body
+        return 'unknown', None
+
+
+class KVStore(object):
+    """KV Store collections of splunkd in memory."""
+    def __init__(self):
+        self.collections = dict()
+        self.lock = threading.Lock()
+
+    def entry(self, name):
+        # Atom entry of a collection configuration
+        return ('<entry><title>%s</title><id>/servicesNS/nobody/search/storage/collections/config/%s</id>'
+            '<link href="/servicesNS/nobody/search/storage/collections/config/%s" rel="alternate"/>'
+            '<author><name>nobody</name></author><content type="text/xml"><s:dict><s:key name="eai:acl"><s:dict>'
+            '<s:key name="app">search</s:key><s:key name="owner">nobody</s:key><s:key name="sharing">app</s:key>'
+            '</s:dict></s:key></s:dict></content></entry>') \
+            % (escape(name), escape(name), escape(name))
+
+    def feed(self, names):
+        return ('<?xml version="1.0" encoding="UTF-8"?><feed xmlns="http://www.w3.org/2005/Atom" '
+            'xmlns:s="http://dev.splunk.com/ns/rest"><title>collections-conf</title><totalResults>%d</totalResults>%s</feed>') \
+            % (len(names), ''.join(self.entry(name) for name in names))
+
+    def respond(self, method, path, body):
+        # Returns (kind of request, status, content type, body)
+        match = re.match(r'^/services(?:NS/[^/]+/[^/]+)?/storage/collections/(config|data)(?:/([^/]+))?(?:/([^/]+))?/?$', path)
+        if match is None:
+            return 'unknown', 404, 'application/json', '{}'
+        endpoint, name, action = [group and requests.utils.unquote(group) for group in match.groups()]
+        with self.lock:
+            if endpoint == 'config':
+                if method == 'POST':
+                    name = dict(pair.split('=', 1) for pair in body.decode('utf-8').split('&')).get('name')
+                    self.collections.setdefault(name, dict())
+                    return 'config', 201, 'text/xml', self.feed([name])
+                if name is None:
+                    return 'config', 200, 'text/xml', self.feed(sorted(self.collections))
+                if name not in self.collections:
+                    return 'config', 404, 'text/xml', '<response><messages><msg type="ERROR">Not Found</msg></messages></response>'
+                return 'config', 200, 'text/xml', self.feed([name])
+
+            documents = self.collections.setdefault(name, dict())
+            if action == 'batch_find':
+                results = list()
+                for query in json.loads(body.decode('utf-8')):
+                    keys = [condition.get('_key') for condition in query.get('query', dict()).get('$or', [query.get('query', dict())])]
+                    results.append([documents[key] for key in keys if key in documents])
+                return 'batch_find', 200, 'application/json', json.dumps(results)
+            if action == 'batch_save':
+                saved = json.loads(body.decode('utf-8'))
+                for document in saved:
+                    documents[document['_key']] = document
+                return 'batch_save', 200, 'application/json', json.dumps([document['_key'] for document in saved])
+            if method == 'GET' and action is not None:
+                if action not in documents:
+                    return 'query', 404, 'application/json', json.dumps({'messages': [{'type': 'ERROR', 'text': 'Could not find object.'}]})
+                return 'query', 200, 'application/json', json.dumps(documents[action])
+            if method == 'POST':
+                document = json.loads(body.decode('utf-8'))
+                key = action or document.get('_key')
+                documents[key] = dict(document, _key=key)
+                return 'insert' if action is None else 'update', 200, 'application/json', json.dumps({'_key': key})
+            return 'query', 200, 'application/json', json.dumps(list(documents.values()))
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port, fixtures):
+        HTTPServer.__init__(self, ('127.0.0.1', port), StubHandler)
+        self.fixtures = fixtures
+        self.kvstore = KVStore()
+        self.stats_lock = threading.Lock()
+        self.stats = dict()
+
+    def handle_error(self, request, client_address):
+        # Clients of a finished run close their keep-alive connections
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            HTTPServer.handle_error(self, request, client_address)
+
+    def count(self, name, value=1):
+        with self.stats_lock:
+            self.stats[name] = self.stats.get(name, 0) + value
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Body isn't delayed after headers by ACK of clients on keep-alive connections
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status, content_type, body, headers=None):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(data)))
+        # splunklib closes connections, and their responses, unless kept alive
+        self.send_header('Connection', 'Keep-Alive')
+        self.end_headers()
+        self.wfile.write(data)
+        return len(data)
+
+    def handle_request(self, method):
+        server = self.server
+        path, _, query = self.path.partition('?')
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+        if path == '/stub/stats':
+            with server.stats_lock:
+                stats, server.stats = server.stats, dict()
+            return self.reply(200, 'application/json', json.dumps(stats))
+
+        if path.startswith('/api/'):
+            params = dict(pair.split('=', 1) for pair in query.split('&') if '=' in pair)
+            params = dict((requests.utils.unquote(name), requests.utils.unquote(value)) for name, value in params.items())
+            kind, response = server.fixtures.respond(path, params)
+            server.count('api_' + kind)
+            if response is None:
+                return self.reply(404, 'application/json', json.dumps({'message': 'Not found'}))
+            # Unchanged responses answer conditional requests with 304
+            data = json.dumps(response)
+            etag = '"%s"' % hashlib.sha1(data.encode('utf-8')).hexdigest()
+            if self.headers.get('If-None-Match') == etag:
+                server.count('api_not_modified')
+                return self.reply(304, 'application/json', '', headers={'ETag': etag})
+            server.count('api_bytes', self.reply(200, 'application/json', data, headers={'ETag': etag}))
+            return
+
+        kind, status, content_type, response = server.kvstore.respond(method, path, body)
+        server.count('kv_' + kind)
+        self.reply(status, content_type, response)
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_DELETE(self):
+        self.handle_request('DELETE')
+
+
+def serve(args):
+    fixtures = Fixtures(shape_from_args(args), recorded=args.fixture)
+    server = StubServer(args.port, fixtures)
+    print('Stub server at http://127.0.0.1:%d' % server.server_address[1])
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+class CountingStream(object):
+    # Text stream which counts events or lines without keeping them
+    # Metrics events of runs are not counted in events
+    def __init__(self):
+        self.size = 0
+        self.events = 0
+        self.lines = 0
+
+    def write(self, text):
+        self.size += len(text)
+        self.events += text.count('</event>') - text.count('<sourcetype>circleci:collector:metrics</sourcetype>')
+        self.lines += text.count('\n')
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def run_input(args):
+    # Collect one organization like splunkd runs the input, and print results
+    from circleci import CircleCIScript
+    from circleci_writer import BufferedEventWriter
+
+    out, err = CountingStream(), CountingStream()
+    runs = list()
+
+    class BenchmarkScript(CircleCIScript):
+        # Run again at once while runs write events, and stop after a run
+        # without events or max_runs
+        def run_input(self, *a, **kwargs):
+            events = out.events
+            started = super(BenchmarkScript, self).run_input(*a, **kwargs)
+            runs.append(out.events - events)
+            if out.events == events or args.max_runs <= len(runs):
+                self._stop_event.set()
+                for listener in self._stop_event_listeners:
+                    listener()
+            return started - int(params['interval'])
+
+    vcs, org = args.org.split('/', 1)
+    params = dict(api_token='0' * 40, vcs=vcs, org=org, interval='6000')
+    params.update(dict(param.split('=', 1) for param in args.param))
+    checkpoint_dir = tempfile.mkdtemp(prefix='circleci_benchmark_')
+    definition = ('<input><server_host>benchmark</server_host><server_uri>%s</server_uri><session_key>benchmark</session_key>'
+        '<checkpoint_dir>%s</checkpoint_dir><configuration><stanza name="circleci://benchmark">%s</stanza></configuration></input>') \
+        % (escape(args.url), escape(checkpoint_dir), ''.join('<param name="%s">%s</param>' % (escape(name), escape(value)) \
+            for name, value in params.items()))
+
+    script = BenchmarkScript()
+    script.api_url = args.url + '/api'
+    started = time.time()
+    try:
+        status = script.run_script([sys.argv[0]], BufferedEventWriter(out, err), io.StringIO(definition))
+    finally:
+        shutil.rmtree(checkpoint_dir, ignore_errors=True)
+    elapsed = time.time() - started
+
+    print(json.dumps({'status': status, 'elapsed': elapsed, 'runs': len(runs), 'events': out.events, 'event_bytes': out.size,
+        'log_lines': err.lines, 'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}))
+    return status
+
+
+def start_stub(args):
+    command = [sys.executable, os.path.abspath(__file__), '--serve', '--port', '0'] + shape_to_argv(args)
+    if args.fixture:
+        command += ['--fixture', args.fixture]
+    stub = subprocess.Popen(command, stdout=subprocess.PIPE, universal_newlines=True)
+    url = stub.stdout.readline().split()[-1]
+    return stub, url
+
+
+def benchmark(args, url, org):
+    # Collect an organization in a new process, and returns its results with
+    # requests counted by the stub server
+    requests.get(url + '/stub/stats')
+    command = [sys.executable, os.path.abspath(__file__), '--run', '--url', url, '--org', org, '--max-runs', str(args.max_runs)]
+    for param in args.param:
+        command += ['--param', param]
+    output = subprocess.check_output(command, universal_newlines=True)
+    result = json.loads(output.strip().splitlines()[-1])
+    result['stats'] = requests.get(url + '/stub/stats').json()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--jobs', type=int, nargs='*', default=[10, 1000, 50000], help='jobs of synthetic organizations (default: 10 1000 50000)')
+    parser.add_argument('--fixture', help='JSON-lines file of recorded CircleCI API responses')
+    parser.add_argument('--org', help='organization of the recorded fixture (e.g. gh/kikeyama)')
+    parser.add_argument('--param', action='append', default=[], help='input setting as name=value')
+    parser.add_argument('--max-runs', type=int, default=5, help='runs of the input per organization at most (default: 5)')
+    add_shape_arguments(parser)
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--run', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, default=0, help=argparse.SUPPRESS)
+    parser.add_argument('--url', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        return serve(args)
+    if args.run:
+        return run_input(args)
+
+    orgs = ['gh/jobs-%d' % num_jobs for num_jobs in args.jobs]
+    if args.org:
+        orgs = [args.org]
+    stub, url = start_stub(args)
+    try:
+        results = [(org, benchmark(args, url, org)) for org in orgs]
+    finally:
+        stub.terminate()
+        stub.wait()
+
+    print('%-16s %5s %9s %7s %7s %9s %11s %11s %10s' % ('org', 'runs', 'wall (s)', 'api', 'kv', 'events', 'events/sec', 'api bytes', 'rss (MB)'))
+    for org, result in results:
+        stats = result['stats']
+        api_calls = sum(value for name, value in stats.items() if name.startswith('api_') and name not in ('api_bytes', 'api_not_modified'))
+        kv_calls = sum(value for name, value in stats.items() if name.startswith('kv_'))
+        print('%-16s %5d %9.2f %7d %7d %9d %11.0f %11d %10.1f' % (org, result['runs'], result['elapsed'], api_calls, kv_calls,
+            result['events'], result['events'] / result['elapsed'], stats.get('api_bytes', 0), result['peak_rss_kb'] / 1024.0))
+    for org, result in results:
+        print('%s requests: %s' % (org, ', '.join('%s=%s' % item for item in sorted(result['stats'].items()) if item[0] != 'api_bytes')))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
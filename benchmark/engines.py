@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+"""Equivalence check of the thread and async engines.
+
+Collects an organization from a recorded fixture of CircleCI API responses
+with ``engine = thread`` and ``engine = async``, each in a fresh process
+against a stub server of ``benchmark/collector.py`` with an empty KV Store,
+and fails unless both write byte-identical events and save identical
+checkpoint documents. The input runs ``--max-runs`` times, so checkpoints of
+a run are read by the next one. Metrics events of runs are not compared, and
+the current time of jobs and steps without end time is fixed. Run from the
+root of this app:
+
+    python benchmark/engines.py --fixture recorded.jsonl --org gh/kikeyama
+
+Without ``--fixture``, a fixture of a synthetic organization is written by
+``benchmark/synthetic.py`` with its shape options, e.g.
+
+    python benchmark/engines.py --jobs 500 --statuses success=80,failed=15,running=5
+"""
+
+from __future__ import absolute_import, print_function
+import argparse, datetime, io, json, os, re, subprocess, sys, tempfile, threading, types
+from xml.sax.saxutils import escape
+
+from collector import Fixtures, StubServer
+from synthetic import SyntheticOrg, add_shape_arguments, shape_from_args
+
+ENGINES = ('thread', 'async')
+
+# Metrics events of runs differ in their durations and latencies
+METRICS_EVENT = re.compile(r'<event [^>]*><time>[^<]*</time><sourcetype>circleci:collector:metrics</sourcetype>.*?</event>', re.S)
+
+
+class FrozenDatetime(datetime.datetime):
+    # Time of jobs and steps which are not finished
+    @classmethod
+    def utcnow(cls):
+        return cls(2020, 7, 28, 12, 0, 0)
+
+
+def run_input(args):
+    # Run the input with an engine, and write its events to args.out
+    from circleci import CircleCIScript
+    import circleci
+    from circleci_writer import BufferedEventWriter
+
+    frozen = types.ModuleType('datetime')
+    frozen.__dict__.update(datetime.__dict__)
+    frozen.datetime = FrozenDatetime
+    circleci.datetime = frozen
+
+    out, err = io.StringIO(), io.StringIO()
+    runs = list()
+
+    class EngineScript(CircleCIScript):
+        # Run again at once until max_runs
+        def run_input(self, *a, **kwargs):
+            started = super(EngineScript, self).run_input(*a, **kwargs)
+            runs.append(started)
+            if args.max_runs <= len(runs):
+                self._stop_event.set()
+                for listener in self._stop_event_listeners:
+                    listener()
+            return started - int(params['interval'])
+
+    vcs, org = args.org.split('/', 1)
+    params = dict(api_token='0' * 40, vcs=vcs, org=org, interval='6000', engine=args.engine)
+    params.update(dict(param.split('=', 1) for param in args.param))
+    checkpoint_dir = tempfile.mkdtemp(prefix='circleci_engines_')
+    definition = ('<input><server_host>engines</server_host><server_uri>%s</server_uri><session_key>engines</session_key>'
+        '<checkpoint_dir>%s</checkpoint_dir><configuration><stanza name="circleci://engines">%s</stanza></configuration></input>') \
+        % (escape(args.url), escape(checkpoint_dir), ''.join('<param name="%s">%s</param>' % (escape(name), escape(value)) \
+            for name, value in params.items()))
+
+    script = EngineScript()
+    script.api_url = args.url + '/api'
+    status = script.run_script([sys.argv[0]], BufferedEventWriter(out, err), io.StringIO(definition))
+    with io.open(args.out, 'w', encoding='utf-8') as f:
+        f.write(METRICS_EVENT.sub('', out.getvalue()))
+    errors = [line for line in err.getvalue().splitlines() if line.startswith('ERROR')]
+    for line in errors:
+        print(line, file=sys.stderr)
+    return status or (1 if errors else 0)
+
+
+def collect(args, fixture, engine, out):
+    # Collect the organization with engine against a new stub server, and
+    # returns checkpoint documents saved in its KV Store
+    server = StubServer(0, Fixtures(shape_from_args(args), recorded=fixture))
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        command = [sys.executable, os.path.abspath(__file__), '--run', '--engine', engine, '--out', out,
+            '--url', 'http://127.0.0.1:%d' % server.server_address[1], '--org', args.org, '--max-runs', str(args.max_runs)]
+        for param in args.param:
+            command += ['--param', param]
+        subprocess.check_call(command)
+    finally:
+        server.shutdown()
+        server.server_close()
+    return server.kvstore.collections
+
+
+def first_difference(a, b):
+    # Returns the offset of the first difference, and text around it in a
+    # and b
+    offset = next((i for i, (x, y) in enumerate(zip(a, b)) if x != y), min(len(a), len(b)))
+    return offset, a[max(offset - 80, 0):offset + 80], b[max(offset - 80, 0):offset + 80]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fixture', help='JSON-lines file of recorded CircleCI API responses')
+    parser.add_argument('--org', default='gh/engines', help='organization of the fixture (default: gh/engines)')
+    parser.add_argument('--jobs', type=int, default=300, help='jobs of the synthetic organization without --fixture (default: 300)')
+    parser.add_argument('--param', action='append', default=[], help='input setting as name=value')
+    parser.add_argument('--max-runs', type=int, default=2, help='runs of the input per engine (default: 2)')
+    add_shape_arguments(parser)
+    parser.add_argument('--run', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--engine', help=argparse.SUPPRESS)
+    parser.add_argument('--url', help=argparse.SUPPRESS)
+    parser.add_argument('--out', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        return run_input(args)
+
+    work_dir = tempfile.mkdtemp(prefix='circleci_engines_')
+    fixture = args.fixture
+    if fixture is None:
+        vcs, org = args.org.split('/', 1)
+        fixture = os.path.join(work_dir, 'fixture.jsonl')
+        with io.open(fixture, 'w', encoding='utf-8') as f:
+            for path, params, body in SyntheticOrg(vcs, org, args.jobs, shape_from_args(args)).iter_responses():
+                f.write(json.dumps({'path': path, 'params': params, 'body': body}) + u'\n')
+
+    outputs = dict()
+    checkpoints = dict()
+    for engine in ENGINES:
+        out = os.path.join(work_dir, '%s.xml' % engine)
+        checkpoints[engine] = json.dumps(collect(args, fixture, engine, out), sort_keys=True, indent=1)
+        with io.open(out, 'r', encoding='utf-8') as f:
+            outputs[engine] = f.read()
+
+    failed = False
+    for name, results in (('events', outputs), ('checkpoints', checkpoints)):
+        thread_result, async_result = results['thread'], results['async']
+        if thread_result == async_result:
+            print('%-12s identical (%d bytes)' % (name, len(thread_result)))
+            continue
+        failed = True
+        offset, thread_text, async_text = first_difference(thread_result, async_result)
+        print('%-12s differ at %d (thread %d bytes, async %d bytes)' % (name, offset, len(thread_result), len(async_result)))
+        print('  thread: %r' % thread_text)
+        print('  async:  %r' % async_text)
+
+    print('events: %d' % outputs['thread'].count('</event>'))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+"""Equivalence check and throughput benchmark of serialize_event and
+EventTemplate.
+
+First renders random events, including XML special characters, characters
+out of ASCII, empty and missing fields, with ``Event.write_to``,
+``serialize_event`` and ``EventTemplate.serialize``, and fails unless every
+output is identical. Then prints events/sec of the serializers for job and
+step events of the CircleCI modular input. Run from the root of this app:
+
+    python benchmark/event_serializer.py --cases 20000 --events 50000
+"""
+
+from __future__ import absolute_import, print_function
+import argparse, io, json, os, random, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin'))
+
+from splunklib.modularinput import Event
+from circleci_writer import EventTemplate, serialize_event
+
+# Characters which ElementTree escapes, and characters out of ASCII
+ALPHABET = u'abc XYZ 019 &<>"\'\r\n\t;#üéあ☃\U0001f600'
+
+
+def random_text(rng):
+    if rng.random() < 0.1:
+        return u''
+    return u''.join(rng.choice(ALPHABET) for i in range(rng.randint(1, 40)))
+
+
+def random_event(rng):
+    # Each field is missing, empty, or random text
+    def field():
+        return None if rng.random() < 0.3 else random_text(rng)
+
+    return Event(
+        data=random_text(rng) if rng.random() < 0.5 else json.dumps({'name': random_text(rng)}),
+        stanza=field(),
+        time=rng.choice([None, '%.3f' % (rng.random() * 2e9), rng.randint(0, 2000000000)]),
+        host=field(),
+        index=field(),
+        source=field(),
+        sourcetype=field(),
+        done=rng.random() < 0.8,
+        unbroken=rng.random() < 0.8)
+
+
+def render_etree(event):
+    stream = io.StringIO()
+    event.write_to(stream)
+    return stream.getvalue()
+
+
+def check_equivalence(cases, seed):
+    rng = random.Random(seed)
+    for i in range(cases):
+        event = random_event(rng)
+        expected = render_etree(event)
+        template = EventTemplate(stanza=event.stanza, host=event.host, index=event.index, source=event.source, 
+            sourcetype=event.sourceType, done=event.done, unbroken=event.unbroken)
+        for name, actual in (('serialize_event', serialize_event(event)), 
+                ('EventTemplate', template.serialize(event.data, event.time))):
+            if expected != actual:
+                print('MISMATCH case=%d\n  etree: %r\n  %s: %r' % (i, expected, name, actual))
+                return False
+    print('%d random events are serialized identically (seed=%d)' % (cases, seed))
+    return True
+
+
+def make_events(count):
+    # Job events with large JSON and step events, like the modular input
+    events = list()
+    for i in range(count):
+        event = Event(stanza='circleci://benchmark', host='circleci.com', sourcetype='circleci:step')
+        if i % 20 == 0:
+            event.sourceType = 'circleci:job'
+            event.data = json.dumps({
+                'job_name': 'build <%d>' % i,
+                'build_url': 'https://circleci.com/gh/org/repo/%d' % i,
+                'steps': [{'name': 'step %d' % j, 'status': 'success'} for j in range(50)],
+                'vcs': {'subject': u'Fix ü & <tags>', 'revision': 'abc%d' % i}
+            })
+        else:
+            event.data = json.dumps({
+                'name': 'Run tests <%d>' % i,
+                'status': 'success',
+                'step_time': '2020-07-28T10:48:00.000Z',
+                'job_id': 'job-%d' % (i // 20)
+            })
+        events.append(event)
+    return events
+
+
+def measure(serializer, events):
+    started = time.time()
+    for event in events:
+        serializer(event)
+    return len(events) / (time.time() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cases', type=int, default=20000, help='number of random events to compare (default: 20000)')
+    parser.add_argument('--events', type=int, default=50000, help='number of events to serialize (default: 50000)')
+    parser.add_argument('--seed', type=int, default=0, help='random seed (default: 0)')
+    args = parser.parse_args()
+
+    if not check_equivalence(args.cases, args.seed):
+        return 1
+
+    events = make_events(args.events)
+    templates = dict((sourcetype, EventTemplate(stanza='circleci://benchmark', host='circleci.com', sourcetype=sourcetype)) \
+        for sourcetype in ('circleci:job', 'circleci:step'))
+    serialize_template = lambda event: templates[event.sourceType].serialize(event.data)
+
+    results = [
+        ('Event.write_to', measure(render_etree, events)),
+        ('serialize_event', measure(serialize_event, events)),
+        ('EventTemplate', measure(serialize_template, events))
+    ]
+    for name, events_per_sec in results:
+        print('%-20s %10.0f events/sec %6.2fx' % (name, events_per_sec, events_per_sec / results[0][1]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
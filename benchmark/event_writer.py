@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+"""Micro-benchmark of EventWriter and BufferedEventWriter.
+
+Writes step events like those of the CircleCI modular input to a pipe and
+prints events/sec of each writer, with log lines in between as the input
+does. Run from the root of this app:
+
+    python benchmark/event_writer.py --events 50000
+"""
+
+from __future__ import absolute_import, print_function
+import argparse, io, json, os, subprocess, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin'))
+
+from splunklib.modularinput import Event, EventWriter
+from circleci_writer import BufferedEventWriter
+
+
+def make_event(i):
+    event = Event()
+    event.stanza = 'circleci://benchmark'
+    event.host = 'circleci.com'
+    event.sourceType = 'circleci:step'
+    event.data = json.dumps({
+        'allocation_id': 'a%d' % i,
+        'step': i % 20,
+        'index': 0,
+        'name': 'Run tests <%d>' % i,
+        'status': 'success',
+        'end_time': '2020-07-28T10:48:00.000Z',
+        'start_time': '2020-07-28T10:47:00.000Z',
+        'step_time': '2020-07-28T10:48:00.000Z',
+        'job_id': 'job-%d' % (i // 20),
+        'job_name': 'test'
+    })
+    return event
+
+
+# Reads stdin to the end like splunkd reading the input
+DRAIN = 'import sys\nwhile sys.stdin.buffer.read1(65536):\n    pass'
+
+
+def open_pipe():
+    # Returns a text stream to a pipe, and the process reading it
+    reader = subprocess.Popen([sys.executable, '-c', DRAIN], stdin=subprocess.PIPE)
+    return io.TextIOWrapper(reader.stdin), reader
+
+
+def run(writer_class, events, out, err, **kwargs):
+    ew = writer_class(out, err, **kwargs)
+    started = time.time()
+    for i, event in enumerate(events):
+        ew.write_event(event)
+        if i % 20 == 0:
+            ew.log('INFO', 'Finish processing job event: build_num=%d' % (i // 20))
+    ew.close()
+    return len(events) / (time.time() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=50000, help='number of events (default: 50000)')
+    parser.add_argument('--flush-size', type=int, default=65536, help='flush size of BufferedEventWriter (default: 65536)')
+    args = parser.parse_args()
+
+    events = [make_event(i) for i in range(args.events)]
+
+    results = list()
+    for name, writer_class, kwargs in [
+        ('EventWriter', EventWriter, {}),
+        ('BufferedEventWriter', BufferedEventWriter, {'flush_size': args.flush_size, 'serializer': 'etree'}),
+        ('+ serialize_event', BufferedEventWriter, {'flush_size': args.flush_size, 'serializer': 'template'})
+    ]:
+        # Write to pipes drained by other processes like stdout and stderr
+        # of the input read by splunkd
+        out, out_reader = open_pipe()
+        err, err_reader = open_pipe()
+        results.append((name, run(writer_class, events, out, err, **kwargs)))
+        for stream, reader in ((out, out_reader), (err, err_reader)):
+            stream.close()
+            reader.wait()
+
+    for name, events_per_sec in results:
+        print('%-20s %10.0f events/sec %6.2fx' % (name, events_per_sec, events_per_sec / results[0][1]))
+
+
+if __name__ == '__main__':
+    main()
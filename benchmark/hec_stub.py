@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+"""Stub HTTP Event Collector, and a check of the `hec` output mode against it.
+
+The stub accepts gzip-compressed batches at /services/collector/event, checks
+the HEC token, and acknowledges them at /services/collector/ack after
+``--ack-delay`` seconds. ``--busy-rate`` of requests fail with 503 (server
+busy) to exercise retries.
+
+Without ``--serve``, sends step and job events through ``HECEventWriter``
+with and without indexer acknowledgement, fails unless the stub received
+every event once and in order with its time and fields, including the
+``index`` of the input, then prints
+events/sec against ``BufferedEventWriter`` writing XML to a pipe, both until
+events are written by the collecting thread and until they are received by
+the stub. Run from the root of this app:
+
+    python benchmark/hec_stub.py --events 50000
+
+With ``--serve``, runs the stub until interrupted, to point an input at it
+with ``output_mode = hec``, ``hec_url = http://localhost:8088`` and
+``hec_token = 00000000-0000-0000-0000-000000000000``:
+
+    python benchmark/hec_stub.py --serve --port 8088 --verbose
+"""
+
+from __future__ import absolute_import, print_function
+import argparse, gzip, json, os, random, subprocess, sys, threading, time
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin'))
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import circleci_hec
+from circleci_hec import HECEventWriter, HECSender
+from circleci_writer import BufferedEventWriter, EventTemplate
+
+TOKEN = '00000000-0000-0000-0000-000000000000'
+
+
+class StubHEC(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port, ack_delay=0.0, busy_rate=0.0, verbose=False):
+        HTTPServer.__init__(self, ('127.0.0.1', port), StubHandler)
+        self.ack_delay = ack_delay
+        self.busy_rate = busy_rate
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.events = list()
+        self.requests = 0
+        self.busy = 0
+        # Time each ack id is indexed at, by channel
+        self.acks = dict()
+
+    def decode(self, body):
+        # HEC accepts JSON events one after another
+        decoder = json.JSONDecoder()
+        text = body.decode('utf-8')
+        events = list()
+        position = 0
+        while position < len(text):
+            while position < len(text) and text[position].isspace():
+                position += 1
+            if position < len(text):
+                event, position = decoder.raw_decode(text, position)
+                events.append(event)
+        return events
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def reply(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.headers.get('Authorization') != 'Splunk %s' % TOKEN:
+            return self.reply(403, {'text': 'Invalid token', 'code': 4})
+        channel = self.headers.get('X-Splunk-Request-Channel')
+
+        # Received events are read and cleared by the check
+        if self.path == '/stub/events':
+            with server.lock:
+                events, server.events = server.events, list()
+                stats = {'requests': server.requests, 'busy': server.busy}
+            return self.reply(200, {'events': events, 'stats': stats})
+
+        with server.lock:
+            server.requests += 1
+            if random.random() < server.busy_rate:
+                server.busy += 1
+                return self.reply(503, {'text': 'Server is busy', 'code': 9})
+
+        path = self.path.split('?')[0]
+        if path == '/services/collector/ack':
+            now = time.time()
+            with server.lock:
+                indexed = server.acks.get(channel, dict())
+                acks = dict((str(ack_id), indexed.get(ack_id, now + 1) <= now) for ack_id in json.loads(body)['acks'])
+            return self.reply(200, {'acks': acks})
+
+        if path != '/services/collector/event':
+            return self.reply(404, {'text': 'The requested URL was not found on this server.', 'code': 404})
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        try:
+            events = server.decode(body)
+        except ValueError:
+            return self.reply(400, {'text': 'Invalid data format', 'code': 6})
+
+        with server.lock:
+            server.events.extend(events)
+            indexed = server.acks.setdefault(channel, dict())
+            ack_id = len(indexed)
+            indexed[ack_id] = time.time() + server.ack_delay
+        return self.reply(200, {'text': 'Success', 'code': 0, 'ackId': ack_id})
+
+
+def start_stub(args):
+    # Runs the stub in another process like splunkd, and returns its URL
+    port = args.port
+    if not port:
+        probe = HTTPServer(('127.0.0.1', 0), BaseHTTPRequestHandler)
+        port = probe.server_address[1]
+        probe.server_close()
+    command = [sys.executable, os.path.abspath(__file__), '--serve', '--port', str(port), 
+        '--ack-delay', str(args.ack_delay), '--busy-rate', str(args.busy_rate)]
+    stub = subprocess.Popen(command + (['--verbose'] if args.verbose else []))
+    url = 'http://127.0.0.1:%d' % port
+    for i in range(100):
+        try:
+            read_stub(url)
+            return stub, url
+        except requests.exceptions.ConnectionError:
+            time.sleep(0.1)
+    raise RuntimeError('Stub HTTP Event Collector did not start at %s' % url)
+
+
+def read_stub(url):
+    # Returns events received by the stub since the last call, and its stats
+    response = requests.post(url + '/stub/events', headers={'Authorization': 'Splunk %s' % TOKEN})
+    response.raise_for_status()
+    result = response.json()
+    return result['events'], result['stats']
+
+
+class NullWriter(object):
+    # Log lines of the input are not checked
+    def log(self, severity, message):
+        pass
+
+    def flush(self):
+        pass
+
+
+def make_events(count):
+    # (sourcetype, data, time) of step events and a job event per 20 steps
+    events = list()
+    for i in range(count):
+        if i % 20 == 0:
+            data = {'job_name': u'build <%d> ü' % i, 'steps': [{'name': 'step %d' % j} for j in range(20)]}
+            events.append(('circleci:job', json.dumps(data), '%d.%03d' % (1595933280 + i, i % 1000)))
+        else:
+            data = {'name': 'Run tests "%d"' % i, 'status': 'success', 'job_id': 'job-%d' % (i // 20)}
+            events.append(('circleci:step', json.dumps(data), '%d.%03d' % (1595933280 + i, i % 1000)))
+    return events
+
+
+def make_templates():
+    return dict((sourcetype, EventTemplate(stanza='circleci://benchmark', host='circleci.com', sourcetype=sourcetype)) \
+        for sourcetype in ('circleci:job', 'circleci:step'))
+
+
+def check(url, events, ack, batch_size, index):
+    # Send events through HECEventWriter, and returns events/sec until all
+    # are written and until all are sent (and acknowledged), if the stub
+    # received all of them
+    read_stub(url)
+    sender = HECSender(url=url, token=TOKEN, ack=ack, queue_size=8, max_retries=10)
+    sender._retry.backoff = 0.01
+    templates = make_templates()
+
+    started = time.time()
+    ew = HECEventWriter(ew=NullWriter(), sender=sender, batch_size=batch_size, index=index)
+    for sourcetype, data, event_time in events:
+        ew.write_template(templates[sourcetype], data, event_time)
+    written = time.time() - started
+    ew.flush()
+    elapsed = time.time() - started
+    sender.close()
+
+    received, stats = read_stub(url)
+    expected = [{'host': 'circleci.com', 'source': 'hec:circleci://benchmark', 'sourcetype': sourcetype, 'index': index,
+        'time': float(event_time), 'event': json.loads(data)} for sourcetype, data, event_time in events]
+    if received != expected:
+        mismatch = next((i for i, (a, b) in enumerate(zip(received, expected)) if a != b), min(len(received), len(expected)))
+        print('MISMATCH ack=%s received=%d expected=%d at=%d' % (ack, len(received), len(expected), mismatch))
+        return None
+    num_events, num_batches, num_resent, num_bytes = sender.pop_stats()
+    print('ack=%-5s %d events received once and in order: batches=%d resent=%d bytes=%d failures=%d' \
+        % (ack, len(received), num_batches, num_resent, num_bytes, sender.failures))
+    return len(events) / written, len(events) / elapsed
+
+
+def measure_xml(events):
+    # BufferedEventWriter writing to a pipe drained by another process
+    reader = subprocess.Popen([sys.executable, '-c', 'import sys\nwhile sys.stdin.buffer.read1(65536):\n    pass'],
+        stdin=subprocess.PIPE)
+    out = open(reader.stdin.fileno(), 'w', closefd=False)
+    ew = BufferedEventWriter(out, open(os.devnull, 'w'))
+    templates = make_templates()
+    started = time.time()
+    for sourcetype, data, event_time in events:
+        ew.write_template(templates[sourcetype], data, event_time)
+    ew.flush()
+    elapsed = time.time() - started
+    reader.stdin.close()
+    reader.wait()
+    return len(events) / elapsed, len(events) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--serve', action='store_true', help='run the stub until interrupted')
+    parser.add_argument('--port', type=int, default=0, help='port of the stub (default: any free port, 8088 with --serve)')
+    parser.add_argument('--ack-delay', type=float, default=0.2, help='seconds until batches are acknowledged (default: 0.2)')
+    parser.add_argument('--busy-rate', type=float, default=0.05, help='ratio of requests failed with 503 (default: 0.05)')
+    parser.add_argument('--events', type=int, default=50000, help='number of events to send (default: 50000)')
+    parser.add_argument('--batch-size', type=int, default=1048576, help='hec_batch_size (default: 1048576)')
+    parser.add_argument('--index', default='circleci', help='index of the input, which events are sent to (default: circleci)')
+    parser.add_argument('--verbose', action='store_true', help='log requests to the stub')
+    args = parser.parse_args()
+
+    if args.serve:
+        stub = StubHEC(args.port or 8088, ack_delay=args.ack_delay, busy_rate=args.busy_rate, verbose=args.verbose)
+        print('Stub HTTP Event Collector at http://127.0.0.1:%d token=%s' % (stub.server_address[1], TOKEN))
+        try:
+            stub.serve_forever()
+        except KeyboardInterrupt:
+            print('%d events received, %d requests, %d busy' % (len(stub.events), stub.requests, stub.busy))
+        return 0
+
+    circleci_hec.ACK_POLL_INTERVAL = min(circleci_hec.ACK_POLL_INTERVAL, args.ack_delay or 0.05)
+    stub, url = start_stub(args)
+    events = make_events(args.events)
+
+    try:
+        results = [('BufferedEventWriter', measure_xml(events))]
+        for ack in (False, True):
+            events_per_sec = check(url, events, ack, args.batch_size, args.index)
+            if events_per_sec is None:
+                return 1
+            results.append(('HECEventWriter ack=%s' % ack, events_per_sec))
+        stats = read_stub(url)[1]
+        print('%d requests to the stub, %d failed with 503' % (stats['requests'], stats['busy']))
+    finally:
+        stub.terminate()
+        stub.wait()
+
+    # Written: events/sec of the thread writing events, which collects data
+    # in the input; Sent: until the stub received (and acknowledged) them
+    print('%-25s %28s %28s' % ('', 'Written', 'Sent'))
+    for name, (written, sent) in results:
+        print('%-25s %10.0f events/sec %6.2fx %10.0f events/sec %6.2fx' \
+            % (name, written, written / results[0][1][0], sent, sent / results[0][1][1]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""CPU time of logging while writing a fixture of 50,000 step events.
+
+Runs ``CircleCIScript.process_job`` over jobs of API v1.1 job detail with
+``LeveledLogger`` at each level, and prints CPU seconds and log lines. Level
+``DEBUG`` formats and writes every log line like the input did before log
+levels. Events and logs are written with ``BufferedEventWriter`` to
+``os.devnull``. Run from the root of this app:
+
+    python benchmark/logger.py --jobs 50 --steps 1000
+"""
+
+from __future__ import absolute_import, print_function
+import argparse, copy, os, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bin'))
+
+from circleci import CircleCIScript
+from circleci_checkpoint import CheckpointBuffer
+from circleci_logger import LeveledLogger
+from circleci_writer import BufferedEventWriter, EventTemplate
+
+
+class NullCollection(object):
+    # KV Store collection which drops checkpoints
+    name = '_circleci_job_checkpoint_collection'
+
+    def __init__(self):
+        self.data = self
+
+    def batch_save(self, *documents):
+        pass
+
+
+class CountingStream(object):
+    # Text stream to os.devnull which counts lines
+    def __init__(self):
+        self.stream = open(os.devnull, 'w')
+        self.lines = 0
+
+    def write(self, text):
+        self.lines += text.count('\n')
+        self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+
+def make_jobs(num_jobs, num_steps):
+    # (job, job_detail) with num_steps actions per job
+    jobs = list()
+    for i in range(num_jobs):
+        job = {'job_number': i, 'project_slug': 'gh/org/repo', 'status': 'success'}
+        job_detail = {
+            'username': 'org', 'reponame': 'repo', 'build_num': i, 'status': 'success',
+            'stop_time': '2020-07-28T10:48:00.000Z', 'start_time': '2020-07-28T10:40:00.000Z',
+            'build_url': 'https://circleci.com/gh/org/repo/%d' % i, 'branch': 'master',
+            'workflows': {'job_id': 'job-%d' % i, 'job_name': 'test'},
+            'steps': [{'name': 'step %d' % j, 'actions': [{
+                'allocation_id': 'alloc-%d' % i, 'step': j, 'index': 0, 'name': 'Run tests %d' % j,
+                'status': 'success', 'start_time': '2020-07-28T10:47:00.000Z', 'end_time': '2020-07-28T10:48:00.000Z'
+            }]} for j in range(num_steps)]
+        }
+        jobs.append((job, job_detail))
+    return jobs
+
+
+def run(script, jobs, level):
+    # Returns CPU seconds and log lines of writing events of jobs
+    jobs = copy.deepcopy(jobs)
+    err = CountingStream()
+    ew = BufferedEventWriter(open(os.devnull, 'w'), err)
+    logger = LeveledLogger(ew, level=level, repeat_limit=0 if level == 'DEBUG' else 100)
+    collection = NullCollection()
+    checkpoint_buffer = CheckpointBuffer(ew=logger, batch_size=500)
+    event_templates = dict((sourcetype, EventTemplate(stanza='circleci://benchmark', host='circleci.com', sourcetype=sourcetype)) \
+        for sourcetype in ('circleci:job', 'circleci:step'))
+
+    started = time.process_time()
+    for job, job_detail in jobs:
+        script.process_job(
+            job=job,
+            job_checkpoint_data={'_key': job_detail['workflows']['job_id'], 'status': None},
+            job_detail=job_detail,
+            event_templates=event_templates,
+            job_kvstore_collection=collection,
+            checkpoint_buffer=checkpoint_buffer,
+            ew=logger)
+    checkpoint_buffer.flush()
+    logger.summary('circleci://benchmark')
+    ew.flush()
+    return time.process_time() - started, err.lines, logger.events.get('circleci:step', 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--jobs', type=int, default=50, help='number of jobs (default: 50)')
+    parser.add_argument('--steps', type=int, default=1000, help='number of steps per job (default: 1000)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per level, the fastest is printed (default: 3)')
+    args = parser.parse_args()
+
+    script = CircleCIScript()
+    jobs = make_jobs(args.jobs, args.steps)
+    results = list()
+    for level in ('DEBUG', 'INFO', 'WARN'):
+        runs = [run(script, jobs, level) for i in range(args.repeat)]
+        results.append((level, min(runs)))
+
+    for level, (cpu_seconds, lines, steps) in results:
+        print('log_level=%-5s %8.3f CPU seconds %8d log lines %6d steps %6.2fx' \
+            % (level, cpu_seconds, lines, steps, results[0][1][0] / cpu_seconds))
+
+
+if __name__ == '__main__':
+    main()
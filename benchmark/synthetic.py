@@ -0,0 +1,354 @@
+#!/usr/bin/env python
+"""Synthetic CircleCI organizations for scale testing.
+
+``SyntheticOrg`` generates pages of API v2 pipelines, workflows and jobs, and
+API v1.1 job details of an organization with any number of jobs, on request
+and without keeping them in memory. The shape of the organization is set by
+``OrgShape``: workflows per pipeline, jobs per workflow, steps per job,
+actions per step (parallelism), page size of list endpoints, and the mix of
+job statuses. Pages are chained by opaque ``next_page_token`` like CircleCI
+API, and the same organization is generated for the same shape and seed.
+
+``benchmark/collector.py`` serves synthetic organizations from its stub
+server. Without it, this script writes an organization as a recorded fixture
+of JSON lines, which the stub server replays with ``--fixture``:
+
+    python benchmark/synthetic.py --jobs 1000 --org gh/big --steps 20 \\
+        --statuses success=80,failed=15,running=5 > big.jsonl
+"""
+
+from __future__ import absolute_import, print_function
+import argparse, base64, json, random, re, sys, time
+
+# Time of the latest pipeline of synthetic organizations
+BASE_TIME = 1595930400
+
+# Job statuses of CircleCI API v2, and their lifecycle in API v1.1
+LIFECYCLES = {
+    'success': 'finished', 'failed': 'finished', 'canceled': 'finished', 'infrastructure_fail': 'finished',
+    'timedout': 'finished', 'running': 'running', 'queued': 'queued', 'on_hold': 'not_run',
+    'blocked': 'not_run', 'not_run': 'not_run'
+}
+
+# Workflow status of jobs in the order of precedence
+WORKFLOW_STATUSES = (('running', 'running'), ('queued', 'running'), ('on_hold', 'on_hold'), ('failed', 'failed'),
+    ('infrastructure_fail', 'failed'), ('timedout', 'failed'), ('canceled', 'canceled'))
+
+
+def timestamp(seconds, millis=True):
+    text = time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(BASE_TIME + seconds))
+    return text + ('.000Z' if millis else 'Z')
+
+
+def parse_statuses(text):
+    # Returns weights by status from "success=80,failed=15,running=5"
+    statuses = dict()
+    for item in text.split(','):
+        status, _, weight = item.strip().partition('=')
+        if status not in LIFECYCLES:
+            raise ValueError('Unknown job status: %s' % status)
+        statuses[status] = float(weight or 1)
+    return statuses
+
+
+class OrgShape(object):
+    """Shape of synthetic organizations."""
+    def __init__(self, workflows_per_pipeline=2, jobs_per_workflow=5, steps_per_job=5, actions_per_step=1,
+            page_size=20, statuses=None, seed=0):
+        self.workflows_per_pipeline = workflows_per_pipeline
+        self.jobs_per_workflow = jobs_per_workflow
+        self.steps_per_job = steps_per_job
+        self.actions_per_step = actions_per_step
+        self.page_size = page_size
+        # Weights of job statuses
+        self.statuses = statuses or {'success': 1}
+        self.seed = seed
+
+
+class SyntheticOrg(object):
+    """Organization ``org`` of ``num_jobs`` jobs in ``vcs``.
+
+    Pipeline ``p`` is the ``p``-th latest, created a minute before the one
+    after it, and jobs are numbered from the latest pipeline. Ids encode the
+    position of items, so that any page or job detail is generated alone.
+    """
+    def __init__(self, vcs, org, num_jobs, shape=None):
+        self.vcs = vcs
+        self.org = org
+        self.num_jobs = num_jobs
+        self.shape = shape or OrgShape()
+        self.project_slug = '%s/%s/repo' % (vcs, org)
+        self.jobs_per_pipeline = self.shape.workflows_per_pipeline * self.shape.jobs_per_workflow
+        self.num_pipelines = (num_jobs + self.jobs_per_pipeline - 1) // self.jobs_per_pipeline
+
+        statuses = sorted(self.shape.statuses.items())
+        total = float(sum(weight for status, weight in statuses))
+        self._status_names = [status for status, weight in statuses]
+        self._status_bounds = list()
+        bound = 0.0
+        for status, weight in statuses:
+            bound += weight / total
+            self._status_bounds.append(bound)
+
+    def job_status(self, n):
+        # Status of job n, the same every time for the seed
+        value = random.Random('%s:%s:%d' % (self.shape.seed, self.org, n)).random()
+        for status, bound in zip(self._status_names, self._status_bounds):
+            if value < bound:
+                return status
+        return self._status_names[-1]
+
+    def workflow_status(self, p, w):
+        statuses = set(self.job_status(n) for n in self.job_numbers(p, w))
+        for job_status, workflow_status in WORKFLOW_STATUSES:
+            if job_status in statuses:
+                return workflow_status
+        return 'success'
+
+    def job_numbers(self, p, w):
+        first = p * self.jobs_per_pipeline + w * self.shape.jobs_per_workflow + 1
+        return range(first, min(first + self.shape.jobs_per_workflow, self.num_jobs + 1))
+
+    def position(self, n):
+        # (pipeline, workflow) of job n
+        index = n - 1
+        return index // self.jobs_per_pipeline, index % self.jobs_per_pipeline // self.shape.jobs_per_workflow
+
+    def num_workflows(self, p):
+        remaining = self.num_jobs - p * self.jobs_per_pipeline
+        return min(self.shape.workflows_per_pipeline, (remaining + self.shape.jobs_per_workflow - 1) // self.shape.jobs_per_workflow)
+
+    def page_token(self, kind, offset):
+        # Opaque token of the page from offset
+        text = '%s:%s:%d' % (self.org, kind, offset)
+        return base64.urlsafe_b64encode(text.encode('utf-8')).decode('ascii').rstrip('=')
+
+    def page_offset(self, kind, token):
+        # Returns offset of the page of token, or None if it isn't a token of
+        # kind in this organization
+        if not token:
+            return 0
+        try:
+            text = base64.urlsafe_b64decode((token + '=' * (-len(token) % 4)).encode('ascii')).decode('utf-8')
+            org, token_kind, offset = text.rsplit(':', 2)
+            if org == self.org and token_kind == kind:
+                return int(offset)
+        except (ValueError, TypeError):
+            pass
+        return None
+
+    def page(self, kind, count, item, params):
+        # Page of items from item(0) to item(count - 1) at page-token
+        start = self.page_offset(kind, params.get('page-token'))
+        if start is None:
+            return None
+        end = min(start + self.shape.page_size, count)
+        return {
+            'items': [item(i) for i in range(start, end)],
+            'next_page_token': self.page_token(kind, end) if end < count else None
+        }
+
+    def pipeline(self, p):
+        return {
+            'id': '%s.p%d' % (self.org, p), 'errors': [], 'project_slug': self.project_slug,
+            'updated_at': timestamp(-60 * p), 'number': self.num_pipelines - p, 'state': 'created',
+            'created_at': timestamp(-60 * p),
+            'trigger': {'type': 'webhook', 'received_at': timestamp(-60 * p), 'actor': {'login': 'user', 'avatar_url': None}},
+            'vcs': {'origin_repository_url': 'https://github.com/%s/repo' % self.org, 'target_repository_url': 'https://github.com/%s/repo' % self.org,
+                'revision': '%040x' % p, 'provider_name': 'GitHub', 'branch': 'master',
+                'commit': {'body': '', 'subject': 'Commit %d' % p}}
+        }
+
+    def workflow(self, p, w):
+        status = self.workflow_status(p, w)
+        return {
+            'pipeline_id': '%s.p%d' % (self.org, p), 'id': '%s.p%d.w%d' % (self.org, p, w), 'name': 'workflow%d' % w,
+            'project_slug': self.project_slug, 'status': status, 'started_by': 'user', 'pipeline_number': self.num_pipelines - p,
+            'created_at': timestamp(-60 * p, millis=False),
+            'stopped_at': None if status in ('running', 'on_hold') else timestamp(-60 * p + 50, millis=False)
+        }
+
+    def job(self, n):
+        p, w = self.position(n)
+        status = self.job_status(n)
+        lifecycle = LIFECYCLES[status]
+        job = {
+            'dependencies': [], 'id': '%s.j%d' % (self.org, n), 'name': 'job%d' % ((n - 1) % self.shape.jobs_per_workflow),
+            'project_slug': self.project_slug, 'status': status, 'type': 'build',
+            'started_at': None if lifecycle in ('queued', 'not_run') else timestamp(-60 * p + 1, millis=False),
+            'stopped_at': timestamp(-60 * p + 40, millis=False) if lifecycle == 'finished' else None
+        }
+        # Jobs which haven't run have no job number
+        if lifecycle != 'not_run':
+            job['job_number'] = n
+        return job
+
+    def action(self, n, p, s, i, status):
+        running = status == 'running'
+        return {
+            'truncated': False, 'index': i, 'parallel': 1 < self.shape.actions_per_step, 'failed': status == 'failed' or None,
+            'infrastructure_fail': None, 'name': 'step %d' % s, 'bash_command': 'make step%d' % s, 'status': status,
+            'timedout': None, 'continue': None, 'end_time': None if running else timestamp(-60 * p + 2 + s),
+            'type': 'test', 'allocation_id': '%s.a%d.%d' % (self.org, n, i), 'output_url': None,
+            'start_time': timestamp(-60 * p + 1 + s), 'background': False, 'exit_code': None if running else int(status == 'failed'),
+            'insignificant': False, 'canceled': None, 'step': s * 100 + i, 'run_time_millis': None if running else 1000,
+            'has_output': True
+        }
+
+    def job_detail(self, n):
+        p, w = self.position(n)
+        status = self.job_status(n)
+        lifecycle = LIFECYCLES[status]
+        finished = lifecycle == 'finished'
+
+        # Steps before the last one succeeded, and running jobs are in the
+        # middle of their steps
+        num_steps = self.shape.steps_per_job if lifecycle != 'running' else (self.shape.steps_per_job + 1) // 2
+        steps = list()
+        for s in range(num_steps if lifecycle in ('finished', 'running') else 0):
+            step_status = 'success'
+            if s == num_steps - 1 and status != 'success':
+                step_status = 'running' if lifecycle == 'running' else 'failed'
+            steps.append({'name': 'step %d' % s, 'actions': [self.action(n, p, s, i, step_status) \
+                for i in range(self.shape.actions_per_step)]})
+
+        return {
+            'compare': None, 'previous_successful_build': None, 'build_parameters': None, 'oss': False,
+            'all_commit_details_truncated': False, 'committer_date': timestamp(-60 * p - 10, millis=False),
+            'steps': steps, 'body': '', 'usage_queued_at': timestamp(-60 * p), 'context_ids': [], 'fail_reason': None,
+            'retry_of': None, 'reponame': 'repo', 'ssh_users': [], 'build_url': 'https://circleci.com/%s/%d' % (self.project_slug, n),
+            'parallel': self.shape.actions_per_step, 'failed': status == 'failed' or None, 'branch': 'master',
+            'username': self.org, 'author_date': timestamp(-60 * p - 10, millis=False), 'why': 'github', 'user': {'login': 'user'},
+            'vcs_revision': '%040x' % p, 'workflows': {'job_name': 'job%d' % ((n - 1) % self.shape.jobs_per_workflow),
+                'job_id': '%s.j%d' % (self.org, n), 'workflow_id': '%s.p%d.w%d' % (self.org, p, w),
+                'workspace_id': '%s.p%d.w%d' % (self.org, p, w), 'upstream_job_ids': [], 'upstream_concurrency_map': {},
+                'workflow_name': 'workflow%d' % w},
+            'owners': [self.org], 'vcs_tag': None, 'build_num': n, 'infrastructure_fail': False, 'committer_email': 'user@example.com',
+            'has_artifacts': True, 'previous': None, 'status': status if status != 'on_hold' else 'not_run',
+            'committer_name': 'user', 'retries': None, 'subject': 'Commit %d' % p, 'vcs_type': 'github' if self.vcs == 'gh' else 'bitbucket',
+            'timedout': status == 'timedout', 'dont_build': None, 'lifecycle': lifecycle, 'no_dependency_cache': False,
+            'stop_time': timestamp(-60 * p + 40) if finished else None, 'ssh_disabled': True, 'build_time_millis': 39000 if finished else None,
+            'picard': None, 'circle_yml': {'string': ''}, 'messages': [], 'is_first_green_build': False, 'job_name': None,
+            'start_time': timestamp(-60 * p + 1) if lifecycle in ('finished', 'running') else None, 'canceler': None,
+            'platform': '2.0', 'outcome': status if finished else None, 'vcs_url': 'https://github.com/%s/repo' % self.org,
+            'author_name': 'user', 'node': None, 'queued_at': timestamp(-60 * p), 'canceled': status == 'canceled',
+            'author_email': 'user@example.com'
+        }
+
+    def job_summary(self, n):
+        p, w = self.position(n)
+        job = self.job(n)
+        return {
+            'web_url': 'https://app.circleci.com/pipelines/%s/%d/workflows/%s.p%d.w%d/jobs/%d' \
+                % (self.project_slug, self.num_pipelines - p, self.org, p, w, n),
+            'project': {'slug': self.project_slug, 'name': 'repo', 'external_url': 'https://github.com/%s/repo' % self.org},
+            'parallel_runs': [{'index': i, 'status': job['status']} for i in range(self.shape.actions_per_step)],
+            'started_at': job['started_at'], 'latest_workflow': {'id': '%s.p%d.w%d' % (self.org, p, w), 'name': 'workflow%d' % w},
+            'name': job['name'], 'executor': {'type': 'docker', 'resource_class': 'medium'}, 'parallelism': self.shape.actions_per_step,
+            'status': job['status'], 'number': n, 'pipeline': {'id': '%s.p%d' % (self.org, p)},
+            'duration': 39000 if job['stopped_at'] else None, 'created_at': timestamp(-60 * p, millis=False),
+            'messages': [], 'contexts': [], 'organization': {'name': self.org}, 'queued_at': timestamp(-60 * p, millis=False),
+            'stopped_at': job['stopped_at']
+        }
+
+    def respond(self, path, params):
+        # Returns (kind of request, body) of a request to this organization,
+        # where kind is None if the request isn't for it, and body is None if
+        # not found
+        if path == '/api/v2/pipeline':
+            if params.get('org-slug') != '%s/%s' % (self.vcs, self.org):
+                return None, None
+            return 'pipelines', self.page('pipelines', self.num_pipelines, self.pipeline, params)
+
+        ids = '(?:%s)' % re.escape(self.org)
+        match = re.match(r'^/api/v2/pipeline/%s\.p([0-9]+)/workflow$' % ids, path)
+        if match:
+            p = int(match.group(1))
+            if self.num_pipelines <= p:
+                return 'workflows', None
+            return 'workflows', self.page('workflows.%d' % p, self.num_workflows(p), lambda w: self.workflow(p, w), params)
+        match = re.match(r'^/api/v2/workflow/%s\.p([0-9]+)\.w([0-9]+)/job$' % ids, path)
+        if match:
+            p, w = int(match.group(1)), int(match.group(2))
+            numbers = self.job_numbers(p, w)
+            if self.num_pipelines <= p or len(numbers) == 0:
+                return 'jobs', None
+            return 'jobs', self.page('jobs.%d.%d' % (p, w), len(numbers), lambda i: self.job(numbers[i]), params)
+
+        project = '%s/%s/repo' % (re.escape(self.vcs), re.escape(self.org))
+        match = re.match(r'^/api/v1\.1/project/%s/([0-9]+)$' % project, path)
+        if match:
+            n = int(match.group(1))
+            return 'job_detail', self.job_detail(n) if 0 < n <= self.num_jobs else None
+        match = re.match(r'^/api/v2/project/%s/job/([0-9]+)$' % project, path)
+        if match:
+            n = int(match.group(1))
+            return 'job_summary', self.job_summary(n) if 0 < n <= self.num_jobs else None
+        return None, None
+
+    def iter_responses(self):
+        # (path, params, body) of every response of the organization, as a
+        # collector requests them
+        def pages(path, params):
+            token = None
+            while True:
+                page_params = dict(params, **({'page-token': token} if token else {}))
+                body = self.respond(path, page_params)[1]
+                yield path, page_params, body
+                token = body['next_page_token']
+                if token is None:
+                    break
+
+        for response in pages('/api/v2/pipeline', {'org-slug': '%s/%s' % (self.vcs, self.org)}):
+            yield response
+        for p in range(self.num_pipelines):
+            for response in pages('/api/v2/pipeline/%s.p%d/workflow' % (self.org, p), {}):
+                yield response
+            for w in range(self.num_workflows(p)):
+                for response in pages('/api/v2/workflow/%s.p%d.w%d/job' % (self.org, p, w), {}):
+                    yield response
+                for n in self.job_numbers(p, w):
+                    for path in ('/api/v1.1/project/%s/%d' % (self.project_slug, n), '/api/v2/project/%s/job/%d' % (self.project_slug, n)):
+                        yield path, {}, self.respond(path, {})[1]
+
+
+def add_shape_arguments(parser):
+    # Options of OrgShape, shared with benchmark/collector.py
+    parser.add_argument('--workflows', type=int, default=2, help='workflows per pipeline (default: 2)')
+    parser.add_argument('--jobs-per-workflow', type=int, default=5, help='jobs per workflow (default: 5)')
+    parser.add_argument('--steps', type=int, default=5, help='steps per job (default: 5)')
+    parser.add_argument('--actions', type=int, default=1, help='actions per step, or parallelism (default: 1)')
+    parser.add_argument('--page-size', type=int, default=20, help='items per page of list endpoints (default: 20)')
+    parser.add_argument('--statuses', type=parse_statuses, default={'success': 1},
+        help='weights of job statuses, e.g. success=80,failed=15,running=5 (default: success)')
+    parser.add_argument('--seed', type=int, default=0, help='seed of job statuses (default: 0)')
+
+
+def shape_from_args(args):
+    return OrgShape(workflows_per_pipeline=args.workflows, jobs_per_workflow=args.jobs_per_workflow, steps_per_job=args.steps,
+        actions_per_step=args.actions, page_size=args.page_size, statuses=args.statuses, seed=args.seed)
+
+
+def shape_to_argv(args):
+    # Options of OrgShape to pass to another process
+    return ['--workflows', str(args.workflows), '--jobs-per-workflow', str(args.jobs_per_workflow), '--steps', str(args.steps),
+        '--actions', str(args.actions), '--page-size', str(args.page_size), '--seed', str(args.seed),
+        '--statuses', ','.join('%s=%s' % item for item in sorted(args.statuses.items()))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--jobs', type=int, default=1000, help='jobs of the organization (default: 1000)')
+    parser.add_argument('--org', default='gh/synthetic', help='organization as vcs/name (default: gh/synthetic)')
+    add_shape_arguments(parser)
+    args = parser.parse_args()
+
+    vcs, org = args.org.split('/', 1)
+    synthetic = SyntheticOrg(vcs, org, args.jobs, shape_from_args(args))
+    for path, params, body in synthetic.iter_responses():
+        sys.stdout.write(json.dumps({'path': path, 'params': params, 'body': body}) + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -15,15 +15,109 @@
 # under the License.
 
 from __future__ import absolute_import
-import sys, json
-import re, requests, uuid, datetime
+import os, sys, json
+import re, requests, datetime, threading, time, asyncio, signal, itertools, calendar
+
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 from splunklib.modularinput import *
-from splunklib import six
 from splunklib.binding import HTTPError
 
-from splunklib.client import connect
-from splunklib.six.moves.urllib.parse import urlsplit
+from circleci_async import AsyncExecutor, AsyncHTTPClient
+from circleci_cache import JobDetailCache, ResponseCache
+from circleci_checkpoint import CheckpointBuffer, TerminalCheckpointCache, TERMINAL_STATUSES
+from circleci_ratelimit import get_scheduler
+from circleci_writer import BufferedEventWriter, EventTemplate, SynchronizedEventWriter
+from circleci_hec import HECEventWriter, HECSender
+from circleci_logger import JSONArg, LeveledLogger
+from circleci_metrics import RunMetrics
+from circleci_profiler import RunProfiler, is_profile_env_enabled
+
+# Seconds to wait for connecting to and reading from CircleCI API, so that a
+# stalled request doesn't block its input beyond the time budget
+REQUEST_TIMEOUT = 60
+
+# Errors of requests which failed without a response, retried like 5xx
+TRANSPORT_ERRORS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)
+# Same errors of the HTTP client of the async engine, where ConnectionError,
+# socket.timeout and asyncio.TimeoutError are OSError
+ASYNC_TRANSPORT_ERRORS = (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError)
+
+# Job statuses for which API v1.1 job detail is requested with job_detail = failed
+FAILED_STATUSES = frozenset(['failed', 'infrastructure_fail', 'timedout'])
+
+# Timestamps of CircleCI API in UTC (e.g. 2020-07-28T10:48:00.123Z)
+TIMESTAMP_PATTERN = re.compile(r'^(\d{4})-(\d{2})-(\d{2})T(\d{2}):(\d{2}):(\d{2})(?:\.(\d+))?Z$')
+
+# Seconds after which a created pipeline without workflows is settled, as
+# filters of branches or tags skip all of its workflows
+EMPTY_PIPELINE_GRACE_SECONDS = 300
+
+# Base URL of CircleCI API
+API_URL = 'https://circleci.com/api'
+
+# Log lines of the same format written per minute at INFO and above
+LOG_REPEAT_LIMIT = 100
+
+# VCS type in project_slug
+VCS_TYPES = {
+    'gh': 'github',
+    'bb': 'bitbucket'
+}
+
+class CircleCIAPIError(Exception):
+    """CircleCI API request which failed with a final status code, or
+    without a response, after retries if it was retried."""
+    def __init__(self, url, status_code, error=None):
+        if status_code is None:
+            message = 'request failed at %s: %s' % (url, error)
+        else:
+            message = 'status code is %s at %s' % (status_code, url)
+        super(CircleCIAPIError, self).__init__(message)
+        self.url = url
+        self.status_code = status_code
+        self.error = error
+
+# Metrics of the run whose request is sent from the current thread, as
+# sessions and their connection pools are shared by runs of inputs in parallel
+_http_local = threading.local()
+
+
+def count_new_connection():
+    metrics = getattr(_http_local, 'metrics', None)
+    if metrics is not None:
+        metrics.count('api_connections')
+
+
+class CountingHTTPConnectionPool(HTTPConnectionPool):
+    """Connection pool which counts new connections in the run of the
+    request."""
+    def _new_conn(self):
+        count_new_connection()
+        return super(CountingHTTPConnectionPool, self)._new_conn()
+
+
+class CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    """Connection pool which counts new connections in the run of the
+    request."""
+    def _new_conn(self):
+        count_new_connection()
+        return super(CountingHTTPSConnectionPool, self)._new_conn()
+
+
+class CountingHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter whose pools count new connections."""
+    def init_poolmanager(self, *args, **kwargs):
+        super(CountingHTTPAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': CountingHTTPConnectionPool,
+            'https': CountingHTTPSConnectionPool
+        }
+
 
 class CircleCIScript(Script):
     """All modular inputs should inherit from the abstract base class Script
@@ -32,6 +126,40 @@ class CircleCIScript(Script):
     if the scheme returned by get_scheme has Scheme.use_external_validation
     set to True, the validate_input function.
     """
+    def __init__(self):
+        super(CircleCIScript, self).__init__()
+        # Pooled HTTP sessions by API token, shared by all threads in a run
+        self._sessions = dict()
+        self._sessions_lock = threading.Lock()
+        # Connection pool size of each API token, the largest of the inputs
+        # which share its session
+        self._pool_sizes = dict()
+        # Local cache of workflows and jobs in a terminal state
+        self._terminal_cache = None
+        # Local cache of list responses for conditional requests
+        self._response_cache = None
+        # Local cache of API v1.1 job details of finished builds
+        self._job_detail_cache = None
+        # Set to stop scheduling inputs in single-instance mode
+        self._stop_event = threading.Event()
+        self._stop_event_listeners = list()
+        # Base URL of CircleCI API, which benchmarks point at a local server
+        self.api_url = API_URL
+        # HTTP Event Collector senders by HEC settings, shared by inputs
+        self._hec_senders = dict()
+        self._hec_senders_lock = threading.Lock()
+        # Profiles of runs are written under checkpoint_dir
+        self._checkpoint_dir = None
+
+    def run(self, args):
+        # Events and logs are written to splunkd in batches by
+        # BufferedEventWriter, which is flushed even if the run fails
+        event_writer = BufferedEventWriter()
+        try:
+            return self.run_script(args, event_writer, sys.stdin)
+        finally:
+            event_writer.flush()
+
     def get_scheme(self):
         """When Splunk starts, it looks for all the modular inputs defined by
         its configuration, and tries to run them with the argument --scheme.
@@ -55,6 +183,10 @@ class CircleCIScript(Script):
         # and will run validation internally using that string.
         scheme.use_external_validation = True
 
+        # All circleci:// stanzas are passed to one long-lived process, which
+        # schedules each of them at its interval
+        scheme.use_single_instance = True
+
         api_token_argument = Argument("api_token")
         api_token_argument.title = "API Token"
         api_token_argument.data_type = Argument.data_type_string
@@ -73,12 +205,187 @@ class CircleCIScript(Script):
         org_argument.description = "Input your organization name (e.g. `splunk` in https://github.com/splunk/splunk-sdk-python)"
         org_argument.required_on_create = True
 
+        max_concurrency_argument = Argument("max_concurrency")
+        max_concurrency_argument.title = "Max concurrency"
+        max_concurrency_argument.data_type = Argument.data_type_number
+        max_concurrency_argument.description = "Number of concurrent CircleCI API requests (1 to 32, default: 1)"
+        max_concurrency_argument.required_on_create = False
+
+        pool_size_argument = Argument("pool_size")
+        pool_size_argument.title = "HTTP connection pool size"
+        pool_size_argument.data_type = Argument.data_type_number
+        pool_size_argument.description = "Number of keep-alive connections to CircleCI API (1 to 64, not less than max concurrency, default: same as max concurrency)"
+        pool_size_argument.required_on_create = False
+
+        engine_argument = Argument("engine")
+        engine_argument.title = "Collector engine"
+        engine_argument.data_type = Argument.data_type_string
+        engine_argument.description = "`thread` (default) or `async` to multiplex API requests on an asyncio event loop"
+        engine_argument.required_on_create = False
+
+        checkpoint_batch_size_argument = Argument("checkpoint_batch_size")
+        checkpoint_batch_size_argument.title = "Checkpoint batch size"
+        checkpoint_batch_size_argument.data_type = Argument.data_type_number
+        checkpoint_batch_size_argument.description = "Number of checkpoints saved to KV Store per request (1 to 1000, default: 500)"
+        checkpoint_batch_size_argument.required_on_create = False
+
+        checkpoint_max_age_argument = Argument("checkpoint_max_age")
+        checkpoint_max_age_argument.title = "Checkpoint max age"
+        checkpoint_max_age_argument.data_type = Argument.data_type_number
+        checkpoint_max_age_argument.description = "Max seconds updated checkpoints are buffered before saved to KV Store (default: 30)"
+        checkpoint_max_age_argument.required_on_create = False
+
+        terminal_cache_size_argument = Argument("terminal_cache_size")
+        terminal_cache_size_argument.title = "Terminal checkpoint cache size"
+        terminal_cache_size_argument.data_type = Argument.data_type_number
+        terminal_cache_size_argument.description = "Number of finished workflows and jobs cached on local disk to skip KV Store and API requests (0 disables, default: 100000)"
+        terminal_cache_size_argument.required_on_create = False
+
+        response_cache_size_argument = Argument("response_cache_size")
+        response_cache_size_argument.title = "Response cache size"
+        response_cache_size_argument.data_type = Argument.data_type_number
+        response_cache_size_argument.description = "Megabytes of workflow and job lists cached on local disk and requested again with If-None-Match and If-Modified-Since (0 disables, default: 100)"
+        response_cache_size_argument.required_on_create = False
+
+        job_detail_cache_size_argument = Argument("job_detail_cache_size")
+        job_detail_cache_size_argument.title = "Job detail cache size"
+        job_detail_cache_size_argument.data_type = Argument.data_type_number
+        job_detail_cache_size_argument.description = "Megabytes of API v1.1 job details of finished builds cached on local disk so that they are not requested again (0 disables, default: 100)"
+        job_detail_cache_size_argument.required_on_create = False
+
+        job_detail_cache_ttl_argument = Argument("job_detail_cache_ttl")
+        job_detail_cache_ttl_argument.title = "Job detail cache TTL"
+        job_detail_cache_ttl_argument.data_type = Argument.data_type_number
+        job_detail_cache_ttl_argument.description = "Seconds job details are kept in the job detail cache (default: 604800)"
+        job_detail_cache_ttl_argument.required_on_create = False
+
+        job_detail_argument = Argument("job_detail")
+        job_detail_argument.title = "Job detail"
+        job_detail_argument.data_type = Argument.data_type_string
+        job_detail_argument.description = "Jobs to request API v1.1 job detail with steps: `all` (default), `terminal` (finished jobs), or `failed` (failed jobs)"
+        job_detail_argument.required_on_create = False
+
+        rate_limit_argument = Argument("rate_limit")
+        rate_limit_argument.title = "Rate limit"
+        rate_limit_argument.data_type = Argument.data_type_number
+        rate_limit_argument.description = "Max CircleCI API requests per second per API token, shared by all inputs (0 disables, default: 0)"
+        rate_limit_argument.required_on_create = False
+
+        max_retries_argument = Argument("max_retries")
+        max_retries_argument.title = "Max retries"
+        max_retries_argument.data_type = Argument.data_type_number
+        max_retries_argument.description = "Number of retries of CircleCI API requests on 429, 5xx, connection errors and timeouts (0 to 10, default: 3)"
+        max_retries_argument.required_on_create = False
+
+        org_workers_argument = Argument("org_workers")
+        org_workers_argument.title = "Org workers"
+        org_workers_argument.data_type = Argument.data_type_number
+        org_workers_argument.description = "Number of inputs collected in parallel, the largest of all inputs is used (1 to 16, default: 1)"
+        org_workers_argument.required_on_create = False
+
+        max_run_seconds_argument = Argument("max_run_seconds")
+        max_run_seconds_argument.title = "Max run seconds"
+        max_run_seconds_argument.data_type = Argument.data_type_number
+        max_run_seconds_argument.description = "Max seconds of each run of this input, the next run resumes where it stopped (0 disables, default: 0)"
+        max_run_seconds_argument.required_on_create = False
+
+        event_flush_size_argument = Argument("event_flush_size")
+        event_flush_size_argument.title = "Event flush size"
+        event_flush_size_argument.data_type = Argument.data_type_number
+        event_flush_size_argument.description = "Characters of events and logs buffered before written to splunkd, the largest of all inputs is used (default: 65536)"
+        event_flush_size_argument.required_on_create = False
+
+        event_flush_interval_argument = Argument("event_flush_interval")
+        event_flush_interval_argument.title = "Event flush interval"
+        event_flush_interval_argument.data_type = Argument.data_type_number
+        event_flush_interval_argument.description = "Max seconds events and logs are buffered before written to splunkd, the largest of all inputs is used (default: 1)"
+        event_flush_interval_argument.required_on_create = False
+
+        output_mode_argument = Argument("output_mode")
+        output_mode_argument.title = "Output mode"
+        output_mode_argument.data_type = Argument.data_type_string
+        output_mode_argument.description = "`stdout` (default) to write events to splunkd, or `hec` to send them to HTTP Event Collector"
+        output_mode_argument.required_on_create = False
+
+        hec_url_argument = Argument("hec_url")
+        hec_url_argument.title = "HEC URL"
+        hec_url_argument.data_type = Argument.data_type_string
+        hec_url_argument.description = "URL of HTTP Event Collector with `hec` output mode (default: https://localhost:8088)"
+        hec_url_argument.required_on_create = False
+
+        hec_token_argument = Argument("hec_token")
+        hec_token_argument.title = "HEC token"
+        hec_token_argument.data_type = Argument.data_type_string
+        hec_token_argument.description = "Token of HTTP Event Collector, required with `hec` output mode"
+        hec_token_argument.required_on_create = False
+
+        hec_ack_argument = Argument("hec_ack")
+        hec_ack_argument.title = "HEC indexer acknowledgement"
+        hec_ack_argument.data_type = Argument.data_type_boolean
+        hec_ack_argument.description = "Wait for indexer acknowledgement of events before saving their checkpoints, the HEC token must enable it (default: false)"
+        hec_ack_argument.required_on_create = False
+
+        hec_verify_ssl_argument = Argument("hec_verify_ssl")
+        hec_verify_ssl_argument.title = "HEC verify SSL"
+        hec_verify_ssl_argument.data_type = Argument.data_type_boolean
+        hec_verify_ssl_argument.description = "Verify the SSL certificate of HTTP Event Collector (default: true)"
+        hec_verify_ssl_argument.required_on_create = False
+
+        hec_batch_size_argument = Argument("hec_batch_size")
+        hec_batch_size_argument.title = "HEC batch size"
+        hec_batch_size_argument.data_type = Argument.data_type_number
+        hec_batch_size_argument.description = "Characters of events sent to HTTP Event Collector per request before compression (default: 1048576)"
+        hec_batch_size_argument.required_on_create = False
+
+        hec_queue_size_argument = Argument("hec_queue_size")
+        hec_queue_size_argument.title = "HEC queue size"
+        hec_queue_size_argument.data_type = Argument.data_type_number
+        hec_queue_size_argument.description = "Number of batches queued or waiting for acknowledgement before writing events blocks (1 to 64, default: 8)"
+        hec_queue_size_argument.required_on_create = False
+
+        log_level_argument = Argument("log_level")
+        log_level_argument.title = "Log level"
+        log_level_argument.data_type = Argument.data_type_string
+        log_level_argument.description = "Lowest severity of logs written by this input: `DEBUG`, `INFO` (default), `WARN`, or `ERROR`"
+        log_level_argument.required_on_create = False
+
+        profile_argument = Argument("profile")
+        profile_argument.title = "Profile runs"
+        profile_argument.data_type = Argument.data_type_boolean
+        profile_argument.description = "Profile each run with cProfile, write the profile under the checkpoint directory, and log its hot functions (default: false)"
+        profile_argument.required_on_create = False
+
         # If you are not using external validation, you would add something like:
         #
         # scheme.validation = "api_token==xxxxxxxxxxxxxxx"
         scheme.add_argument(api_token_argument)
         scheme.add_argument(vcs_argument)
         scheme.add_argument(org_argument)
+        scheme.add_argument(max_concurrency_argument)
+        scheme.add_argument(pool_size_argument)
+        scheme.add_argument(engine_argument)
+        scheme.add_argument(checkpoint_batch_size_argument)
+        scheme.add_argument(checkpoint_max_age_argument)
+        scheme.add_argument(terminal_cache_size_argument)
+        scheme.add_argument(response_cache_size_argument)
+        scheme.add_argument(job_detail_cache_size_argument)
+        scheme.add_argument(job_detail_cache_ttl_argument)
+        scheme.add_argument(job_detail_argument)
+        scheme.add_argument(rate_limit_argument)
+        scheme.add_argument(max_retries_argument)
+        scheme.add_argument(org_workers_argument)
+        scheme.add_argument(max_run_seconds_argument)
+        scheme.add_argument(event_flush_size_argument)
+        scheme.add_argument(event_flush_interval_argument)
+        scheme.add_argument(output_mode_argument)
+        scheme.add_argument(hec_url_argument)
+        scheme.add_argument(hec_token_argument)
+        scheme.add_argument(hec_ack_argument)
+        scheme.add_argument(hec_verify_ssl_argument)
+        scheme.add_argument(hec_batch_size_argument)
+        scheme.add_argument(hec_queue_size_argument)
+        scheme.add_argument(log_level_argument)
+        scheme.add_argument(profile_argument)
 
         return scheme
 
@@ -129,67 +436,468 @@ class CircleCIScript(Script):
         if vcs != 'github' and vcs != 'bitbucket':
             raise ValueError("VCS must be `github` or `bitbucket`.")
 
+        # max_concurrency is optional and must be from 1 to 32
+        max_concurrency = validation_definition.parameters.get("max_concurrency")
+        if max_concurrency is not None and max_concurrency != '':
+            if re.match(r'^[1-9][0-9]*$', max_concurrency) is None or 32 < int(max_concurrency):
+                raise ValueError("Max concurrency must be from 1 to 32.")
+
+        # pool_size is optional and must be from 1 to 64
+        pool_size = validation_definition.parameters.get("pool_size")
+        if pool_size is not None and pool_size != '':
+            if re.match(r'^[1-9][0-9]*$', pool_size) is None or 64 < int(pool_size):
+                raise ValueError("HTTP connection pool size must be from 1 to 64.")
+            # Connections of concurrent requests beyond the pool are discarded
+            if max_concurrency is not None and max_concurrency != '' and int(pool_size) < int(max_concurrency):
+                raise ValueError("HTTP connection pool size must not be less than max concurrency.")
+
+        # engine is optional and must be thread or async
+        engine = validation_definition.parameters.get("engine")
+        if engine is not None and engine != '' and engine != 'thread' and engine != 'async':
+            raise ValueError("Collector engine must be `thread` or `async`.")
+
+        # checkpoint_batch_size is optional and must be from 1 to 1000
+        # (default max_documents_per_batch_save of KV Store)
+        checkpoint_batch_size = validation_definition.parameters.get("checkpoint_batch_size")
+        if checkpoint_batch_size is not None and checkpoint_batch_size != '':
+            if re.match(r'^[1-9][0-9]*$', checkpoint_batch_size) is None or 1000 < int(checkpoint_batch_size):
+                raise ValueError("Checkpoint batch size must be from 1 to 1000.")
+
+        # checkpoint_max_age is optional and must be non-negative integer
+        checkpoint_max_age = validation_definition.parameters.get("checkpoint_max_age")
+        if checkpoint_max_age is not None and checkpoint_max_age != '':
+            if re.match(r'^[0-9]+$', checkpoint_max_age) is None:
+                raise ValueError("Checkpoint max age must be non-negative integer.")
+
+        # terminal_cache_size is optional and must be non-negative integer
+        terminal_cache_size = validation_definition.parameters.get("terminal_cache_size")
+        if terminal_cache_size is not None and terminal_cache_size != '':
+            if re.match(r'^[0-9]+$', terminal_cache_size) is None:
+                raise ValueError("Terminal checkpoint cache size must be non-negative integer.")
+
+        # response_cache_size is optional and must be non-negative integer
+        response_cache_size = validation_definition.parameters.get("response_cache_size")
+        if response_cache_size is not None and response_cache_size != '':
+            if re.match(r'^[0-9]+$', response_cache_size) is None:
+                raise ValueError("Response cache size must be non-negative integer.")
+
+        # job_detail_cache_size is optional and must be non-negative integer
+        job_detail_cache_size = validation_definition.parameters.get("job_detail_cache_size")
+        if job_detail_cache_size is not None and job_detail_cache_size != '':
+            if re.match(r'^[0-9]+$', job_detail_cache_size) is None:
+                raise ValueError("Job detail cache size must be non-negative integer.")
+
+        # job_detail_cache_ttl is optional and must be positive integer
+        job_detail_cache_ttl = validation_definition.parameters.get("job_detail_cache_ttl")
+        if job_detail_cache_ttl is not None and job_detail_cache_ttl != '':
+            if re.match(r'^[1-9][0-9]*$', job_detail_cache_ttl) is None:
+                raise ValueError("Job detail cache TTL must be positive integer.")
+
+        # org_workers is optional and must be from 1 to 16
+        org_workers = validation_definition.parameters.get("org_workers")
+        if org_workers is not None and org_workers != '':
+            if re.match(r'^[1-9][0-9]*$', org_workers) is None or 16 < int(org_workers):
+                raise ValueError("Org workers must be from 1 to 16.")
+
+        # max_run_seconds is optional and must be non-negative integer
+        max_run_seconds = validation_definition.parameters.get("max_run_seconds")
+        if max_run_seconds is not None and max_run_seconds != '':
+            if re.match(r'^[0-9]+$', max_run_seconds) is None:
+                raise ValueError("Max run seconds must be non-negative integer.")
+
+        # event_flush_size is optional and must be positive integer
+        event_flush_size = validation_definition.parameters.get("event_flush_size")
+        if event_flush_size is not None and event_flush_size != '':
+            if re.match(r'^[1-9][0-9]*$', event_flush_size) is None:
+                raise ValueError("Event flush size must be positive integer.")
+
+        # event_flush_interval is optional and must be non-negative integer
+        event_flush_interval = validation_definition.parameters.get("event_flush_interval")
+        if event_flush_interval is not None and event_flush_interval != '':
+            if re.match(r'^[0-9]+$', event_flush_interval) is None:
+                raise ValueError("Event flush interval must be non-negative integer.")
+
+        # output_mode is optional and must be stdout or hec
+        output_mode = validation_definition.parameters.get("output_mode")
+        if output_mode is not None and output_mode != '' and output_mode not in ('stdout', 'hec'):
+            raise ValueError("Output mode must be `stdout` or `hec`.")
+
+        # hec_url is optional and must be http or https URL
+        hec_url = validation_definition.parameters.get("hec_url")
+        if hec_url is not None and hec_url != '':
+            if re.match(r'^https?://[^/\s]+/?$', hec_url) is None:
+                raise ValueError("HEC URL must be http or https URL without path (e.g. https://localhost:8088).")
+
+        # hec_token is required with hec output mode and must be GUID
+        hec_token = validation_definition.parameters.get("hec_token")
+        if output_mode == 'hec' and (hec_token is None or hec_token == ''):
+            raise ValueError("HEC token is required with `hec` output mode.")
+        if hec_token is not None and hec_token != '':
+            if re.match(r'^[0-9A-Fa-f]{8}-[0-9A-Fa-f]{4}-[0-9A-Fa-f]{4}-[0-9A-Fa-f]{4}-[0-9A-Fa-f]{12}$', hec_token) is None:
+                raise ValueError("HEC token format is invalid. Must be GUID (e.g. 12345678-1234-1234-1234-123456789012).")
+
+        # hec_ack, hec_verify_ssl and profile are optional and must be boolean
+        for name, title in (("hec_ack", "HEC indexer acknowledgement"), ("hec_verify_ssl", "HEC verify SSL"), ("profile", "Profile runs")):
+            value = validation_definition.parameters.get(name)
+            if value is not None and value != '' and value.lower() not in ('0', '1', 'false', 'true'):
+                raise ValueError("%s must be `true` or `false`." % title)
+
+        # hec_batch_size is optional and must be positive integer
+        hec_batch_size = validation_definition.parameters.get("hec_batch_size")
+        if hec_batch_size is not None and hec_batch_size != '':
+            if re.match(r'^[1-9][0-9]*$', hec_batch_size) is None:
+                raise ValueError("HEC batch size must be positive integer.")
+
+        # hec_queue_size is optional and must be from 1 to 64
+        hec_queue_size = validation_definition.parameters.get("hec_queue_size")
+        if hec_queue_size is not None and hec_queue_size != '':
+            if re.match(r'^[1-9][0-9]*$', hec_queue_size) is None or 64 < int(hec_queue_size):
+                raise ValueError("HEC queue size must be from 1 to 64.")
+
+        # log_level is optional and must be DEBUG, INFO, WARN or ERROR
+        log_level = validation_definition.parameters.get("log_level")
+        if log_level is not None and log_level != '' and log_level not in ('DEBUG', 'INFO', 'WARN', 'ERROR'):
+            raise ValueError("Log level must be `DEBUG`, `INFO`, `WARN`, or `ERROR`.")
+
+        # job_detail is optional and must be all, terminal or failed
+        job_detail = validation_definition.parameters.get("job_detail")
+        if job_detail is not None and job_detail != '' and job_detail not in ('all', 'terminal', 'failed'):
+            raise ValueError("Job detail must be `all`, `terminal`, or `failed`.")
+
+        # rate_limit is optional and must be non-negative number
+        rate_limit = validation_definition.parameters.get("rate_limit")
+        if rate_limit is not None and rate_limit != '':
+            if re.match(r'^[0-9]+(\.[0-9]+)?$', rate_limit) is None:
+                raise ValueError("Rate limit must be non-negative number.")
+
+        # max_retries is optional and must be from 0 to 10
+        max_retries = validation_definition.parameters.get("max_retries")
+        if max_retries is not None and max_retries != '':
+            if re.match(r'^[0-9]+$', max_retries) is None or 10 < int(max_retries):
+                raise ValueError("Max retries must be from 0 to 10.")
+
+
+    def iter_list_pages(self, url, api_token, params, limit, ew, stop=None, executor=None, with_page_token=False, conditional=False):
+        # Request pages of a list API lazily and yield items of each page as
+        # soon as it arrives
+        # stop is an optional callable which takes items of each page and
+        # returns True to stop requesting following pages
+        # executor runs each request with its engine (default: this thread)
+        # with_page_token yields (page-token of the request, items) instead,
+        # where page-token in params starts from that page
+        # conditional requests pages with the response cache
+
+        i = 0
+        list_count = 0
+        # Copy params not to share page-token between concurrent requests
+        params = dict(params or {})
+
+        ew.log('DEBUG', 'Initial list request url=%s params=%s', url, JSONArg(params))
+        page_token = params.get('page-token')
+        # HTTP Get Request
+        if executor is None:
+            r_dict = self.get_dict_api(url=url, api_token=api_token, params=params, ew=ew, conditional=conditional)
+        else:
+            r_dict = self.fetch_one(executor, self.get_dict_api, url, api_token=api_token, params=params, ew=ew, conditional=conditional)
+
+        params['page-token'] = r_dict.get('next_page_token')
+        list_count += len(r_dict.get('items'))
+        ew.log('DEBUG', 'end Initial list request url=%s params=%s', url, JSONArg(params))
+
+        yield (page_token, r_dict.get('items')) if with_page_token else r_dict.get('items')
+
+        if stop is not None and stop(r_dict.get('items')):
+            ew.log('DEBUG', 'stop list request url=%s list_count=%s', url, list_count)
+            params['page-token'] = None
+
+        while params.get('page-token') is not None:
+
+            ew.log('DEBUG', 'start get list loop url=%s i=%s limit=%s', url, i, limit)
+            if limit is not None and limit < i:
+                break
+
+            ew.log('DEBUG', 'Repeated list request url=%s params=%s i=%s', url, JSONArg(params), i)
+            page_token = params.get('page-token')
+            # HTTP Get Request
+            if executor is None:
+                r_dict = self.get_dict_api(url=url, api_token=api_token, params=params, ew=ew, conditional=conditional)
+            else:
+                r_dict = self.fetch_one(executor, self.get_dict_api, url, api_token=api_token, params=params, ew=ew, conditional=conditional)
+
+            params['page-token'] = r_dict.get('next_page_token')
+            list_count += len(r_dict.get('items'))
+            ew.log('DEBUG', 'end get list url=%s i=%s limit=%s list_count=%s', url, i, limit, list_count)
+
+            yield (page_token, r_dict.get('items')) if with_page_token else r_dict.get('items')
+
+            if stop is not None and stop(r_dict.get('items')):
+                ew.log('DEBUG', 'stop list request url=%s list_count=%s', url, list_count)
+                break
+
+            i += 1
+
+    def get_list_api(self, url, api_token, params, limit, ew, stop=None, conditional=False):
+        # Get all items of a list API
+        r_list = list()
+        for items in self.iter_list_pages(url=url, api_token=api_token, params=params, limit=limit, ew=ew, stop=stop, 
+                conditional=conditional):
+            r_list.extend(items)
+
+        return r_list
 
-    def get_list_api(self, url, api_token, params, limit, ew):
+    async def get_list_api_async(self, client, url, api_token, params, limit, ew, stop=None, conditional=False):
+        # Same as get_list_api on the event loop of the async engine
 
         i = 0
         r_list = list()
+        params = dict(params or {})
 
-        ew.log('DEBUG', 'Initial list request url=%s params=%s' % (url, json.dumps(params)))
+        ew.log('DEBUG', 'Initial list request url=%s params=%s', url, JSONArg(params))
         # HTTP Get Request
-        r_dict = self.get_dict_api(url=url, api_token=api_token, params=params, ew=ew)
+        r_dict = await self.get_dict_api_async(client=client, url=url, api_token=api_token, params=params, ew=ew, 
+            conditional=conditional)
 
         params['page-token'] = r_dict.get('next_page_token')
         r_list.extend(r_dict.get('items'))
-        ew.log('DEBUG', 'end Initial list request url=%s params=%s' % (url, json.dumps(params)))
+        ew.log('DEBUG', 'end Initial list request url=%s params=%s', url, JSONArg(params))
+
+        if stop is not None and stop(r_dict.get('items')):
+            ew.log('DEBUG', 'stop list request url=%s list_count=%s', url, len(r_list))
+            params['page-token'] = None
 
         while params.get('page-token') is not None:
 
-            ew.log('DEBUG', 'start get list loop url=%s i=%s limit=%s' % (url, str(i), str(limit)))
+            ew.log('DEBUG', 'start get list loop url=%s i=%s limit=%s', url, i, limit)
             if limit is not None and limit < i:
                 break
 
-            ew.log('DEBUG', 'Repeated list request url=%s params=%s i=%s' % (url, json.dumps(params), str(i)))
+            ew.log('DEBUG', 'Repeated list request url=%s params=%s i=%s', url, JSONArg(params), i)
             # HTTP Get Request
-            r_dict = self.get_dict_api(url=url, api_token=api_token, params=params, ew=ew)
+            r_dict = await self.get_dict_api_async(client=client, url=url, api_token=api_token, params=params, ew=ew, 
+                conditional=conditional)
 
             params['page-token'] = r_dict.get('next_page_token')
             r_list.extend(r_dict.get('items'))
-            ew.log('DEBUG', 'end get list url=%s i=%s limit=%s list_count=%s' % (url, str(i), str(limit), str(len(r_list))))
+            ew.log('DEBUG', 'end get list url=%s i=%s limit=%s list_count=%s', url, i, limit, len(r_list))
 
-            i += 1
+            if stop is not None and stop(r_dict.get('items')):
+                ew.log('DEBUG', 'stop list request url=%s list_count=%s', url, len(r_list))
+                break
 
-        ew.log('DEBUG', json.dumps(r_list))
+            i += 1
 
         return r_list
 
-    def get_dict_api(self, url, api_token, params, ew):
+    def get_pool_size(self, input_item):
+        # Connections kept alive by an input, at least one per concurrent
+        # request so that none of them is discarded
+        max_concurrency = self.get_int_parameter(input_item, 'max_concurrency', 1)
+        return max(self.get_int_parameter(input_item, 'pool_size', max_concurrency), max_concurrency)
+
+    def get_session(self, api_token):
+        # Get or create a pooled session for api_token
+        # Connections are kept alive and reused by every request with the same
+        # token until close_sessions is called at the end of the run
+        # The pool fits the inputs with the same token in stream_events, as
+        # it can't be resized once the session is created
+        with self._sessions_lock:
+            session = self._sessions.get(api_token)
+            if session is None:
+                adapter = CountingHTTPAdapter(pool_maxsize=self._pool_sizes.get(api_token, 1))
+                session = requests.Session()
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                session.headers.update({
+                    'Circle-Token': api_token,
+                    'Accept': 'application/json',
+                    'Accept-Encoding': 'gzip'
+                })
+                self._sessions[api_token] = session
+        return session
+
+    def close_sessions(self, ew):
+        # Close pooled sessions at the end of the process
+        # Their connection reuse is logged by each run
+        with self._sessions_lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+
+        for session in sessions:
+            session.close()
+
+    def log_http_stats(self, api_token, ew):
+        # Log requests of the run and their connection reuse from its metrics
+        metrics = getattr(ew, 'metrics', None)
+        if metrics is None:
+            return
+        num_requests = metrics.get_requests()
+        num_connections = metrics.get_count('api_connections')
+        ew.log('INFO', 'HTTP session stats: api_token=****%s requests=%s connections=%s reused=%s', 
+            api_token[-4:], num_requests, num_connections, num_requests - num_connections)
+        ew.log('INFO', 'Rate limit stats: api_token=****%s throttled=%s retried=%s', 
+            api_token[-4:], metrics.get_count('api_throttled'), metrics.get_count('api_retried'))
+
+    def get_dict_api(self, url, api_token, params, ew, conditional=False):
+        # conditional requests url with ETag and Last-Modified of its cached
+        # response, and reuses the cached body if it is not modified
+
+        session = self.get_session(api_token)
+        scheduler = get_scheduler(api_token)
+        cache_headers, cached_body = self.get_cached_response(url, params, conditional, ew)
+
+        ew.log('DEBUG', 'start GET request url=%s params=%s', url, JSONArg(params))
+        # New connections of the session are counted in the run of ew
+        _http_local.metrics = getattr(ew, 'metrics', None)
+        attempt = 0
+        while True:
+            # Wait for the rate limit of api_token
+            delay = scheduler.acquire()
+            if 0 < delay:
+                self.count_metric('api_throttled', ew)
+                time.sleep(delay)
 
-        headers = {
-            'Circle-Token': api_token,
-            'Accept': 'application/json'
-        }
-
-        ew.log('DEBUG', 'start GET request url=%s params=%s' % (url, json.dumps(params)))
-        # HTTP Get Request
-        # params is not empty
-        if bool(params):
-            r = requests.get(url, params=params, headers=headers)
-        # params is empty
+            # HTTP Get Request
+            requested = time.time()
+            try:
+                # params is not empty
+                if bool(params):
+                    r = session.get(url, params=params, headers=cache_headers, timeout=REQUEST_TIMEOUT)
+                # params is empty
+                else:
+                    r = session.get(url, headers=cache_headers, timeout=REQUEST_TIMEOUT)
+            except TRANSPORT_ERRORS as e:
+                # Retry connection errors and timeouts with backoff
+                delay = scheduler.error_delay(attempt)
+                if delay is None:
+                    ew.log('WARN', 'request failed at %s: %s', url, e)
+                    raise CircleCIAPIError(url, None, e)
+                ew.log('WARN', 'request failed at %s, retry in %.1f seconds: %s', url, delay, e)
+                self.count_metric('api_retried', ew)
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self.record_request(url, r, time.time() - requested, ew)
+
+            # Retry 429 and 5xx with backoff
+            delay = scheduler.retry_delay(r.status_code, r.headers, attempt)
+            if delay is None:
+                break
+            ew.log('WARN', 'status code is %s at %s, retry in %.1f seconds', r.status_code, url, delay)
+            self.count_metric('api_retried', ew)
+            time.sleep(delay)
+            attempt += 1
+
+        # Cached body of an unchanged response
+        if r.status_code == 304 and cached_body is not None:
+            ew.log('DEBUG', 'Not modified url=%s params=%s', url, JSONArg(params))
+            self.count_metric('api_not_modified', ew)
+            r_dict = json.loads(cached_body)
         else:
-            r = requests.get(url, headers=headers)
+            # If not success in API request, its body is not data
+            if r.status_code != 200:
+                ew.log('WARN', 'status code is %s at %s', r.status_code, url)
+                raise CircleCIAPIError(url, r.status_code)
+            ew.log('DEBUG', 'Success url=%s params=%s', url, JSONArg(params))
+            if conditional:
+                self.cache_response(url, params, r, ew)
+
+            r_dict = json.loads(r.text)
+        ew.log('DEBUG', 'end GET request url=%s params=%s', url, JSONArg(params))
+
+        return r_dict
+
+    async def get_dict_api_async(self, client, url, api_token, params, ew, conditional=False):
+        # Same as get_dict_api with the HTTP client of the async engine
 
-        # If not success in API request
-        if r.status_code != 200:
-            ew.log('WARN', 'status code is %s at %s' % (str(r.status_code), url))
+        scheduler = get_scheduler(api_token)
+        cache_headers, cached_body = self.get_cached_response(url, params, conditional, ew)
+
+        ew.log('DEBUG', 'start GET request url=%s params=%s', url, JSONArg(params))
+        attempt = 0
+        while True:
+            # Wait for the rate limit of api_token
+            delay = scheduler.acquire()
+            if 0 < delay:
+                self.count_metric('api_throttled', ew)
+            await asyncio.sleep(delay)
+
+            # HTTP Get Request
+            requested = time.time()
+            try:
+                r = await asyncio.wait_for(client.get(url, params=params, headers=cache_headers), REQUEST_TIMEOUT)
+            except ASYNC_TRANSPORT_ERRORS as e:
+                # Retry connection errors and timeouts with backoff
+                delay = scheduler.error_delay(attempt)
+                if delay is None:
+                    ew.log('WARN', 'request failed at %s: %s', url, repr(e))
+                    raise CircleCIAPIError(url, None, repr(e))
+                ew.log('WARN', 'request failed at %s, retry in %.1f seconds: %s', url, delay, repr(e))
+                self.count_metric('api_retried', ew)
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            self.record_request(url, r, time.time() - requested, ew)
+
+            # Retry 429 and 5xx with backoff
+            delay = scheduler.retry_delay(r.status_code, r.headers, attempt)
+            if delay is None:
+                break
+            ew.log('WARN', 'status code is %s at %s, retry in %.1f seconds', r.status_code, url, delay)
+            self.count_metric('api_retried', ew)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+        # Cached body of an unchanged response
+        if r.status_code == 304 and cached_body is not None:
+            ew.log('DEBUG', 'Not modified url=%s params=%s', url, JSONArg(params))
+            self.count_metric('api_not_modified', ew)
+            r_dict = json.loads(cached_body)
         else:
-            ew.log('INFO', 'Success url=%s params=%s' % (url, json.dumps(params)))
+            # If not success in API request, its body is not data
+            if r.status_code != 200:
+                ew.log('WARN', 'status code is %s at %s', r.status_code, url)
+                raise CircleCIAPIError(url, r.status_code)
+            ew.log('DEBUG', 'Success url=%s params=%s', url, JSONArg(params))
+            if conditional:
+                self.cache_response(url, params, r, ew)
 
-        r_dict = json.loads(r.text)
-        ew.log('DEBUG', 'end GET request url=%s params=%s' % (url, json.dumps(params)))
+            r_dict = json.loads(r.text)
+        ew.log('DEBUG', 'end GET request url=%s params=%s', url, JSONArg(params))
 
         return r_dict
 
+    def get_cached_response(self, url, params, conditional, ew):
+        # Returns headers of a conditional request and the cached body of
+        # url, or (None, None) if it is not cached
+        if not conditional or self._response_cache is None:
+            return None, None
+        try:
+            return self._response_cache.get(url, params)
+        except Exception as e:
+            ew.log('WARN', 'Failed to read response cache: url=%s %s', url, e)
+            return None, None
+
+    def cache_response(self, url, params, response, ew):
+        # Responses are not cached with response_cache_size = 0
+        if self._response_cache is None:
+            return
+        try:
+            self._response_cache.put(url, params, response)
+        except Exception as e:
+            ew.log('WARN', 'Failed to write response cache: url=%s %s', url, e)
+
+    def record_request(self, url, response, seconds, ew):
+        # Count a response of CircleCI API in metrics of the run
+        metrics = getattr(ew, 'metrics', None)
+        if metrics is not None:
+            metrics.record_request(url, response.status_code, len(response.content), seconds)
+
+    def count_metric(self, name, ew, value=1):
+        # Count name in metrics of the run, if ew is the logger of a run
+        metrics = getattr(ew, 'metrics', None)
+        if metrics is not None:
+            metrics.count(name, value)
+
     def init_kvstore(self, collection_name, ew):
         # Create or Get KV Store Collection
         # Create kv store for circleci project and build checkpoint
@@ -203,69 +911,290 @@ class CircleCIScript(Script):
 
         if collection_name not in service.kvstore:
             try:
-                ew.log('DEBUG', 'Start creating kv store collection: %s' % collection_name)
+                ew.log('DEBUG', 'Start creating kv store collection: %s', collection_name)
                 service.kvstore.create(collection_name)
-                ew.log('DEBUG', 'Success creating kv store collection: %s' % collection_name)
+                ew.log('DEBUG', 'Success creating kv store collection: %s', collection_name)
             except:
-                ew.log('ERROR', 'Failed creating kv store collection: %s' % collection_name)
+                ew.log('ERROR', 'Failed creating kv store collection: %s', collection_name)
 
         try:
-            ew.log('DEBUG', 'Start getting kv store collection: %s' % collection_name)
+            ew.log('DEBUG', 'Start getting kv store collection: %s', collection_name)
             kvstore_collection = service.kvstore[collection_name]
-            ew.log('DEBUG', 'Success getting kv store collection: %s' % collection_name)
+            ew.log('DEBUG', 'Success getting kv store collection: %s', collection_name)
         except Exception as e:
-            ew.log('ERROR', 'Failed getting kv store collection: %s' % collection_name)
-            ew.log('ERROR', e)
+            ew.log('ERROR', 'Failed getting kv store collection: %s %s', collection_name, e)
 
         if kvstore_collection is None:
-            ew.log('ERROR', 'kv store collection is None: %s' % collection_name)
+            ew.log('ERROR', 'kv store collection is None: %s', collection_name)
 
         return kvstore_collection
 
-    def get_checkpoint(self, kvstore_collection, init_data, ew):
+    def prefetch_checkpoints(self, kvstore_collection, keys, ew):
+        # Get checkpoints of all keys with a single batch_find request
+        # instead of one query_by_id request per key
+        # Returns None if batch_find fails so that get_checkpoint falls back
+        # to per-key lookups
+        checkpoint_map = dict()
+        keys = [key for key in keys if key is not None]
+        if len(keys) == 0:
+            return checkpoint_map
+
+        # One query per chunk of keys, all sent in the same request
+        chunk_size = 100
+        dbqueries = [{'query': {'$or': [{'_key': key} for key in keys[i:i+chunk_size]]}} \
+            for i in range(0, len(keys), chunk_size)]
+
+        try:
+            ew.log('DEBUG', 'Start batch_find kv store with keys=%s', len(keys))
+            self.count_metric('kvstore_reads', ew)
+            self.count_metric('kvstore_read_keys', ew, len(keys))
+            results = kvstore_collection.data.batch_find(*dbqueries)
+            for result in results:
+                for checkpoint_data in result:
+                    checkpoint_map[checkpoint_data.get('_key')] = checkpoint_data
+            ew.log('DEBUG', 'Finish batch_find kv store with keys=%s found=%s', len(keys), len(checkpoint_map))
+        except Exception as e:
+            ew.log('WARN', 'Failed batch_find kv store, fall back to per-key lookups: %s', e)
+            self.count_metric('kvstore_failures', ew)
+            return None
+
+        return checkpoint_map
+
+    def get_checkpoint(self, kvstore_collection, init_data, ew, checkpoint_map=None):
 
         checkpoint_data = init_data
         kvstore_key = checkpoint_data.get('_key')
 
+        # Use checkpoint prefetched by prefetch_checkpoints
+        if checkpoint_map is not None:
+            if kvstore_key in checkpoint_map:
+                return checkpoint_map[kvstore_key]
+
+            # Data is not found in kv store
+            # New checkpoint is saved by batch_save of update_checkpoint
+            return checkpoint_data
+
         # Get checkpoint data
         try:
-            ew.log('DEBUG', 'Start kv store with kvstore_key=%s' % kvstore_key)
+            ew.log('DEBUG', 'Start kv store with kvstore_key=%s', kvstore_key)
+            self.count_metric('kvstore_reads', ew)
+            self.count_metric('kvstore_read_keys', ew)
             checkpoint_data = kvstore_collection.data.query_by_id(kvstore_key)
-            ew.log('DEBUG', 'Finish kv store with kvstore_key=%s' % kvstore_key)
+            ew.log('DEBUG', 'Finish kv store with kvstore_key=%s', kvstore_key)
 
         # Get Error
         except HTTPError as e:
-            ew.log('WARN', e)
+            ew.log('WARN', 'HTTPError in getting checkpoint: kvstore_key=%s %s', kvstore_key, e)
             # Data is not found in kv store
             if '404 Not Found' in str(e):
-                ew.log('DEBUG', 'HTTPError in getting checkpoint: %s' % e)
-
-                # Insert new data
-                try:
-                    ew.log('DEBUG', 'Start inserting new kv store data checkpoint_data=%s' % json.dumps(checkpoint_data))
-                    kvstore_collection.data.insert(json.dumps(checkpoint_data))
-                    ew.log('DEBUG', 'Successfully insert new kv store data checkpoint_data=%s' % json.dumps(checkpoint_data))
-                except:
-                    ew.log('ERROR', 'Failed to insert new kv store data checkpoint_data=%s' % json.dumps(checkpoint_data))
+                ew.log('DEBUG', 'HTTPError in getting checkpoint: %s', e)
 
         except Exception as e:
-            ew.log('ERROR', 'Unknown error: %s' % e)
+            ew.log('ERROR', 'Unknown error: %s', e)
 
         return checkpoint_data
 
-    def update_checkpoint(self, kvstore_collection, checkpoint_data, ew):
+    def update_checkpoint(self, checkpoint_buffer, kvstore_collection, checkpoint_data, ew):
         # Update checkpoint data
+        # Checkpoints are inserted or updated by batch_save of checkpoint_buffer
+        ew.log('DEBUG', 'Buffer updated kv store data: %s', JSONArg(checkpoint_data))
+        checkpoint_buffer.add(kvstore_collection, checkpoint_data)
+
+    def open_terminal_cache(self, inputs, ew):
+        # Load terminal workflow and job ids cached under checkpoint_dir
+        # Cache size is the largest terminal_cache_size of inputs, 0 disables it
+        checkpoint_dir = inputs.metadata.get('checkpoint_dir')
+        max_entries = max([self.get_int_parameter(input_item, 'terminal_cache_size', 100000) \
+            for input_item in inputs.inputs.values()] or [0])
+        if checkpoint_dir is None or max_entries == 0:
+            return
+
+        terminal_cache = TerminalCheckpointCache(
+            path=os.path.join(checkpoint_dir, 'circleci_terminal_checkpoints'), 
+            max_entries=max_entries)
         try:
-            # Update kv store
-            kvstore_key = checkpoint_data.get('_key')
-            checkpoint_json = json.dumps(checkpoint_data)
+            terminal_cache.load()
+            self._terminal_cache = terminal_cache
+        except Exception as e:
+            ew.log('WARN', 'Failed to load terminal checkpoint cache: %s', e)
+
+    def open_response_cache(self, inputs, ew):
+        # Open the cache of list responses under checkpoint_dir
+        # Cache size is the largest response_cache_size of inputs in
+        # megabytes, 0 disables it
+        checkpoint_dir = inputs.metadata.get('checkpoint_dir')
+        max_megabytes = max([self.get_int_parameter(input_item, 'response_cache_size', 100) \
+            for input_item in inputs.inputs.values()] or [0])
+        if checkpoint_dir is None or max_megabytes == 0:
+            return
+
+        response_cache = ResponseCache(
+            directory=os.path.join(checkpoint_dir, 'circleci_response_cache'), 
+            max_bytes=max_megabytes * 1024 * 1024)
+        try:
+            response_cache.load()
+            self._response_cache = response_cache
+        except Exception as e:
+            ew.log('WARN', 'Failed to open response cache: %s', e)
+
+    def open_job_detail_cache(self, inputs, ew):
+        # Open the cache of job details of finished builds under checkpoint_dir
+        # Cache size in megabytes and TTL are the largest of inputs, and
+        # job_detail_cache_size 0 of all inputs disables it
+        checkpoint_dir = inputs.metadata.get('checkpoint_dir')
+        max_megabytes = max([self.get_int_parameter(input_item, 'job_detail_cache_size', 100) \
+            for input_item in inputs.inputs.values()] or [0])
+        ttl = max([self.get_int_parameter(input_item, 'job_detail_cache_ttl', 604800) \
+            for input_item in inputs.inputs.values()] or [604800])
+        if checkpoint_dir is None or max_megabytes == 0:
+            return
+
+        job_detail_cache = JobDetailCache(
+            directory=os.path.join(checkpoint_dir, 'circleci_job_detail_cache'), 
+            max_bytes=max_megabytes * 1024 * 1024, 
+            ttl=ttl)
+        try:
+            job_detail_cache.load()
+            self._job_detail_cache = job_detail_cache
+        except Exception as e:
+            ew.log('WARN', 'Failed to open job detail cache: %s', e)
 
-            ew.log('DEBUG', 'Start updating kv store: %s' % checkpoint_json)
-            kvstore_collection.data.update(kvstore_key, checkpoint_json)
-            ew.log('DEBUG', 'Successfully update kv store: %s' % checkpoint_json)
+    def get_cached_job_detail(self, job, ew):
+        # Returns the cached job detail of a finished job, or None
+        if self._job_detail_cache is None or job.get('status') not in TERMINAL_STATUSES:
+            return None
+        try:
+            job_detail = self._job_detail_cache.get(job.get('project_slug'), job.get('job_number'))
+        except Exception as e:
+            ew.log('WARN', 'Failed to read job detail cache: project_slug=%s job_number=%s %s', 
+                job.get('project_slug'), job.get('job_number'), e)
+            return None
+        if job_detail is not None:
+            ew.log('DEBUG', 'job detail cached: project_slug=%s job_number=%s', job.get('project_slug'), job.get('job_number'))
+            self.count_metric('skipped_job_details_by_cache', ew)
+        return job_detail
+
+    def cache_job_detail(self, job, job_detail, ew):
+        # Cache the job detail of a finished build, and returns it
+        if self._job_detail_cache is not None:
+            try:
+                self._job_detail_cache.put(job.get('project_slug'), job.get('job_number'), job_detail)
+            except Exception as e:
+                ew.log('WARN', 'Failed to write job detail cache: project_slug=%s job_number=%s %s', 
+                    job.get('project_slug'), job.get('job_number'), e)
+        return job_detail
+
+    def save_terminal_cache(self, ew):
+        if self._terminal_cache is None:
+            return
+        try:
+            self._terminal_cache.save()
         except Exception as e:
-            ew.log('ERROR', 'Failed to update kv store: %s' % checkpoint_json)
-            ew.log('ERROR', e)
+            ew.log('WARN', 'Failed to save terminal checkpoint cache: %s', e)
+
+    def close_terminal_cache(self, ew):
+        self.save_terminal_cache(ew=ew)
+        self._terminal_cache = None
+
+    def is_terminal_cached(self, key, status, ew):
+        # Returns True if key is cached with the same terminal status
+        if self._terminal_cache is None or key is None:
+            return False
+        if self._terminal_cache.get(key) == status:
+            ew.log('DEBUG', 'skip terminal checkpoint cached: key=%s status=%s', key, status)
+            return True
+        return False
+
+    def get_int_parameter(self, input_item, name, default):
+        # Optional parameters are not passed by splunkd when they are left empty
+        value = input_item.get(name)
+        if value is None or str(value).strip() == '':
+            return default
+        return int(value)
+
+    def get_bool_parameter(self, input_item, name, default):
+        # Boolean parameters are passed as 0/1 or false/true
+        value = input_item.get(name)
+        if value is None or str(value).strip() == '':
+            return default
+        return str(value).strip().lower() in ('1', 'true')
+
+    def get_fetch(self, executor, fetch):
+        # fetch is get_list_api or get_dict_api
+        # The async engine runs their coroutine twin with the HTTP client of
+        # its event loop instead
+        if getattr(executor, 'is_async', False):
+            return partial(getattr(self, fetch.__name__ + '_async'), executor.client)
+        return fetch
+
+    def fetch_one(self, executor, fetch, url, **kwargs):
+        # Request a single url with the engine of executor
+        return executor.submit(self.get_fetch(executor, fetch), url, **kwargs).result()
+
+    def map_ordered(self, executor, fetch, urls, errors=(), **kwargs):
+        # Submit every url to the engine and yield results in the order of
+        # urls, so that callers can write events in the same order as the
+        # serial traversal. Pending requests are cancelled if the caller stops
+        # consuming results.
+        # Exceptions of errors are yielded as results of their url, so that
+        # the caller can skip it and go on
+        fetch = self.get_fetch(executor, fetch)
+        futures = [executor.submit(fetch, url, **kwargs) for url in urls]
+        try:
+            for future in futures:
+                try:
+                    result = future.result()
+                except errors as e:
+                    result = e
+                yield result
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def get_workflows_endpoint(self, pipeline):
+        # Get pipeline workflows
+        # /api/v2/pipeline/{pipeline-id}/workflow
+        # https://circleci.com/docs/api/v2/#get-a-pipeline-39-s-workflows
+        return '%s/v2/pipeline/%s/workflow' % (self.api_url, pipeline.get('id'))
+
+    def get_jobs_endpoint(self, workflow):
+        # Get Jobs in a workflow
+        # /workflow/{id}/job
+        # https://circleci.com/docs/api/v2/#get-a-workflow-39-s-jobs
+        return '%s/v2/workflow/%s/job' % (self.api_url, workflow.get('id'))
+
+    def get_job_detail_endpoint(self, job):
+        # Returns full details for a single build. The response includes all of 
+        # the fields from the build summary.
+        # /project/:vcs-type/:username/:project/:build_num
+        return '%s/v1.1/project/%s/%s' \
+            % (self.api_url, job.get('project_slug'), job.get('job_number'))
+
+    def get_job_summary_endpoint(self, job):
+        # Returns job details of API v2, which doesn't include steps
+        # /project/{project-slug}/job/{job-number}
+        # https://circleci.com/docs/api/v2/#get-job-details
+        return '%s/v2/project/%s/job/%s' \
+            % (self.api_url, job.get('project_slug'), job.get('job_number'))
+
+    def get_event_time(self, timestamp):
+        # Returns a timestamp of CircleCI API as epoch seconds with
+        # milliseconds for Event.time, or None if it can't be parsed
+        match = TIMESTAMP_PATTERN.match(timestamp or '')
+        if match is None:
+            return None
+        year, month, day, hour, minute, second, fraction = match.groups()
+        epoch = calendar.timegm((int(year), int(month), int(day), int(hour), int(minute), int(second), 0, 0, 0))
+        return '%d.%s' % (epoch, ((fraction or '') + '000')[:3])
+
+    def needs_job_detail(self, job_status, job_detail_filter):
+        # Returns True if API v1.1 job detail is requested for a job in
+        # job_status which is new to its checkpoint
+        if job_detail_filter == 'terminal':
+            return job_status in TERMINAL_STATUSES
+        elif job_detail_filter == 'failed':
+            return job_status in FAILED_STATUSES
+        return True
 
     def stream_events(self, inputs, ew):
         """This function handles all the action: splunk calls this modular input
@@ -280,359 +1209,1156 @@ class CircleCIScript(Script):
         :param ew: an EventWriter object
         """
 
+        # Buffer size and interval of BufferedEventWriter are the largest of
+        # all inputs
+        if isinstance(ew, BufferedEventWriter):
+            ew.flush_size = max([self.get_int_parameter(input_item, 'event_flush_size', ew.flush_size) \
+                for input_item in inputs.inputs.values()] or [ew.flush_size])
+            ew.flush_interval = max([self.get_int_parameter(input_item, 'event_flush_interval', ew.flush_interval) \
+                for input_item in inputs.inputs.values()] or [ew.flush_interval])
+
+        # Events and logs of inputs in parallel are written one at a time
+        ew = SynchronizedEventWriter(ew)
+
+        # Sessions are shared by inputs with the same API token, so their pool
+        # fits the largest of those inputs which run in parallel, up to
+        # org_workers of them
+        org_workers = max([self.get_int_parameter(input_item, 'org_workers', 1) \
+            for input_item in inputs.inputs.values()] or [1])
+        pool_sizes = dict()
+        for input_item in inputs.inputs.values():
+            pool_sizes.setdefault(input_item.get('api_token'), list()).append(self.get_pool_size(input_item))
+        self._pool_sizes = dict((api_token, sum(sorted(sizes, reverse=True)[:org_workers])) \
+            for api_token, sizes in pool_sizes.items())
+
         # KV Store Collection name
         workflow_collection_name = '_circleci_workflow_checkpoint_collection'
         job_collection_name = '_circleci_job_checkpoint_collection'
+        pipeline_collection_name = '_circleci_pipeline_checkpoint_collection'
 
         workflow_kvstore_collection = self.init_kvstore(collection_name=workflow_collection_name, ew=ew)
         job_kvstore_collection = self.init_kvstore(collection_name=job_collection_name, ew=ew)
+        pipeline_kvstore_collection = self.init_kvstore(collection_name=pipeline_collection_name, ew=ew)
 
-        # Go through each input for this modular input
-        for input_name, input_item in six.iteritems(inputs.inputs):
-            # Get fields from the InputDefinition object
-            api_token = input_item["api_token"]
-            interval = int(input_item["interval"])
-            vcs = input_item["vcs"]
-            org = input_item["org"]
-            ew.log('INFO', 'read circieci api_token=%s vcs=%s org=%s' % (api_token, vcs, org))
-
-            # Create an Event object, and set its fields
-            event = Event()
-            event.stanza = input_name
-            event.host = 'circleci.com'
-
-            # Get all pipelines
-            # Lists all pipelines you are following on CircleCI
-            # /api/v2/pipelineorg-slug=github/organization
-            # https://circleci.com/docs/api/v2/#get-a-list-of-pipelines
-            pipeline_endpoint = 'https://circleci.com/api/v2/pipeline'
-
-            ew.log('DEBUG', 'start GET request pipeline_endpoint: %s' % pipeline_endpoint)
-            params = {
-                'org-slug': vcs + '/' + org
-            }
+        self._checkpoint_dir = inputs.metadata.get('checkpoint_dir')
+        self.open_terminal_cache(inputs=inputs, ew=ew)
+        self.open_response_cache(inputs=inputs, ew=ew)
+        self.open_job_detail_cache(inputs=inputs, ew=ew)
+        self.handle_stop_signals(ew=ew)
 
-            # Set pipeline page limit to be determined based on interval
-            # Max: 100 pages
-            pipeline_limit = min(interval // 60, 100)
+        try:
+            self.schedule_inputs(
+                inputs=inputs, 
+                workflow_kvstore_collection=workflow_kvstore_collection, 
+                job_kvstore_collection=job_kvstore_collection, 
+                pipeline_kvstore_collection=pipeline_kvstore_collection, 
+                ew=ew)
+        finally:
+            self.close_sessions(ew=ew)
+            self.close_hec_senders(ew=ew)
+            self.close_terminal_cache(ew=ew)
+            self._response_cache = None
+            self._job_detail_cache = None
+            ew.flush()
+
+    def schedule_inputs(self, inputs, workflow_kvstore_collection, job_kvstore_collection, pipeline_kvstore_collection, ew):
+        # Run each input at its interval until the process is stopped
+        # Inputs run in parallel with up to org_workers threads, and HTTP
+        # sessions, rate limiters and the terminal checkpoint cache are shared
+        # by all inputs across runs
+        org_workers = max([self.get_int_parameter(input_item, 'org_workers', 1) \
+            for input_item in inputs.inputs.values()] or [1])
+        next_runs = dict((input_name, time.time()) for input_name in inputs.inputs)
+        ew.log('INFO', 'Start scheduling inputs: %s org_workers=%s', 
+            ', '.join(sorted(next_runs)), org_workers)
+
+        # Set when an input finishes or the process is stopped
+        wakeup = threading.Event()
+        self._stop_event_listeners.append(wakeup.set)
+
+        # Running inputs by name
+        running = dict()
+        org_executor = ThreadPoolExecutor(max_workers=org_workers)
+        try:
+            while next_runs and not self._stop_event.is_set():
+                wakeup.clear()
+
+                # Reschedule finished inputs
+                for input_name, future in list(running.items()):
+                    if future.done():
+                        del running[input_name]
+                        started = future.result()
+                        # Runs longer than the interval are followed by the next run at once
+                        next_runs[input_name] = max(started + int(inputs.inputs[input_name]['interval']), time.time())
+                        ew.log('INFO', 'Next run of input: %s in %s seconds', 
+                            input_name, int(next_runs[input_name] - time.time()))
+
+                # Start inputs which are due, in order of their due time
+                now = time.time()
+                for input_name in sorted(next_runs, key=next_runs.get):
+                    if input_name not in running and next_runs[input_name] <= now:
+                        future = org_executor.submit(self.run_input, 
+                            input_name=input_name, 
+                            input_item=inputs.inputs[input_name], 
+                            workflow_kvstore_collection=workflow_kvstore_collection, 
+                            job_kvstore_collection=job_kvstore_collection, 
+                            pipeline_kvstore_collection=pipeline_kvstore_collection, 
+                            ew=ew)
+                        future.add_done_callback(lambda future: wakeup.set())
+                        running[input_name] = future
+
+                # Wait until the next input is due or a running one finishes
+                waiting = [next_runs[input_name] for input_name in next_runs if input_name not in running]
+                timeout = max(min(waiting) - time.time(), 0) if waiting else None
+                wakeup.wait(timeout)
+        finally:
+            # Running inputs stop at their next pipeline once stopped
+            org_executor.shutdown(wait=True)
+            self._stop_event_listeners.remove(wakeup.set)
+
+        ew.log('INFO', 'Stop scheduling inputs')
+
+    def run_input(self, input_name, input_item, workflow_kvstore_collection, job_kvstore_collection, pipeline_kvstore_collection, ew):
+        # Run an input within its time budget, and returns the time it started
+        started = time.time()
+        max_run_seconds = self.get_int_parameter(input_item, 'max_run_seconds', 0)
+        deadline = started + max_run_seconds if 0 < max_run_seconds else None
+        # Logs below log_level are dropped before formatted, and repeated
+        # ones are rate limited unless debugging
+        log_level = input_item.get('log_level') or 'INFO'
+        # Counters and timings of the run are written as a metrics event
+        metrics = RunMetrics()
+        logger = LeveledLogger(ew, level=log_level, repeat_limit=0 if log_level == 'DEBUG' else LOG_REPEAT_LIMIT, 
+            metrics=metrics)
+        status = 'success'
+        profiler = self.start_profiler(input_name=input_name, input_item=input_item, ew=ew)
+        try:
+            # Events of the run go to HTTP Event Collector with hec output mode
+            event_writer = self.get_event_writer(input_item=input_item, ew=ew)
+            logger.ew = event_writer
+            self.collect_input(
+                input_name=input_name, 
+                input_item=input_item, 
+                deadline=deadline, 
+                workflow_kvstore_collection=workflow_kvstore_collection, 
+                job_kvstore_collection=job_kvstore_collection, 
+                pipeline_kvstore_collection=pipeline_kvstore_collection, 
+                ew=logger)
+            if isinstance(event_writer, HECEventWriter):
+                event_writer.flush()
+                self.log_hec_stats(event_writer.sender, ew)
+        except Exception as e:
+            # Keep other inputs running, and retry this one at its next run
+            ew.log('ERROR', 'Failed to process input: %s %s', input_name, e)
+            status = 'failed'
+        self.stop_profiler(profiler=profiler, input_name=input_name, ew=ew)
+        logger.summary(input_name)
+        self.write_metrics(input_name, metrics.to_dict(input_name, logger.events, status), ew)
+        self.save_terminal_cache(ew=ew)
+        # Write events of this run before waiting for the next one
+        ew.flush()
+        return started
+
+    def start_profiler(self, input_name, input_item, ew):
+        # Returns the profiler of a run if profile of the input is true or
+        # CIRCLECI_PROFILE is set, and None otherwise
+        if not (self.get_bool_parameter(input_item, 'profile', False) or is_profile_env_enabled()):
+            return None
+        if self._checkpoint_dir is None:
+            ew.log('WARN', 'Skip profiling run without checkpoint directory: %s', input_name)
+            return None
+
+        profiler = RunProfiler(directory=os.path.join(self._checkpoint_dir, 'circleci_profiles'), input_name=input_name)
+        try:
+            if profiler.start():
+                return profiler
+            ew.log('WARN', 'Skip profiling run while another run is profiled: %s', input_name)
+        except Exception as e:
+            ew.log('WARN', 'Failed to start profiling run: %s %s', input_name, e)
+        return None
 
-            # HTTP Get Request
-            pipelines = self.get_list_api(url=pipeline_endpoint, api_token=api_token, params=params, limit=pipeline_limit, ew=ew)
+    def stop_profiler(self, profiler, input_name, ew):
+        # Write the profile of a run and log its hot functions
+        if profiler is None:
+            return
+        try:
+            path = profiler.stop()
+        except Exception as e:
+            ew.log('WARN', 'Failed to write profile: %s %s', input_name, e)
+            return
+
+        for rank, (ncalls, tottime, cumtime, function) in enumerate(profiler.top(), 1):
+            ew.log('INFO', 'Profile hot function: input=%s rank=%s tottime=%.3f cumtime=%.3f ncalls=%s function=%s', 
+                input_name, rank, tottime, cumtime, ncalls, function)
+        ew.log('INFO', 'Profile written: input=%s path=%s', input_name, path)
+
+    def write_metrics(self, input_name, metrics_data, ew):
+        # Write metrics of a run as an event to splunkd, also with hec output
+        # mode so that they are indexed while HTTP Event Collector is down
+        template = EventTemplate(
+            stanza=input_name, 
+            sourcetype='circleci:collector:metrics')
+        try:
+            ew.write_template(template, json.dumps(metrics_data, sort_keys=True), '%.3f' % time.time())
+        except Exception as e:
+            ew.log('ERROR', 'Failed to write collector metrics event: %s %s', input_name, e)
+
+    def get_event_writer(self, input_item, ew):
+        # Returns the event writer of a run of the input
+        # With hec output mode, events are sent to HTTP Event Collector by a
+        # sender shared by inputs with the same HEC settings, and logs are
+        # still written to ew
+        if (input_item.get('output_mode') or 'stdout') != 'hec':
+            return ew
+
+        hec_url = input_item.get('hec_url') or 'https://localhost:8088'
+        hec_token = input_item['hec_token']
+        hec_ack = self.get_bool_parameter(input_item, 'hec_ack', False)
+        hec_verify_ssl = self.get_bool_parameter(input_item, 'hec_verify_ssl', True)
+        with self._hec_senders_lock:
+            key = (hec_url, hec_token, hec_ack, hec_verify_ssl)
+            sender = self._hec_senders.get(key)
+            if sender is None:
+                sender = HECSender(
+                    url=hec_url, 
+                    token=hec_token, 
+                    ack=hec_ack, 
+                    verify=hec_verify_ssl, 
+                    queue_size=self.get_int_parameter(input_item, 'hec_queue_size', 8), 
+                    max_retries=self.get_int_parameter(input_item, 'max_retries', 3))
+                self._hec_senders[key] = sender
+                ew.log('INFO', 'Open HTTP Event Collector sender: url=%s hec_token=****%s ack=%s', 
+                    hec_url, hec_token[-4:], hec_ack)
+        # splunkd applies index of the stanza to events of stdout, but HTTP
+        # Event Collector indexes events without index to the default index
+        # of the token
+        index = input_item.get('index')
+        return HECEventWriter(ew=ew, sender=sender, batch_size=self.get_int_parameter(input_item, 'hec_batch_size', 1048576), 
+            index=index if index != 'default' else None)
+
+    def close_hec_senders(self, ew):
+        # Send all queued events, log stats of each sender, then close it
+        with self._hec_senders_lock:
+            senders = list(self._hec_senders.items())
+            self._hec_senders.clear()
+
+        for key, sender in senders:
+            sender.close()
+            self.log_hec_stats(sender, ew)
+
+    def log_hec_stats(self, sender, ew):
+        num_events, num_batches, num_resent, num_bytes = sender.pop_stats()
+        ew.log('INFO', 'HTTP Event Collector stats: url=%s hec_token=****%s events=%s batches=%s resent=%s bytes=%s failures=%s', 
+            sender.url, sender.token[-4:], num_events, num_batches, num_resent, num_bytes, sender.failures)
+
+    def is_out_of_time(self, deadline):
+        # Returns True if the process is stopped or the time budget of the
+        # input is over
+        return self._stop_event.is_set() or (deadline is not None and deadline <= time.time())
+
+    def handle_stop_signals(self, ew):
+        # splunkd stops the process with SIGTERM at shutdown and when inputs are
+        # changed, so stop after the current run to save its checkpoints
+        def stop(signum, frame):
+            ew.log('INFO', 'Received signal %s, stop after the current run', signum)
+            self._stop_event.set()
+            for listener in self._stop_event_listeners:
+                listener()
+
+        try:
+            signal.signal(signal.SIGTERM, stop)
+            signal.signal(signal.SIGINT, stop)
+        except ValueError:
+            # Signals can only be handled in the main thread
+            pass
+
+    def collect_input(self, input_name, input_item, deadline, workflow_kvstore_collection, job_kvstore_collection, pipeline_kvstore_collection, ew):
+        # Get fields from the InputDefinition object
+        api_token = input_item["api_token"]
+        interval = int(input_item["interval"])
+        vcs = input_item["vcs"]
+        org = input_item["org"]
+        max_concurrency = self.get_int_parameter(input_item, 'max_concurrency', 1)
+        pool_size = self.get_pool_size(input_item)
+        engine = input_item.get('engine') or 'thread'
+        job_detail_filter = input_item.get('job_detail') or 'all'
+        checkpoint_batch_size = self.get_int_parameter(input_item, 'checkpoint_batch_size', 500)
+        checkpoint_max_age = self.get_int_parameter(input_item, 'checkpoint_max_age', 30)
+        rate_limit = float(input_item.get('rate_limit') or 0)
+        max_retries = self.get_int_parameter(input_item, 'max_retries', 3)
+        ew.log('INFO', 'read circieci api_token=%s vcs=%s org=%s max_concurrency=%s pool_size=%s engine=%s', 
+            api_token, vcs, org, max_concurrency, pool_size, engine)
+
+        # Requests of the same API token share a rate limit across inputs
+        get_scheduler(api_token, rate=rate_limit, max_retries=max_retries)
+
+        # Updated checkpoints are saved in batches
+        checkpoint_buffer = CheckpointBuffer(ew=ew, batch_size=checkpoint_batch_size, max_age=checkpoint_max_age)
+        # Terminal ids are cached once their checkpoint is saved
+        if self._terminal_cache is not None:
+            checkpoint_buffer.listeners.append(self._terminal_cache.add_checkpoints)
+
+        # API requests are fanned out to a bounded pool of workers, or to
+        # coroutines on a single event loop with the async engine, while
+        # events and checkpoints are written from this thread only
+        client = None
+        if engine == 'async':
+            client = AsyncHTTPClient(headers={
+                'Circle-Token': api_token,
+                'Accept': 'application/json',
+                'Accept-Encoding': 'gzip'
+            }, pool_size=pool_size)
+            executor = AsyncExecutor(max_workers=max_concurrency, client=client)
+        else:
+            # Open pooled session for this API token
+            self.get_session(api_token)
+            executor = ThreadPoolExecutor(max_workers=max_concurrency)
+
+        try:
+            self.collect_pipelines(
+                input_name=input_name, 
+                api_token=api_token, 
+                interval=interval, 
+                vcs=vcs, 
+                org=org, 
+                deadline=deadline, 
+                executor=executor, 
+                job_detail_filter=job_detail_filter, 
+                workflow_kvstore_collection=workflow_kvstore_collection, 
+                job_kvstore_collection=job_kvstore_collection, 
+                pipeline_kvstore_collection=pipeline_kvstore_collection, 
+                checkpoint_buffer=checkpoint_buffer, 
+                ew=ew)
+        finally:
+            executor.shutdown(wait=True)
+            # Save checkpoints of events written so far
+            checkpoint_buffer.flush()
+            # Requests, connections, throttles and retries are counted in
+            # metrics of this run, as inputs with the same API token in
+            # parallel share its session and rate limit
+            if client is not None:
+                self.count_metric('api_connections', ew, client.num_connections)
+            self.log_http_stats(api_token, ew)
+
+        ew.log('INFO', 'Finish processing input: api_token=%s vcs=%s org=%s', api_token, vcs, org)
+
+    def collect_pipelines(self, input_name, api_token, interval, vcs, org, deadline, executor, job_detail_filter, workflow_kvstore_collection, job_kvstore_collection, pipeline_kvstore_collection, checkpoint_buffer, ew):
+
+        # Create an event template of each sourcetype, whose fields other than
+        # data are encoded once for this input
+        event_templates = dict((sourcetype, EventTemplate(
+            stanza=input_name, 
+            host='circleci.com', 
+            sourcetype=sourcetype)) for sourcetype in ('circleci:workflow', 'circleci:job', 'circleci:step'))
+
+        # Get all pipelines
+        # Lists all pipelines you are following on CircleCI
+        # /api/v2/pipelineorg-slug=github/organization
+        # https://circleci.com/docs/api/v2/#get-a-list-of-pipelines
+        pipeline_endpoint = '%s/v2/pipeline' % self.api_url
+
+        ew.log('DEBUG', 'start GET request pipeline_endpoint: %s', pipeline_endpoint)
+        params = {
+            'org-slug': vcs + '/' + org
+        }
+
+        # Set pipeline page limit to be determined based on interval
+        # Max: 100 pages
+        pipeline_limit = min(interval // 60, 100)
+
+        # Pipeline checkpoint
+        # updated_at is the high-water mark of pipelines fully processed in the org
+        # cursor is the position where the last run stopped, if it was cut off
+        pipeline_checkpoint_data = {
+            '_key': vcs + ':' + org,
+            'updated_at': None,
+            'cursor': None
+        }
+        pipeline_checkpoint_data = self.get_checkpoint(
+            kvstore_collection=pipeline_kvstore_collection, 
+            init_data=pipeline_checkpoint_data, 
+            ew=ew)
+        high_water_mark = pipeline_checkpoint_data.get('updated_at')
+        ew.log('INFO', 'pipeline high-water mark vcs=%s org=%s updated_at=%s', vcs, org, high_water_mark)
+
+        # Stop pagination at a page whose pipelines are all below the mark
+        stop = None
+        if high_water_mark is not None:
+            stop = partial(self.is_below_high_water_mark, high_water_mark=high_water_mark)
+
+        # updated_at of processed pipelines, and whether they are settled
+        pipeline_results = list()
+
+        # Resume from the cursor of the last run
+        resume_cursor = pipeline_checkpoint_data.get('cursor')
+        if resume_cursor is not None:
+            ew.log('INFO', 'resume pipelines from cursor vcs=%s org=%s pipeline_id=%s workflow_id=%s', 
+                vcs, org, resume_cursor.get('pipeline_id'), resume_cursor.get('workflow_id'))
+            if resume_cursor.get('page_token') is not None:
+                params['page-token'] = resume_cursor.get('page_token')
+            # Pipelines processed before the cursor count for the new mark
+            pipeline_results.extend(tuple(result) for result in resume_cursor.get('results') or [])
+
+        # Pipelines of each page are processed as soon as the page arrives
+        # HTTP Get Request
+        pipeline_pages = self.iter_list_pages(url=pipeline_endpoint, api_token=api_token, 
+            params=params, limit=pipeline_limit, ew=ew, stop=stop, executor=executor, with_page_token=True)
+        try:
+            first_page = next(pipeline_pages, None)
+        except Exception as e:
+            if resume_cursor is None:
+                raise
+            # Page token of the cursor may have expired
+            ew.log('WARN', 'Failed to resume pipelines from cursor, start from the first page vcs=%s org=%s %s', vcs, org, e)
+            resume_cursor = None
+            del pipeline_results[:]
+            params.pop('page-token', None)
+            pipeline_pages = self.iter_list_pages(url=pipeline_endpoint, api_token=api_token, 
+                params=params, limit=pipeline_limit, ew=ew, stop=stop, executor=executor, with_page_token=True)
+            first_page = next(pipeline_pages, None)
+        if first_page is not None:
+            pipeline_pages = itertools.chain([first_page], pipeline_pages)
+
+        # Position of the traversal saved with checkpoints, so that the next
+        # run resumes from it if this run is cut off or killed
+        cursor = dict()
+        save_cursor = partial(self.save_cursor, 
+            cursor=cursor, 
+            pipeline_checkpoint_data=pipeline_checkpoint_data, 
+            pipeline_results=pipeline_results, 
+            pipeline_kvstore_collection=pipeline_kvstore_collection, 
+            checkpoint_buffer=checkpoint_buffer, 
+            ew=ew)
+
+        # Set when max_run_seconds is over before all pages are processed
+        cut_off = False
+
+        for page_token, pipelines in pipeline_pages:
+
+            # Stop at max_run_seconds, and resume from the cursor next run
+            if self.is_out_of_time(deadline):
+                cut_off = True
+                break
 
+            # Skip pipelines processed before the cursor in its page
+            resume_pipeline_id = None
+            resume_workflow_id = None
+            if resume_cursor is not None:
+                pipeline_ids = [pipeline.get('id') for pipeline in pipelines]
+                if resume_cursor.get('page_token') == page_token and resume_cursor.get('pipeline_id') in pipeline_ids:
+                    index = pipeline_ids.index(resume_cursor.get('pipeline_id'))
+                    if resume_cursor.get('pipeline_done'):
+                        index += 1
+                    else:
+                        resume_pipeline_id = resume_cursor.get('pipeline_id')
+                        resume_workflow_id = resume_cursor.get('workflow_id')
+                    pipelines = pipelines[index:]
+                resume_cursor = None
+
+            valid_pipelines = list()
             for pipeline in pipelines:
                 ew.log('DEBUG', 'Start getting each element from pipeline object')
                 pipeline_id = pipeline.get('id')
                 project_slug = pipeline.get('project_slug')
                 pipeline_num = pipeline.get('number')
-                updated_at = pipeline.get('updated_at')
                 ew.log('DEBUG', 'Finish getting each element from project object')
 
                 # If no data in either of username, vcs_type, or reponame, then skip
                 if pipeline_id is None or project_slug is None or pipeline_num is None:
-                    ew.log('WARN', 'skip id=%s project_slug=%s pipeline_num=%s' % (pipeline_id, project_slug, pipeline_num))
+                    ew.log('WARN', 'skip id=%s project_slug=%s pipeline_num=%s', pipeline_id, project_slug, pipeline_num)
                     continue
 
-                ew.log('INFO', 'Start processing pipeline: project_slug=%s number=%s' % (project_slug, pipeline_num))
-
-
-                # Get pipeline workflows
-                # /api/v2/pipeline/{pipeline-id}/workflow
-                # https://circleci.com/docs/api/v2/#get-a-pipeline-39-s-workflows
-                workflows_endpoint = 'https://circleci.com/api/v2/pipeline/%s/workflow' % pipeline_id
-                ew.log('DEBUG', 'start GET request workflows_endpoint=%s' % workflows_endpoint)
-
-                # HTTP Get Request
-                now = datetime.datetime.utcnow()
-                workflows = self.get_list_api(url=workflows_endpoint, api_token=api_token, params=dict(), limit=None, ew=ew)
-
-
-                for workflow in workflows:
-
-                    workflow_id = workflow.get('id')
-                    workflow_name = workflow.get('name')
-                    workflow_status = workflow.get('status')
-                    project_slug = workflow.get('project_slug')
-
-                    # 
-                    if workflow_id is None:
-                        ew.log('DEBUG', 'workflow_id is None workflow_id=%s workflow_name=%s' \
-                            % (workflow_id, workflow_name))
-                        continue
-
-                    # Workflow checkpoint
-                    ew.log('INFO', 'Getting workflow checkpoint')
-                    workflow_checkpoint_data = {
-                        '_key': workflow_id,
-                        'name': workflow_name,
-                        'project_slug': project_slug,
-                        'status': 'Unknown'
-                    }
-                    workflow_checkpoint_data = self.get_checkpoint(
-                        kvstore_collection=workflow_kvstore_collection, 
-                        init_data=workflow_checkpoint_data, 
-                        ew=ew)
-
-                    # Checkpoint definition
-                    write_workflow_to_splunk = True
-                    workflow_checkpoint_status = workflow_checkpoint_data.get('status')
-
-                    # If status matches checkpoint's value, skip the following process
-                    if workflow_status == workflow_checkpoint_status:
-                        # If status is still running, don't skip but don't write to splunk
-                        if workflow_status == 'running':
-                            write_workflow_to_splunk == False
-                        else:
-                            ew.log('DEBUG', 'skip this workflow: project_slug=%s workflow_name=%s status=%s checkpoint_status=%s' \
-                                % (project_slug, workflow_name, workflow_status, workflow_checkpoint_status))
-                            continue
-
-                    ew.log('INFO', 'Start processing workflow: project_slug=%s name=%s id=%s' \
-                        % (project_slug, workflow_name, workflow_id))
-
-                    # add field workflow_time for _time
-                    if workflow.get('stopped_at') is not None:
-                        workflow['workflow_time'] = workflow.get('stopped_at')
-                    else:
-                        # set current time as %Y-%m-%dT%H:%M:%S.%2NZ
-                        workflow['workflow_time'] = now.strftime('%Y-%m-%dT%H:%M:%S') + 'Z'
-                    # Attach pipeline data at workflow
-                    workflow['trigger'] = pipeline['trigger']
-                    workflow['vcs'] = pipeline['vcs']
-                    # Add username and reponame to comply with job data
-                    if sys.version_info[0] == 2:
-                        project_slug = project_slug.encode('utf-8')
-                    elif sys.version_info[0] == 3:
-                        project_slug = project_slug
-                    left_separator = project_slug.find('/')
-                    right_separator = project_slug.rfind('/')
-                    workflow['username'] = project_slug[left_separator+1:right_separator]
-                    workflow['reponame'] = project_slug[right_separator+1:]
-
-                    # Set workflow sourcetype
-                    event.sourceType = 'circleci:workflow'
-
-                    # Set event data
-                    event.data = json.dumps(workflow)
-
-                    # Write event data to Splunk
-                    if write_workflow_to_splunk:
-                        try:
-                            ew.write_event(event)
-                            ew.log('DEBUG', 'Successfully write circleci workflow event: workflow_id=%s workflow_name=%s project_slug=%s' \
-                                % (workflow_id, workflow_name, project_slug))
-
-                        except Exception as e:
-                            ew.log('ERROR', 'Failed to write circleci workflow event: workflow_id=%s workflow_name=%s project_slug=%s' \
-                                % (workflow_id, workflow_name, project_slug))
-                            ew.log('ERROR', e)
-                            continue
-
-                    # Get Jobs in a workflow
-                    # /workflow/{id}/job
-                    # https://circleci.com/docs/api/v2/#get-a-workflow-39-s-jobs
-                    jobs_endpoint = 'https://circleci.com/api/v2/workflow/%s/job' % workflow_id
-                    ew.log('DEBUG', 'start GET request jobs_endpoint=%s' % jobs_endpoint)
-
-                    # HTTP Get Request
-                    jobs = self.get_list_api(url=jobs_endpoint, api_token=api_token, params=dict(), limit=None, ew=ew)
-
-
-                    # 
-                    for job in jobs:
-
-                        job_id = job.get('id')
-                        job_number = job.get('job_number')
-                        project_slug = job.get('project_slug')
-                        job_status = job.get('status')
-
-                        if job_number is None:
-                            ew.log('WARN', 'skip this job: project_slug=%s job_number=%s' \
-                                % (project_slug, job_number))
-                            continue
-
-                        # Job checkpoint
-                        ew.log('INFO', 'Getting job checkpoint')
-                        job_checkpoint_data = {
-                            '_key': job_id,
-                            'job_number': job_number,
-                            'project_slug': project_slug,
-                            'status': 'Unknown'
-                        }
-                        job_checkpoint_data = self.get_checkpoint(
-                            kvstore_collection=job_kvstore_collection, 
-                            init_data=job_checkpoint_data, 
-                            ew=ew)
+                # Pipelines below the high-water mark have been fully processed
+                if self.is_below_high_water_mark([pipeline], high_water_mark):
+                    ew.log('DEBUG', 'skip pipeline below high-water mark id=%s project_slug=%s pipeline_num=%s', 
+                        pipeline_id, project_slug, pipeline_num)
+                    self.count_metric('skipped_pipelines', ew)
+                    continue
 
-                        # Checkpoint definition
-                        write_job_to_splunk = True
-                        job_checkpoint_status = job_checkpoint_data.get('status')
-
-                        # If status matches checkpoint's value, skip the following process
-                        if job_status == job_checkpoint_status:
-                            # If status is still running, don't skip but don't write to splunk
-                            if job_status == 'running':
-                                write_job_to_splunk == False
-                            else:
-                                ew.log('DEBUG', 'skip this job: project_slug=%s job_number=%s status=%s checkpoint_status=%s' \
-                                    % (project_slug, job_number, job_status, job_checkpoint_status))
-                                continue
-
-                        ew.log('INFO', 'Start processing job event: project_slug=%s build_num=%s' \
-                            % (project_slug, str(job_number)))
-
-                        # Set sourcetype in event data
-                        event.sourceType = 'circleci:job'
-
-                        # Set current time to set job_time
-                        now = datetime.datetime.utcnow()
-
-                        # Returns full details for a single build. The response includes all of 
-                        # the fields from the build summary.
-                        # /project/:vcs-type/:username/:project/:build_num
-                        job_detail_endpoint = 'https://circleci.com/api/v1.1/project/%s/%s' \
-                            % (project_slug, job_number)
-
-                        # HTTP Get Request
-                        job_detail = self.get_dict_api(url=job_detail_endpoint, api_token=api_token, params=None, ew=ew)
-
-                        username = job_detail.get('username')
-                        reponame = job_detail.get('reponame')
-                        build_num = job_detail.get('build_num')
-
-                        # Create job event data
-                        job_event_data = dict()
-                        # add field job_time for _time
-                        if job_detail.get('stop_time') is not None:
-                            job_event_data['job_time'] = job_detail.get('stop_time')
-                        else:
-                            # set current time as %Y-%m-%dT%H:%M:%S.%3NZ
-                            job_event_data['job_time'] = now.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
-                        job_event_data['stop_time'] = job_detail.get('stop_time')
-                        job_event_data['start_time'] = job_detail.get('start_time')
-                        job_event_data['queued_time'] = job_detail.get('queued_at')
-                        if job_event_data.get('build_parameters') is not None:
-                            job_event_data['job_name'] = job_detail.get('build_parameters').get('CIRCLE_JOB')
-                        else:
-                            job_event_data['job_name'] = 'Unknown'
-                        job_event_data['reponame'] = job_detail.get('reponame')
-                        job_event_data['build_num'] = job_detail.get('build_num')
-                        job_event_data['build_url'] = job_detail.get('build_url')
-                        job_event_data['branch'] = job_detail.get('branch')
-                        job_event_data['status'] = job_detail.get('status')
-                        job_event_data['project_slug'] = project_slug
-                        job_event_data['fail_reason'] = job_detail.get('fail_reason')
-                        job_event_data['build_time_millis'] = job_detail.get('build_time_millis')
-                        job_event_data['timedout'] = job_detail.get('timedout')
-                        job_event_data['username'] = job_detail.get('username')
-                        job_event_data['owners'] = job_detail.get('owners')
-                        job_event_data['author_name'] = job_detail.get('author_name')
-                        if job_event_data.get('user') is not None:
-                            job_event_data['avatar_url'] = job_detail.get('user').get('avatar_url')
-                            job_event_data['user_id'] = job_detail.get('user').get('id')
-                        else:
-                            job_event_data['avatar_url'] = ''
-                        job_event_data['build_time_millis'] = job_detail.get('build_time_millis')
-                        job_event_data['workflows'] = job_detail.get('workflows')
-                        job_event_data['vcs'] = {}
-                        job_event_data['vcs']['commit_time'] = job_detail.get('committer_date')
-                        job_event_data['vcs']['type'] = job_detail.get('vcs_type')
-                        job_event_data['vcs']['url'] = job_detail.get('vcs_url')
-                        job_event_data['vcs']['revision'] = job_detail.get('vcs_revision')
-                        job_event_data['vcs']['tag'] = job_detail.get('vcs_tag')
-                        job_event_data['vcs']['committer_name'] = job_detail.get('committer_name')
-                        job_event_data['vcs']['subject'] = job_detail.get('subject')
-
-                        # Set event data
-                        event.data = json.dumps(job_event_data)
-
-                        # Write event data to Splunk
-                        if write_job_to_splunk:
-                            try:
-                                ew.write_event(event)
-                                ew.log('DEBUG', 'Successfully write circleci job event: username=%s reponame=%s build_num=%s' \
-                                    % (username, reponame, str(build_num)))
-
-                            except Exception as e:
-                                ew.log('ERROR', 'Failed to write circleci job event: username=%s reponame=%s build_num=%s' \
-                                    % (username, reponame, str(build_num)))
-                                ew.log('ERROR', e)
-                                continue
-
-                        # Clear event data for next loop
-                        job_event_data.clear()
-
-                        # Write steps data in each job to splunk
-                        ew.log('DEBUG', 'Start processing steps data collection')
-                        for step in job_detail.get('steps'):
-                            # Set sourcetype in event data
-                            event.sourceType = 'circleci:step'
-
-                            # each step has actions in list
-                            for action in step.get('actions'):
-
-                                ew.log('INFO', 'Start processing step event allocation_id=%s step=%s' \
-                                    % (action.get('allocation_id'), str(action.get('step'))))
-
-                                # Create step event data
-                                # add field step_time for _time
-                                if action.get('end_time') is not None:
-                                    action['step_time'] = action.get('end_time')
-                                else:
-                                    # set current time as %Y-%m-%dT%H:%M:%S.%3NZ
-                                    action['step_time'] = now.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
-                                # add job key
-                                if job_detail.get('workflows') is not None:
-                                    action['job_id'] = job_detail.get('workflows').get('job_id')
-                                    action['job_name'] = job_detail.get('workflows').get('job_name')
-                                else:
-                                    action['job_id'] = 'Unknown'
-                                    action['job_name'] = 'Unknown'
-
-                                # Set event data
-                                event.data = json.dumps(action)
-
-                                # Write event data to Splunk
-                                try:
-                                    ew.write_event(event)
-                                    ew.log('DEBUG', 'Successfully write circleci step event: username=%s ' \
-                                        'reponame=%s build_num=%s allocation_id=%s step=%s' \
-                                        % (username, reponame, str(build_num), \
-                                            action.get('allocation_id'), str(action.get('step'))))
-                                except Exception as e:
-                                    ew.log('ERROR', 'Failed to write circleci step event: username=%s ' \
-                                        'reponame=%s build_num=%s allocation_id=%s step=%s' \
-                                        % (username, reponame, str(build_num), \
-                                            action.get('allocation_id'), str(action.get('step'))))
-                                    ew.log('ERROR', e)
-                                    continue
-
-                                ew.log('INFO', 'Finish processing step event: allocation_id=%s step=%s' \
-                                    % (action.get('allocation_id'), str(action.get('step'))))
-
-
-                        # Update job checkpoint
-                        job_checkpoint_data['status'] = job_detail.get('status')
-                        self.update_checkpoint(
-                            kvstore_collection=job_kvstore_collection, 
-                            checkpoint_data=job_checkpoint_data, 
-                            ew=ew)
+                valid_pipelines.append(pipeline)
 
-                        ew.log('INFO', 'Finish processing job event: username=%s reponame=%s build_num=%s' \
-                            % (username, reponame, str(build_num)))
+            # HTTP Get Request
+            pipeline_workflows = self.map_ordered(executor, self.get_list_api, 
+                [self.get_workflows_endpoint(pipeline) for pipeline in valid_pipelines], 
+                errors=CircleCIAPIError, api_token=api_token, params=dict(), limit=None, ew=ew, conditional=True)
+
+            for pipeline, workflows in zip(valid_pipelines, pipeline_workflows):
+                if self.is_out_of_time(deadline):
+                    cut_off = True
+                    # Cancel workflow requests of the rest of this page
+                    pipeline_workflows.close()
+                    break
+                pipeline_id = pipeline.get('id')
+                # Skip the pipeline as unsettled, so that the high-water mark
+                # stays below it and the next run requests it again
+                if isinstance(workflows, CircleCIAPIError):
+                    ew.log('WARN', 'skip this pipeline: project_slug=%s pipeline_num=%s %s', 
+                        pipeline.get('project_slug'), pipeline.get('number'), workflows)
+                    pipeline_results.append((pipeline.get('updated_at'), False))
+                    continue
+                settled = self.process_pipeline(
+                    pipeline=pipeline, 
+                    workflows=workflows, 
+                    api_token=api_token, 
+                    event_templates=event_templates, 
+                    executor=executor, 
+                    job_detail_filter=job_detail_filter, 
+                    deadline=deadline, 
+                    resume_workflow_id=resume_workflow_id if pipeline_id == resume_pipeline_id else None, 
+                    on_workflow=partial(save_cursor, page_token=page_token, pipeline_id=pipeline_id, pipeline_done=False), 
+                    workflow_kvstore_collection=workflow_kvstore_collection, 
+                    job_kvstore_collection=job_kvstore_collection, 
+                    checkpoint_buffer=checkpoint_buffer, 
+                    ew=ew)
+
+                # Cut off in the middle of the pipeline
+                if settled is None:
+                    cut_off = True
+                    pipeline_workflows.close()
+                    break
+
+                pipeline_results.append((pipeline.get('updated_at'), settled))
+                # Move the cursor past this pipeline if any workflow was processed
+                if cursor.get('pipeline_id') == pipeline_id:
+                    save_cursor(page_token=page_token, pipeline_id=pipeline_id, pipeline_done=True, workflow_id=None)
+
+                # Save checkpoints at pipeline boundary
+                checkpoint_buffer.flush()
+
+            if cut_off:
+                break
+
+        # Update high-water mark and clear the cursor only if all checkpoints
+        # have been saved
+        # Pipelines older than those processed may be left when cut off, so
+        # the mark is kept and the next run resumes from the cursor
+        new_high_water_mark = self.get_high_water_mark(pipeline_results, high_water_mark)
+        if cut_off:
+            self.count_metric('cut_off', ew)
+            ew.log('WARN', 'max run seconds is over, resume next run vcs=%s org=%s pipeline_id=%s workflow_id=%s', 
+                vcs, org, cursor.get('pipeline_id'), cursor.get('workflow_id'))
+        elif checkpoint_buffer.flush() and checkpoint_buffer.failures == 0 \
+            and (new_high_water_mark != high_water_mark or pipeline_checkpoint_data.get('cursor') is not None):
+            pipeline_checkpoint_data['updated_at'] = new_high_water_mark
+            pipeline_checkpoint_data['cursor'] = None
+            self.update_checkpoint(
+                checkpoint_buffer=checkpoint_buffer, 
+                kvstore_collection=pipeline_kvstore_collection, 
+                checkpoint_data=pipeline_checkpoint_data, 
+                ew=ew)
+            ew.log('INFO', 'update pipeline high-water mark vcs=%s org=%s updated_at=%s', vcs, org, new_high_water_mark)
+
+    def save_cursor(self, cursor, pipeline_checkpoint_data, pipeline_results, pipeline_kvstore_collection, checkpoint_buffer, ew, **position):
+        # Update the traversal cursor in the pipeline checkpoint
+        # position is page_token, pipeline_id, pipeline_done, and workflow_id
+        # (the last workflow processed in the pipeline)
+        cursor.update(position)
+        pipeline_checkpoint_data['cursor'] = dict(cursor, 
+            results=self.compact_pipeline_results(pipeline_results))
+        self.update_checkpoint(
+            checkpoint_buffer=checkpoint_buffer, 
+            kvstore_collection=pipeline_kvstore_collection, 
+            checkpoint_data=pipeline_checkpoint_data, 
+            ew=ew)
+
+    def compact_pipeline_results(self, pipeline_results):
+        # Reduce results of processed pipelines to the oldest unsettled one and
+        # the latest settled one, which gives the same or an older mark with
+        # get_high_water_mark
+        unsettled = [updated_at for updated_at, settled in pipeline_results if not settled]
+        settled = [updated_at for updated_at, settled in pipeline_results if settled and updated_at is not None]
+        compacted = list()
+        if len(unsettled) > 0:
+            compacted.append([None if None in unsettled else min(unsettled), False])
+        if len(settled) > 0:
+            compacted.append([max(settled), True])
+        return compacted
+
+    def is_below_high_water_mark(self, pipelines, high_water_mark):
+        # Returns True if all pipelines were updated at or before high_water_mark
+        # Timestamps of CircleCI API are compared as ISO 8601 strings
+        if high_water_mark is None:
+            return False
+        for pipeline in pipelines:
+            updated_at = pipeline.get('updated_at')
+            if updated_at is None or high_water_mark < updated_at:
+                return False
+        return True
+
+    def get_high_water_mark(self, pipeline_results, high_water_mark):
+        # New mark is the latest updated_at of settled pipelines which is older
+        # than every unsettled pipeline, so that unsettled ones are processed
+        # again in the next run
+        unsettled = [updated_at for updated_at, settled in pipeline_results if not settled]
+        if None in unsettled:
+            return high_water_mark
+        candidates = [updated_at for updated_at, settled in pipeline_results \
+            if settled and updated_at is not None and (len(unsettled) == 0 or updated_at < min(unsettled))]
+        if len(candidates) == 0:
+            return high_water_mark
+        if high_water_mark is not None and max(candidates) <= high_water_mark:
+            return high_water_mark
+        return max(candidates)
+
+    def process_pipeline(self, pipeline, workflows, api_token, event_templates, executor, job_detail_filter, deadline, resume_workflow_id, on_workflow, workflow_kvstore_collection, job_kvstore_collection, checkpoint_buffer, ew):
+        # Returns True if the pipeline is settled, or None if it is cut off at
+        # deadline
+        # Workflows up to resume_workflow_id were processed by the last run, and
+        # on_workflow is called with each workflow id processed
+        project_slug = pipeline.get('project_slug')
+        pipeline_num = pipeline.get('number')
+
+        ew.log('DEBUG', 'Start processing pipeline: project_slug=%s number=%s', project_slug, pipeline_num)
+
+        now = datetime.datetime.utcnow()
+
+        # Workflows to be processed with their checkpoint
+        target_workflows = list()
+
+        # Pipeline is settled when all of its workflows are in a terminal state
+        # and their checkpoints are updated, or when it has no workflows a
+        # while after it was created
+        if len(workflows) == 0:
+            settled = pipeline.get('state') == 'errored' or self.is_empty_pipeline_settled(pipeline, now)
+        else:
+            settled = pipeline.get('state') == 'errored' \
+                or all(workflow.get('status') in TERMINAL_STATUSES for workflow in workflows)
+
+        # Skip workflows processed before the cursor
+        workflow_ids = [workflow.get('id') for workflow in workflows]
+        if resume_workflow_id in workflow_ids:
+            workflows = workflows[workflow_ids.index(resume_workflow_id)+1:]
+
+        # Workflows cached in a terminal state are skipped without kv store
+        # lookup and jobs request
+        num_workflows = len(workflows)
+        workflows = [workflow for workflow in workflows \
+            if not self.is_terminal_cached(workflow.get('id'), workflow.get('status'), ew)]
+        self.count_metric('skipped_workflows_by_cache', ew, num_workflows - len(workflows))
+
+        # Get workflow checkpoints of this pipeline at once
+        workflow_checkpoint_map = self.prefetch_checkpoints(
+            kvstore_collection=workflow_kvstore_collection, 
+            keys=[workflow.get('id') for workflow in workflows], 
+            ew=ew)
+
+        for workflow in workflows:
+
+            workflow_id = workflow.get('id')
+            workflow_name = workflow.get('name')
+            workflow_status = workflow.get('status')
+            project_slug = workflow.get('project_slug')
+
+            # 
+            if workflow_id is None:
+                ew.log('DEBUG', 'workflow_id is None workflow_id=%s workflow_name=%s', workflow_id, workflow_name)
+                continue
+
+            # Workflow checkpoint
+            ew.log('DEBUG', 'Getting workflow checkpoint')
+            workflow_checkpoint_data = {
+                '_key': workflow_id,
+                'name': workflow_name,
+                'project_slug': project_slug,
+                'status': 'Unknown'
+            }
+            workflow_checkpoint_data = self.get_checkpoint(
+                kvstore_collection=workflow_kvstore_collection, 
+                init_data=workflow_checkpoint_data, 
+                ew=ew, 
+                checkpoint_map=workflow_checkpoint_map)
+
+            workflow_checkpoint_status = workflow_checkpoint_data.get('status')
+
+            # If status matches checkpoint's value, skip the following process
+            if workflow_status == workflow_checkpoint_status and workflow_status != 'running':
+                ew.log('DEBUG', 'skip this workflow: project_slug=%s workflow_name=%s status=%s checkpoint_status=%s', 
+                    project_slug, workflow_name, workflow_status, workflow_checkpoint_status)
+                self.count_metric('skipped_workflows_by_checkpoint', ew)
+                if self._terminal_cache is not None:
+                    self._terminal_cache.add(workflow_id, workflow_status)
+                continue
+
+            target_workflows.append((workflow, workflow_checkpoint_data))
+
+        # Jobs of the workflows in this pipeline are requested in parallel
+        # HTTP Get Request
+        workflow_jobs = list(self.map_ordered(executor, self.get_list_api, 
+            [self.get_jobs_endpoint(workflow) for workflow, workflow_checkpoint_data in target_workflows], 
+            errors=CircleCIAPIError, api_token=api_token, params=dict(), limit=None, ew=ew, conditional=True))
+
+        # Set when a workflow is skipped because its request failed
+        failed = False
+
+        # Skip workflows whose jobs request failed without their event and
+        # checkpoint, and process them again next run
+        requested_workflows = list(zip(target_workflows, workflow_jobs))
+        target_workflows = list()
+        workflow_jobs = list()
+        for (workflow, workflow_checkpoint_data), jobs in requested_workflows:
+            if isinstance(jobs, CircleCIAPIError):
+                ew.log('WARN', 'skip this workflow: project_slug=%s workflow_name=%s %s', 
+                    workflow.get('project_slug'), workflow.get('name'), jobs)
+                failed = True
+                continue
+            target_workflows.append((workflow, workflow_checkpoint_data))
+            workflow_jobs.append(jobs)
+
+        # Jobs cached in a terminal state are skipped without kv store lookup
+        # and job detail request
+        num_jobs = sum(len(jobs) for jobs in workflow_jobs)
+        workflow_jobs = [[job for job in jobs \
+            if not self.is_terminal_cached(job.get('id'), job.get('status'), ew)] for jobs in workflow_jobs]
+        self.count_metric('skipped_jobs_by_cache', ew, num_jobs - sum(len(jobs) for jobs in workflow_jobs))
+
+        # Get job checkpoints of this pipeline at once
+        job_checkpoint_map = self.prefetch_checkpoints(
+            kvstore_collection=job_kvstore_collection, 
+            keys=[job.get('id') for jobs in workflow_jobs for job in jobs], 
+            ew=ew)
+
+        for (workflow, workflow_checkpoint_data), jobs in zip(target_workflows, workflow_jobs):
+            # Stop at max_run_seconds, and resume from the cursor next run
+            if self.is_out_of_time(deadline):
+                ew.log('DEBUG', 'Cut off processing pipeline: project_slug=%s number=%s', project_slug, pipeline_num)
+                return None
+            processed = self.process_workflow(
+                pipeline=pipeline, 
+                workflow=workflow, 
+                workflow_checkpoint_data=workflow_checkpoint_data, 
+                jobs=jobs, 
+                job_checkpoint_map=job_checkpoint_map, 
+                now=now, 
+                api_token=api_token, 
+                event_templates=event_templates, 
+                executor=executor, 
+                job_detail_filter=job_detail_filter, 
+                deadline=deadline, 
+                workflow_kvstore_collection=workflow_kvstore_collection, 
+                job_kvstore_collection=job_kvstore_collection, 
+                checkpoint_buffer=checkpoint_buffer, 
+                ew=ew)
+            # Cut off in the middle of the workflow, which is processed
+            # again from the cursor next run
+            if processed is None:
+                ew.log('DEBUG', 'Cut off processing pipeline: project_slug=%s number=%s', project_slug, pipeline_num)
+                return None
+            failed = failed or processed is False
+            # The cursor stays before a failed workflow, so that a cut off
+            # run doesn't skip it when resumed
+            if not failed:
+                on_workflow(workflow_id=workflow.get('id'))
+
+        ew.log('DEBUG', 'Finish processing pipeline: project_slug=%s number=%s', project_slug, pipeline_num)
+
+        return settled and not failed
+
+    def is_empty_pipeline_settled(self, pipeline, now):
+        # Returns True if a pipeline without workflows was created over
+        # EMPTY_PIPELINE_GRACE_SECONDS before now, as workflows may still
+        # be added right after it is created
+        # Timestamps of CircleCI API are compared as ISO 8601 strings
+        created_at = pipeline.get('created_at')
+        if pipeline.get('state') != 'created' or created_at is None:
+            return False
+        grace_until = (now - datetime.timedelta(seconds=EMPTY_PIPELINE_GRACE_SECONDS)).strftime('%Y-%m-%dT%H:%M:%S')
+        return created_at[:19] <= grace_until
+
+    def process_workflow(self, pipeline, workflow, workflow_checkpoint_data, jobs, job_checkpoint_map, now, api_token, event_templates, executor, job_detail_filter, deadline, workflow_kvstore_collection, job_kvstore_collection, checkpoint_buffer, ew):
+        # Returns True if the workflow checkpoint is updated, False if a job
+        # failed, or None if it is cut off at deadline
+        workflow_id = workflow.get('id')
+        workflow_name = workflow.get('name')
+        workflow_status = workflow.get('status')
+        project_slug = workflow.get('project_slug')
+
+        # Checkpoint definition
+        write_workflow_to_splunk = True
+
+        ew.log('DEBUG', 'Start processing workflow: project_slug=%s name=%s id=%s', project_slug, workflow_name, workflow_id)
+
+        # add field workflow_time for _time
+        if workflow.get('stopped_at') is not None:
+            workflow['workflow_time'] = workflow.get('stopped_at')
+        else:
+            # set current time as %Y-%m-%dT%H:%M:%S.%2NZ
+            workflow['workflow_time'] = now.strftime('%Y-%m-%dT%H:%M:%S') + 'Z'
+        # Attach pipeline data at workflow
+        workflow['trigger'] = pipeline['trigger']
+        workflow['vcs'] = pipeline['vcs']
+        # Add username and reponame to comply with job data
+        if sys.version_info[0] == 2:
+            project_slug = project_slug.encode('utf-8')
+        elif sys.version_info[0] == 3:
+            project_slug = project_slug
+        left_separator = project_slug.find('/')
+        right_separator = project_slug.rfind('/')
+        workflow['username'] = project_slug[left_separator+1:right_separator]
+        workflow['reponame'] = project_slug[right_separator+1:]
+
+        # Set event data
+        event_data = json.dumps(workflow)
+
+        # Jobs to be processed with their checkpoint
+        target_jobs = list()
+
+        # 
+        for job in jobs:
+
+            job_id = job.get('id')
+            job_number = job.get('job_number')
+            job_project_slug = job.get('project_slug')
+            job_status = job.get('status')
+
+            if job_number is None:
+                ew.log('WARN', 'skip this job: project_slug=%s job_number=%s', job_project_slug, job_number)
+                continue
+
+            # Job checkpoint
+            ew.log('DEBUG', 'Getting job checkpoint')
+            job_checkpoint_data = {
+                '_key': job_id,
+                'job_number': job_number,
+                'project_slug': job_project_slug,
+                'status': 'Unknown'
+            }
+            job_checkpoint_data = self.get_checkpoint(
+                kvstore_collection=job_kvstore_collection, 
+                init_data=job_checkpoint_data, 
+                ew=ew, 
+                checkpoint_map=job_checkpoint_map)
+
+            job_checkpoint_status = job_checkpoint_data.get('status')
+
+            # If status matches checkpoint's value, skip the following process
+            if job_status == job_checkpoint_status and job_status != 'running':
+                ew.log('DEBUG', 'skip this job: project_slug=%s job_number=%s status=%s checkpoint_status=%s', 
+                    job_project_slug, job_number, job_status, job_checkpoint_status)
+                self.count_metric('skipped_jobs_by_checkpoint', ew)
+                if self._terminal_cache is not None:
+                    self._terminal_cache.add(job_id, job_status)
+                continue
+
+            target_jobs.append((job, job_checkpoint_data))
+
+        # API v1.1 job detail (with steps) is requested only for jobs matching
+        # job_detail_filter, and API v2 job detail for the others
+        detail_jobs = [job for job, job_checkpoint_data in target_jobs \
+            if self.needs_job_detail(job.get('status'), job_detail_filter)]
+        summary_jobs = [job for job, job_checkpoint_data in target_jobs \
+            if not self.needs_job_detail(job.get('status'), job_detail_filter)]
+
+        # Job details of finished builds are read from the job detail cache,
+        # and the others of this workflow are requested in parallel
+        cached_job_details = [self.get_cached_job_detail(job, ew) for job in detail_jobs]
+        # HTTP Get Request
+        requested_job_details = self.map_ordered(executor, self.get_dict_api, 
+            [self.get_job_detail_endpoint(job) for job, job_detail in zip(detail_jobs, cached_job_details) if job_detail is None], 
+            errors=CircleCIAPIError, api_token=api_token, params=None, ew=ew)
+        job_details = (job_detail if job_detail is not None else self.cache_job_detail(job, next(requested_job_details), ew) \
+            for job, job_detail in zip(detail_jobs, cached_job_details))
+        job_summaries = self.map_ordered(executor, self.get_dict_api, 
+            [self.get_job_summary_endpoint(job) for job in summary_jobs], 
+            errors=CircleCIAPIError, api_token=api_token, params=None, ew=ew)
+
+        # Set when a job is skipped because its request failed
+        failed = False
+
+        for job, job_checkpoint_data in target_jobs:
+            # Stop at max_run_seconds and cancel pending requests, without
+            # checkpoints of the rest of the jobs and the workflow
+            if self.is_out_of_time(deadline):
+                ew.log('DEBUG', 'Cut off processing workflow: project_slug=%s name=%s id=%s', project_slug, workflow_name, workflow_id)
+                requested_job_details.close()
+                job_summaries.close()
+                return None
+            if self.needs_job_detail(job.get('status'), job_detail_filter):
+                job_detail = next(job_details)
+                # Skip the job without its event and checkpoint, and process
+                # it again next run
+                if isinstance(job_detail, CircleCIAPIError):
+                    ew.log('WARN', 'skip this job: project_slug=%s job_number=%s %s', 
+                        job.get('project_slug'), job.get('job_number'), job_detail)
+                    failed = True
+                    continue
+                self.process_job(
+                    job=job, 
+                    job_checkpoint_data=job_checkpoint_data, 
+                    job_detail=job_detail, 
+                    event_templates=event_templates, 
+                    job_kvstore_collection=job_kvstore_collection, 
+                    checkpoint_buffer=checkpoint_buffer, 
+                    ew=ew)
+            else:
+                job_summary = next(job_summaries)
+                if isinstance(job_summary, CircleCIAPIError):
+                    ew.log('WARN', 'skip this job: project_slug=%s job_number=%s %s', 
+                        job.get('project_slug'), job.get('job_number'), job_summary)
+                    failed = True
+                    continue
+                self.process_job_summary(
+                    pipeline=pipeline, 
+                    workflow=workflow, 
+                    job=job, 
+                    job_checkpoint_data=job_checkpoint_data, 
+                    job_summary=job_summary, 
+                    event_templates=event_templates, 
+                    job_kvstore_collection=job_kvstore_collection, 
+                    checkpoint_buffer=checkpoint_buffer, 
+                    ew=ew)
+
+        # Workflow with skipped jobs is processed again next run, and its
+        # pipeline is not settled
+        if failed:
+            ew.log('WARN', 'skip workflow checkpoint with failed jobs: project_slug=%s name=%s id=%s', 
+                project_slug, workflow_name, workflow_id)
+            return False
+
+        # Write event data to Splunk with workflow sourcetype
+        # The event is written with the workflow checkpoint after its jobs, so
+        # that a workflow cut off or failed in the middle of its jobs is not
+        # written again when it is processed next run
+        if write_workflow_to_splunk:
+            try:
+                ew.write_template(event_templates['circleci:workflow'], event_data, 
+                    self.get_event_time(workflow.get('workflow_time')))
+                ew.log('DEBUG', 'Successfully write circleci workflow event: workflow_id=%s workflow_name=%s project_slug=%s', 
+                    workflow_id, workflow_name, project_slug)
+
+            except Exception as e:
+                ew.log('ERROR', 'Failed to write circleci workflow event: workflow_id=%s workflow_name=%s project_slug=%s %s', 
+                    workflow_id, workflow_name, project_slug, e)
+                return False
+
+        # Update workflow checkpoint
+        workflow_checkpoint_data['status'] = workflow_status
+        self.update_checkpoint(
+            checkpoint_buffer=checkpoint_buffer, 
+            kvstore_collection=workflow_kvstore_collection, 
+            checkpoint_data=workflow_checkpoint_data, 
+            ew=ew)
+
+        ew.log('DEBUG', 'Finish processing workflow: project_slug=%s name=%s id=%s', project_slug, workflow_name, workflow_id)
+
+        return True
+
+    def process_job_summary(self, pipeline, workflow, job, job_checkpoint_data, job_summary, event_templates, job_kvstore_collection, checkpoint_buffer, ew):
+        # Write job event from API v2 without requesting API v1.1 job detail
+        # Steps are not written, and fields only in API v1.1 are null
+        job_number = job.get('job_number')
+        project_slug = job.get('project_slug')
+
+        ew.log('DEBUG', 'Start processing job summary event: project_slug=%s build_num=%s', project_slug, job_number)
+
+        # Set current time to set job_time
+        now = datetime.datetime.utcnow()
+
+        # project_slug is <vcs>/<username>/<reponame>
+        left_separator = project_slug.find('/')
+        right_separator = project_slug.rfind('/')
+        vcs_type = project_slug[:left_separator]
+        username = project_slug[left_separator+1:right_separator]
+        reponame = project_slug[right_separator+1:]
+        pipeline_vcs = pipeline.get('vcs') or {}
+
+        # Create job event data with the same fields as process_job
+        job_event_data = dict()
+        # add field job_time for _time
+        if job.get('stopped_at') is not None:
+            job_event_data['job_time'] = job.get('stopped_at')
+        else:
+            # set current time as %Y-%m-%dT%H:%M:%S.%3NZ
+            job_event_data['job_time'] = now.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+        job_event_data['stop_time'] = job.get('stopped_at')
+        job_event_data['start_time'] = job.get('started_at')
+        job_event_data['queued_time'] = job_summary.get('queued_at')
+        job_event_data['job_name'] = job.get('name')
+        job_event_data['reponame'] = reponame
+        job_event_data['build_num'] = job_number
+        job_event_data['build_url'] = job_summary.get('web_url')
+        job_event_data['branch'] = pipeline_vcs.get('branch')
+        job_event_data['status'] = job.get('status')
+        job_event_data['project_slug'] = project_slug
+        job_event_data['fail_reason'] = None
+        job_event_data['build_time_millis'] = job_summary.get('duration')
+        job_event_data['timedout'] = None
+        job_event_data['username'] = username
+        job_event_data['owners'] = None
+        job_event_data['author_name'] = None
+        job_event_data['avatar_url'] = ''
+        job_event_data['workflows'] = {
+            'job_id': job.get('id'),
+            'job_name': job.get('name'),
+            'workflow_id': workflow.get('id'),
+            'workflow_name': workflow.get('name')
+        }
+        job_event_data['vcs'] = {}
+        job_event_data['vcs']['commit_time'] = None
+        job_event_data['vcs']['type'] = VCS_TYPES.get(vcs_type, vcs_type)
+        job_event_data['vcs']['url'] = pipeline_vcs.get('origin_repository_url')
+        job_event_data['vcs']['revision'] = pipeline_vcs.get('revision')
+        job_event_data['vcs']['tag'] = pipeline_vcs.get('tag')
+        job_event_data['vcs']['committer_name'] = None
+        job_event_data['vcs']['subject'] = (pipeline_vcs.get('commit') or {}).get('subject')
+
+        # Set event data
+        event_data = json.dumps(job_event_data)
+
+        # Write event data to Splunk with job sourcetype
+        try:
+            ew.write_template(event_templates['circleci:job'], event_data, 
+                self.get_event_time(job_event_data.get('job_time')))
+            ew.log('DEBUG', 'Successfully write circleci job summary event: username=%s reponame=%s build_num=%s', 
+                username, reponame, job_number)
+
+        except Exception as e:
+            ew.log('ERROR', 'Failed to write circleci job summary event: username=%s reponame=%s build_num=%s %s', 
+                username, reponame, job_number, e)
+            return
+
+        # Update job checkpoint with status of API v2
+        job_checkpoint_data['status'] = job.get('status')
+        self.update_checkpoint(
+            checkpoint_buffer=checkpoint_buffer, 
+            kvstore_collection=job_kvstore_collection, 
+            checkpoint_data=job_checkpoint_data, 
+            ew=ew)
+
+        ew.log('DEBUG', 'Finish processing job summary event: username=%s reponame=%s build_num=%s', 
+            username, reponame, job_number)
+
+    def process_job(self, job, job_checkpoint_data, job_detail, event_templates, job_kvstore_collection, checkpoint_buffer, ew):
+        job_number = job.get('job_number')
+        project_slug = job.get('project_slug')
+
+        # Checkpoint definition
+        write_job_to_splunk = True
+
+        ew.log('DEBUG', 'Start processing job event: project_slug=%s build_num=%s', project_slug, job_number)
+
+        # Set current time to set job_time
+        now = datetime.datetime.utcnow()
+
+        username = job_detail.get('username')
+        reponame = job_detail.get('reponame')
+        build_num = job_detail.get('build_num')
+
+        # Create job event data
+        job_event_data = dict()
+        # add field job_time for _time
+        if job_detail.get('stop_time') is not None:
+            job_event_data['job_time'] = job_detail.get('stop_time')
+        else:
+            # set current time as %Y-%m-%dT%H:%M:%S.%3NZ
+            job_event_data['job_time'] = now.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+        job_event_data['stop_time'] = job_detail.get('stop_time')
+        job_event_data['start_time'] = job_detail.get('start_time')
+        job_event_data['queued_time'] = job_detail.get('queued_at')
+        if job_event_data.get('build_parameters') is not None:
+            job_event_data['job_name'] = job_detail.get('build_parameters').get('CIRCLE_JOB')
+        else:
+            job_event_data['job_name'] = 'Unknown'
+        job_event_data['reponame'] = job_detail.get('reponame')
+        job_event_data['build_num'] = job_detail.get('build_num')
+        job_event_data['build_url'] = job_detail.get('build_url')
+        job_event_data['branch'] = job_detail.get('branch')
+        job_event_data['status'] = job_detail.get('status')
+        job_event_data['project_slug'] = project_slug
+        job_event_data['fail_reason'] = job_detail.get('fail_reason')
+        job_event_data['build_time_millis'] = job_detail.get('build_time_millis')
+        job_event_data['timedout'] = job_detail.get('timedout')
+        job_event_data['username'] = job_detail.get('username')
+        job_event_data['owners'] = job_detail.get('owners')
+        job_event_data['author_name'] = job_detail.get('author_name')
+        if job_event_data.get('user') is not None:
+            job_event_data['avatar_url'] = job_detail.get('user').get('avatar_url')
+            job_event_data['user_id'] = job_detail.get('user').get('id')
+        else:
+            job_event_data['avatar_url'] = ''
+        job_event_data['build_time_millis'] = job_detail.get('build_time_millis')
+        job_event_data['workflows'] = job_detail.get('workflows')
+        job_event_data['vcs'] = {}
+        job_event_data['vcs']['commit_time'] = job_detail.get('committer_date')
+        job_event_data['vcs']['type'] = job_detail.get('vcs_type')
+        job_event_data['vcs']['url'] = job_detail.get('vcs_url')
+        job_event_data['vcs']['revision'] = job_detail.get('vcs_revision')
+        job_event_data['vcs']['tag'] = job_detail.get('vcs_tag')
+        job_event_data['vcs']['committer_name'] = job_detail.get('committer_name')
+        job_event_data['vcs']['subject'] = job_detail.get('subject')
+
+        # Set event data
+        event_data = json.dumps(job_event_data)
+
+        # Write event data to Splunk with job sourcetype
+        if write_job_to_splunk:
+            try:
+                ew.write_template(event_templates['circleci:job'], event_data, 
+                    self.get_event_time(job_event_data.get('job_time')))
+                ew.log('DEBUG', 'Successfully write circleci job event: username=%s reponame=%s build_num=%s', 
+                    username, reponame, build_num)
+
+            except Exception as e:
+                ew.log('ERROR', 'Failed to write circleci job event: username=%s reponame=%s build_num=%s %s', 
+                    username, reponame, build_num, e)
+                return
+
+        # Clear event data for next loop
+        job_event_data.clear()
+
+        # Write steps data in each job to splunk
+        ew.log('DEBUG', 'Start processing steps data collection')
+        step_template = event_templates['circleci:step']
+        for step in job_detail.get('steps'):
+            # each step has actions in list
+            for action in step.get('actions'):
+
+                ew.log('DEBUG', 'Start processing step event allocation_id=%s step=%s', 
+                    action.get('allocation_id'), action.get('step'))
+
+                # Create step event data
+                # add field step_time for _time
+                if action.get('end_time') is not None:
+                    action['step_time'] = action.get('end_time')
+                else:
+                    # set current time as %Y-%m-%dT%H:%M:%S.%3NZ
+                    action['step_time'] = now.strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+                # add job key
+                if job_detail.get('workflows') is not None:
+                    action['job_id'] = job_detail.get('workflows').get('job_id')
+                    action['job_name'] = job_detail.get('workflows').get('job_name')
+                else:
+                    action['job_id'] = 'Unknown'
+                    action['job_name'] = 'Unknown'
+
+                # Set event data
+                event_data = json.dumps(action)
+
+                # Write event data to Splunk with step sourcetype
+                try:
+                    ew.write_template(step_template, event_data, 
+                        self.get_event_time(action.get('step_time')))
+                    ew.log('DEBUG', 'Successfully write circleci step event: username=%s ' \
+                        'reponame=%s build_num=%s allocation_id=%s step=%s', \
+                        username, reponame, build_num, action.get('allocation_id'), action.get('step'))
+                except Exception as e:
+                    ew.log('ERROR', 'Failed to write circleci step event: username=%s ' \
+                        'reponame=%s build_num=%s allocation_id=%s step=%s %s', \
+                        username, reponame, build_num, action.get('allocation_id'), action.get('step'), e)
+                    continue
 
-                    # Update workflow checkpoint
-                    workflow_checkpoint_data['status'] = workflow_status
-                    self.update_checkpoint(
-                        kvstore_collection=workflow_kvstore_collection, 
-                        checkpoint_data=workflow_checkpoint_data, 
-                        ew=ew)
+                ew.log('DEBUG', 'Finish processing step event: allocation_id=%s step=%s', 
+                    action.get('allocation_id'), action.get('step'))
 
-                    ew.log('INFO', 'Finish processing workflow: project_slug=%s name=%s id=%s' \
-                        % (project_slug, workflow_name, workflow_id))
 
-                ew.log('INFO', 'Finish processing pipeline: project_slug=%s number=%s' % (project_slug, pipeline_num))
+        # Update job checkpoint
+        job_checkpoint_data['status'] = job_detail.get('status')
+        self.update_checkpoint(
+            checkpoint_buffer=checkpoint_buffer, 
+            kvstore_collection=job_kvstore_collection, 
+            checkpoint_data=job_checkpoint_data, 
+            ew=ew)
 
-            ew.log('INFO', 'Finish processing input: api_token=%s vcs=%s org=%s' % (api_token, vcs, org))
+        ew.log('DEBUG', 'Finish processing job event: username=%s reponame=%s build_num=%s', username, reponame, build_num)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,218 @@
+"""Asyncio engine for the CircleCI modular input.
+
+``AsyncExecutor`` mimics the ``submit``/``result`` interface of
+``concurrent.futures`` so that ``CircleCIScript`` can walk pipelines, workflows
+and jobs with the same code for both engines. Requests are multiplexed on a
+single event loop by ``AsyncHTTPClient``, which only depends on the standard
+library because Splunk's Python does not ship an asyncio HTTP client.
+"""
+
+from __future__ import absolute_import
+import asyncio, ssl, zlib
+
+from splunklib.six.moves.urllib.parse import urlsplit, urlencode
+
+
+class AsyncResponse(object):
+    """Minimal response object compatible with the attributes of
+    ``requests.Response`` used by the collector.
+    """
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+
+class AsyncHTTPClient(object):
+    """HTTP/1.1 client on asyncio streams with keep-alive connections.
+
+    Idle connections are kept per (scheme, host, port) up to ``pool_size``.
+    """
+    def __init__(self, headers=None, pool_size=1):
+        self.headers = dict(headers or {})
+        self.pool_size = pool_size
+        self._idle = dict()
+        self._ssl_context = None
+
+        # Connection reuse stats
+        self.num_requests = 0
+        self.num_connections = 0
+
+    async def _connect(self, scheme, host, port):
+        ssl_context = None
+        if scheme == 'https':
+            if self._ssl_context is None:
+                self._ssl_context = ssl.create_default_context()
+            ssl_context = self._ssl_context
+        reader, writer = await asyncio.open_connection(host, port, ssl=ssl_context)
+        self.num_connections += 1
+        return reader, writer
+
+    async def _read_body(self, reader, status_code, headers):
+        if status_code in (204, 304):
+            # Responses without body, e.g. 304 Not Modified of a conditional request
+            return b'', True
+        elif headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = list()
+            while True:
+                size_line = await reader.readline()
+                size = int(size_line.split(b';')[0].strip(), 16)
+                if size == 0:
+                    # Skip trailers
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            return b''.join(chunks), True
+        elif 'content-length' in headers:
+            return await reader.readexactly(int(headers['content-length'])), True
+        else:
+            # Body is delimited by closing the connection
+            return await reader.read(), False
+
+    async def _request(self, connection, request):
+        reader, writer = connection
+        writer.write(request)
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError('Connection closed by server')
+        status_code = int(status_line.split()[1])
+
+        headers = dict()
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        content, reusable = await self._read_body(reader, status_code, headers)
+        if headers.get('content-encoding', '').lower() == 'gzip':
+            content = zlib.decompress(content, 16 + zlib.MAX_WBITS)
+        if headers.get('connection', '').lower() == 'close':
+            reusable = False
+
+        return AsyncResponse(status_code, headers, content), reusable
+
+    async def get(self, url, params=None, headers=None):
+        split_url = urlsplit(url)
+        scheme = split_url.scheme
+        host = split_url.hostname
+        port = split_url.port or (443 if scheme == 'https' else 80)
+
+        path = split_url.path or '/'
+        query = split_url.query
+        if params:
+            query = (query + '&' if query else '') + urlencode(params)
+        if query:
+            path = path + '?' + query
+
+        request_headers = dict(self.headers)
+        request_headers.update(headers or {})
+        request_headers['Host'] = split_url.netloc
+        request_headers['Connection'] = 'keep-alive'
+        request = 'GET %s HTTP/1.1\r\n' % path
+        for name, value in request_headers.items():
+            request += '%s: %s\r\n' % (name, value)
+        request = (request + '\r\n').encode('utf-8')
+
+        pool_key = (scheme, host, port)
+        idle = self._idle.setdefault(pool_key, list())
+        self.num_requests += 1
+
+        # A reused connection may have been closed by the server while idle,
+        # so retry once with a new connection
+        while idle:
+            connection = idle.pop()
+            try:
+                response, reusable = await self._request(connection, request)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                connection[1].close()
+                continue
+            except BaseException:
+                # e.g. cancelled by a timeout in the middle of the response
+                connection[1].close()
+                raise
+            self._release(pool_key, connection, reusable)
+            return response
+
+        connection = await self._connect(scheme, host, port)
+        try:
+            response, reusable = await self._request(connection, request)
+        except BaseException:
+            connection[1].close()
+            raise
+        self._release(pool_key, connection, reusable)
+        return response
+
+    def _release(self, pool_key, connection, reusable):
+        idle = self._idle.setdefault(pool_key, list())
+        if reusable and len(idle) < self.pool_size:
+            idle.append(connection)
+        else:
+            connection[1].close()
+
+    def close(self):
+        for idle in self._idle.values():
+            for reader, writer in idle:
+                writer.close()
+        self._idle.clear()
+
+
+class AsyncFuture(object):
+    """Future returned by ``AsyncExecutor.submit``.
+
+    Waiting for a result runs the event loop, so every other submitted
+    request makes progress at the same time.
+    """
+    def __init__(self, executor, task):
+        self._executor = executor
+        self._task = task
+
+    def result(self):
+        return self._executor.loop.run_until_complete(self._task)
+
+    def cancel(self):
+        return self._task.cancel()
+
+
+class AsyncExecutor(object):
+    """Runs coroutines on a private event loop with at most ``max_workers``
+    of them in flight.
+    """
+    is_async = True
+
+    def __init__(self, max_workers, client):
+        self.loop = asyncio.new_event_loop()
+        self.client = client
+        self._semaphore = self.loop.run_until_complete(self._create_semaphore(max_workers))
+        self._tasks = set()
+
+    async def _create_semaphore(self, value):
+        return asyncio.Semaphore(value)
+
+    async def _run(self, fn, args, kwargs):
+        async with self._semaphore:
+            return await fn(*args, **kwargs)
+
+    def submit(self, fn, *args, **kwargs):
+        task = self.loop.create_task(self._run(fn, args, kwargs))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return AsyncFuture(self, task)
+
+    def shutdown(self, wait=True):
+        pending = list(self._tasks)
+        for task in pending:
+            task.cancel()
+        if pending:
+            self.loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        self.client.close()
+        self.loop.close()
@@ -0,0 +1,171 @@
+"""On-disk caches of CircleCI API responses for the CircleCI modular input.
+
+``DiskCache`` keeps gzip-compressed values in files named by the SHA-256 of
+their key under a directory, and evicts the least recently used ones beyond
+``max_bytes``. ``ResponseCache`` keeps bodies of list responses with their
+``ETag`` and ``Last-Modified``, so that they are requested again with
+``If-None-Match`` and ``If-Modified-Since`` and reused on ``304 Not
+Modified``. ``JobDetailCache`` keeps API v1.1 job details of finished builds,
+which never change, so that they are not requested again.
+"""
+
+from __future__ import absolute_import
+import gzip, hashlib, json, os, threading, time
+
+from collections import OrderedDict
+
+from circleci_checkpoint import TERMINAL_STATUSES
+
+
+class DiskCache(object):
+    """LRU cache of compressed values in files under ``directory``.
+
+    Files are evicted beyond ``max_bytes`` in total, least recently used
+    first. Entries written more than ``ttl`` seconds ago are expired, unless
+    ``ttl`` is None. The order of use is kept in memory and starts from the
+    order of writes when the cache is opened.
+    """
+    SUFFIX = '.gz'
+
+    def __init__(self, directory, max_bytes, ttl=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # (size, written) by file name, least recently used first
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def load(self):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        entries = list()
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(self.SUFFIX):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name, stat.st_size))
+            elif entry.name.endswith('.tmp'):
+                # Left by a process stopped while writing
+                os.remove(entry.path)
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+            for written, name, size in sorted(entries):
+                self._entries[name] = (size, written)
+                self._total_bytes += size
+            self._evict()
+
+    def get_name(self, key):
+        return hashlib.sha256(key.encode('utf-8')).hexdigest() + self.SUFFIX
+
+    def get(self, key):
+        # Returns the value of key as bytes, or None
+        name = self.get_name(key)
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                return None
+            if self.ttl is not None and entry[1] + self.ttl <= time.time():
+                self._remove(name)
+                return None
+            self._entries.move_to_end(name)
+        try:
+            with gzip.open(os.path.join(self.directory, name), 'rb') as f:
+                return f.read()
+        except Exception:
+            # Removed or corrupted file is a cache miss
+            with self._lock:
+                self._remove(name)
+            return None
+
+    def put(self, key, value):
+        # Replace the file of key atomically
+        name = self.get_name(key)
+        path = os.path.join(self.directory, name)
+        tmp_path = '%s.%d.tmp' % (path, threading.get_ident())
+        with open(tmp_path, 'wb') as f:
+            f.write(gzip.compress(value, compresslevel=6))
+        size = os.path.getsize(tmp_path)
+        with self._lock:
+            os.replace(tmp_path, path)
+            entry = self._entries.pop(name, None)
+            if entry is not None:
+                self._total_bytes -= entry[0]
+            self._entries[name] = (size, time.time())
+            self._total_bytes += size
+            self._evict()
+
+    def _remove(self, name):
+        entry = self._entries.pop(name, None)
+        if entry is None:
+            return
+        self._total_bytes -= entry[0]
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except OSError:
+            pass
+
+    def _evict(self):
+        while self._entries and self.max_bytes < self._total_bytes:
+            self._remove(next(iter(self._entries)))
+
+
+class ResponseCache(object):
+    """Cache of list responses of CircleCI API by URL and params."""
+    def __init__(self, directory, max_bytes):
+        self._cache = DiskCache(directory=directory, max_bytes=max_bytes)
+
+    def load(self):
+        self._cache.load()
+
+    def get_key(self, url, params):
+        return url + '?' + json.dumps(sorted((params or {}).items()))
+
+    def get(self, url, params):
+        # Returns (headers of a conditional request, cached body), or
+        # (None, None) if the response is not cached
+        value = self._cache.get(self.get_key(url, params))
+        if value is None:
+            return None, None
+        entry = json.loads(value.decode('utf-8'))
+        headers = dict()
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers, entry['body']
+
+    def put(self, url, params, response):
+        # Cache a 200 response which has ETag or Last-Modified
+        etag = response.headers.get('etag')
+        last_modified = response.headers.get('last-modified')
+        if response.status_code != 200 or not (etag or last_modified):
+            return
+        entry = {'etag': etag, 'last_modified': last_modified, 'body': response.text}
+        self._cache.put(self.get_key(url, params), json.dumps(entry).encode('utf-8'))
+
+
+class JobDetailCache(object):
+    """Cache of API v1.1 job details of finished builds by project_slug and
+    build number, expired after ``ttl`` seconds."""
+    def __init__(self, directory, max_bytes, ttl):
+        self._cache = DiskCache(directory=directory, max_bytes=max_bytes, ttl=ttl)
+
+    def load(self):
+        self._cache.load()
+
+    def get_key(self, project_slug, build_num):
+        return '%s/%s' % (project_slug, build_num)
+
+    def get(self, project_slug, build_num):
+        # Returns the cached job detail, or None
+        value = self._cache.get(self.get_key(project_slug, build_num))
+        if value is None:
+            return None
+        return json.loads(value.decode('utf-8'))
+
+    def put(self, project_slug, build_num, job_detail):
+        # Cache a job detail only once its build is finished
+        if not isinstance(job_detail, dict) or job_detail.get('status') not in TERMINAL_STATUSES:
+            return
+        self._cache.put(self.get_key(project_slug, build_num), json.dumps(job_detail).encode('utf-8'))
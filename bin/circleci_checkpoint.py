@@ -0,0 +1,180 @@
+"""Checkpoint helpers for the CircleCI modular input.
+
+``CheckpointBuffer`` accumulates updated workflow and job checkpoints and
+writes them to KV Store with ``batch_save`` instead of one request per
+checkpoint. ``TerminalCheckpointCache`` remembers workflows and jobs in a
+terminal state on local disk so that they are skipped without KV Store and
+CircleCI API requests.
+"""
+
+from __future__ import absolute_import
+import atexit, io, os, threading, time, weakref
+
+from collections import OrderedDict
+
+# Workflow and job statuses which never change
+# Job checkpoints keep statuses of API v1.1 (e.g. `fixed`, `no_tests`)
+TERMINAL_STATUSES = frozenset([
+    'success', 'fixed', 'failed', 'error', 'canceled', 'unauthorized', 'not_run',
+    'infrastructure_fail', 'timedout', 'no_tests', 'terminated-unknown'
+])
+
+# Buffers which still hold checkpoints are flushed at process exit
+_live_buffers = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_live_buffers():
+    for checkpoint_buffer in list(_live_buffers):
+        checkpoint_buffer.flush()
+
+
+class CheckpointBuffer(object):
+    """Write-behind buffer of KV Store checkpoints.
+
+    Checkpoints are saved when ``batch_size`` of them are pending, when the
+    oldest pending one is older than ``max_age`` seconds, or when ``flush``
+    is called. ``batch_save`` inserts or updates documents by ``_key``, so new
+    checkpoints don't need to be inserted beforehand. Events buffered in
+    ``ew`` are flushed first, so that no checkpoint is saved before its event
+    is written.
+    """
+    def __init__(self, ew, batch_size=500, max_age=30):
+        self.ew = ew
+        self.batch_size = batch_size
+        self.max_age = max_age
+
+        # Callables notified with (collection_name, documents) after each
+        # successful batch_save
+        self.listeners = list()
+
+        # Pending checkpoints by collection name, then by _key
+        self._collections = dict()
+        self._pending = dict()
+        self._pending_count = 0
+        self._oldest = None
+        self._lock = threading.RLock()
+
+        # Number of failed batch_save requests
+        self.failures = 0
+
+        _live_buffers.add(self)
+
+    def add(self, kvstore_collection, checkpoint_data):
+        with self._lock:
+            collection_name = kvstore_collection.name
+            self._collections[collection_name] = kvstore_collection
+            pending = self._pending.setdefault(collection_name, dict())
+            if checkpoint_data.get('_key') not in pending:
+                self._pending_count += 1
+            pending[checkpoint_data.get('_key')] = dict(checkpoint_data)
+            if self._oldest is None:
+                self._oldest = time.time()
+
+            if self.batch_size <= self._pending_count or self.max_age <= time.time() - self._oldest:
+                self.flush()
+
+    def flush(self):
+        # Save all pending checkpoints
+        # Returns False if any batch_save request failed
+        success = True
+        # Requests are counted in metrics of the run, if ew is its logger
+        metrics = getattr(self.ew, 'metrics', None)
+        with self._lock:
+            if self._pending_count > 0 and getattr(self.ew, 'flush', None) is not None:
+                self.ew.flush()
+            for collection_name, pending in self._pending.items():
+                kvstore_collection = self._collections[collection_name]
+                documents = list(pending.values())
+                for i in range(0, len(documents), self.batch_size):
+                    chunk = documents[i:i+self.batch_size]
+                    try:
+                        self.ew.log('DEBUG', 'Start batch_save kv store collection=%s documents=%s', 
+                            collection_name, len(chunk))
+                        if metrics is not None:
+                            metrics.count('kvstore_writes')
+                            metrics.count('kvstore_written_documents', len(chunk))
+                        kvstore_collection.data.batch_save(*chunk)
+                        self.ew.log('DEBUG', 'Successfully batch_save kv store collection=%s documents=%s', 
+                            collection_name, len(chunk))
+                        for listener in self.listeners:
+                            listener(collection_name, chunk)
+                    except Exception as e:
+                        self.ew.log('ERROR', 'Failed to batch_save kv store collection=%s documents=%s %s', 
+                            collection_name, len(chunk), e)
+                        self.failures += 1
+                        if metrics is not None:
+                            metrics.count('kvstore_failures')
+                        success = False
+
+            self._pending = dict()
+            self._pending_count = 0
+            self._oldest = None
+
+        return success
+
+
+class TerminalCheckpointCache(object):
+    """LRU cache of workflow and job ids in a terminal state.
+
+    Entries are kept in a compact text file (one ``<id> <status>`` per line,
+    least recently used first) and evicted beyond ``max_entries``. Ids are
+    only added once their checkpoint is saved in KV Store.
+    """
+    def __init__(self, path, max_entries=100000):
+        self.path = path
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def load(self):
+        with self._lock:
+            self._entries.clear()
+            if not os.path.exists(self.path):
+                return
+            with io.open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    key, _, status = line.rstrip('\n').partition(' ')
+                    if key:
+                        self._entries[key] = status
+            self._evict()
+
+    def save(self):
+        # Replace the cache file atomically
+        with self._lock:
+            if not self._dirty:
+                return
+            tmp_path = self.path + '.tmp'
+            with io.open(tmp_path, 'w', encoding='utf-8') as f:
+                for key, status in self._entries.items():
+                    f.write(u'%s %s\n' % (key, status))
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+
+    def get(self, key):
+        # Returns cached terminal status of key, or None
+        with self._lock:
+            status = self._entries.get(key)
+            if status is not None:
+                self._entries.move_to_end(key)
+            return status
+
+    def add(self, key, status):
+        if key is None or status not in TERMINAL_STATUSES:
+            return
+        with self._lock:
+            self._entries[key] = status
+            self._entries.move_to_end(key)
+            self._dirty = True
+            self._evict()
+
+    def add_checkpoints(self, collection_name, documents):
+        # Listener of CheckpointBuffer
+        for checkpoint_data in documents:
+            self.add(checkpoint_data.get('_key'), checkpoint_data.get('status'))
+
+    def _evict(self):
+        while self.max_entries < len(self._entries):
+            self._entries.popitem(last=False)
+            self._dirty = True
@@ -0,0 +1,261 @@
+"""HTTP Event Collector output for the CircleCI modular input.
+
+``HECSender`` posts batches of JSON events to HTTP Event Collector, gzip
+compressed, from a background thread. Batches wait in a bounded queue, so
+writers block instead of buffering without limit when HEC is slow. With
+indexer acknowledgement, a batch is done once its ack id is acknowledged, and
+it is sent again if not acknowledged within ``ack_timeout`` seconds.
+``HECEventWriter`` writes events of a run to a ``HECSender`` instead of the
+XML stream to splunkd, and log lines to the event writer it wraps.
+"""
+
+from __future__ import absolute_import
+import gzip, json, threading, time, uuid
+
+import requests
+
+from splunklib.six.moves import queue
+from circleci_ratelimit import RateLimitScheduler
+
+# Seconds between requests to the ack endpoint
+ACK_POLL_INTERVAL = 0.5
+
+# Queued to stop the sender thread
+_CLOSE = object()
+
+
+class HECSender(object):
+    """Sender of event batches to HTTP Event Collector at ``url``.
+
+    Shared by all inputs with the same HEC settings in the process. Batches
+    which fail after ``max_retries`` retries are dropped and counted in
+    ``failures``, so that writers can tell whether their events were sent.
+    """
+    def __init__(self, url, token, ack=False, verify=True, queue_size=8, ack_timeout=300, max_retries=3, timeout=60):
+        self.url = url.rstrip('/')
+        self.token = token
+        self.ack = ack
+        self.ack_timeout = ack_timeout
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        self.session.verify = verify
+        self.session.headers.update({
+            'Authorization': 'Splunk %s' % token,
+            # Acks are tracked per channel
+            'X-Splunk-Request-Channel': str(uuid.uuid4()),
+            'Content-Type': 'application/json'
+        })
+        # Backoff of retries on 503 (server busy) and connection errors
+        self._retry = RateLimitScheduler(max_retries=max_retries)
+
+        # Each queued batch is done once sent, or acknowledged with ack
+        self._queue = queue.Queue(maxsize=queue_size)
+        # Sent batches waiting for ack: (payload, number of events, sent time)
+        # by ack id
+        self._pending_acks = dict()
+        self._polled = 0.0
+
+        self._stats_lock = threading.Lock()
+        self.failures = 0
+        self.last_error = None
+        self.num_events = 0
+        self.num_batches = 0
+        self.num_resent = 0
+        self.num_bytes = 0
+
+        self._thread = threading.Thread(target=self._run, name='hec-sender')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def send(self, payload, num_events):
+        # Queue a batch of newline-delimited JSON events, blocking while the
+        # queue is full
+        self._queue.put((payload, num_events))
+
+    def flush(self):
+        # Wait until all queued batches are sent (and acknowledged)
+        self._queue.join()
+
+    def close(self):
+        self.flush()
+        self._queue.put(_CLOSE)
+        self._thread.join()
+        self.session.close()
+
+    def _run(self):
+        while True:
+            batch = None
+            if len(self._pending_acks) < self._queue.maxsize:
+                try:
+                    batch = self._queue.get(timeout=ACK_POLL_INTERVAL if self._pending_acks else None)
+                except queue.Empty:
+                    pass
+            else:
+                # Too many batches wait for ack, take no more until some are
+                time.sleep(ACK_POLL_INTERVAL)
+
+            if batch is _CLOSE:
+                self._queue.task_done()
+                return
+            if batch is not None:
+                payload, num_events = batch
+                self._send_batch(payload, num_events)
+            if self._pending_acks and ACK_POLL_INTERVAL <= time.time() - self._polled:
+                self._poll_acks()
+
+    def _send_batch(self, payload, num_events, resent=False):
+        try:
+            data = gzip.compress(payload.encode('utf-8'), compresslevel=6)
+            response = self._post('/services/collector/event', data, headers={'Content-Encoding': 'gzip'})
+            with self._stats_lock:
+                self.num_bytes += len(data)
+                if resent:
+                    self.num_resent += 1
+                else:
+                    self.num_events += num_events
+                    self.num_batches += 1
+            if self.ack:
+                self._pending_acks[response.json()['ackId']] = (payload, num_events, time.time())
+            else:
+                self._queue.task_done()
+        except Exception as e:
+            self._fail(e)
+            self._queue.task_done()
+
+    def _poll_acks(self):
+        self._polled = time.time()
+        try:
+            response = self._post('/services/collector/ack', json.dumps({'acks': list(self._pending_acks)}))
+            acks = response.json().get('acks', dict())
+        except Exception as e:
+            # Batches waiting for ack can't be confirmed any more
+            self._fail(e)
+            for i in range(len(self._pending_acks)):
+                self._queue.task_done()
+            self._pending_acks.clear()
+            return
+
+        for ack_id, (payload, num_events, sent) in list(self._pending_acks.items()):
+            if acks.get(str(ack_id)):
+                del self._pending_acks[ack_id]
+                self._queue.task_done()
+            elif self.ack_timeout <= time.time() - sent:
+                # Not indexed in time, send it again under a new ack id
+                del self._pending_acks[ack_id]
+                self._send_batch(payload, num_events, resent=True)
+
+    def _post(self, path, data, headers=None):
+        # POST to HEC, retrying busy servers and connection errors
+        attempt = 0
+        while True:
+            try:
+                response = self.session.post(self.url + path, data=data, headers=headers, timeout=self.timeout)
+            except requests.exceptions.RequestException:
+                # Connection errors are retried like 503
+                delay = self._retry.retry_delay(503, dict(), attempt)
+                if delay is None:
+                    raise
+            else:
+                if response.status_code < 300:
+                    return response
+                delay = self._retry.retry_delay(response.status_code, response.headers, attempt)
+                if delay is None:
+                    raise IOError('HTTP Event Collector returned status_code=%s: %s' \
+                        % (str(response.status_code), response.text[:200]))
+            time.sleep(delay)
+            attempt += 1
+
+    def _fail(self, error):
+        with self._stats_lock:
+            self.failures += 1
+            self.last_error = error
+
+    def pop_stats(self):
+        # Returns counts since the last call, and resets them
+        with self._stats_lock:
+            stats = (self.num_events, self.num_batches, self.num_resent, self.num_bytes)
+            self.num_events = self.num_batches = self.num_resent = self.num_bytes = 0
+        return stats
+
+
+class HECEventWriter(object):
+    """Event writer of a run which sends events to ``sender``.
+
+    Events are batched until ``batch_size`` characters, and log lines are
+    written to ``ew``. Events without index of their own are sent to
+    ``index``, or to the default index of the HEC token if it is None. Data of ``write_template`` is JSON text, and is
+    embedded in the HEC event as it is. ``flush`` raises ``IOError`` if any
+    batch of ``sender`` failed since this writer was created, so that no
+    checkpoint is saved for events which may not have been indexed.
+    """
+    def __init__(self, ew, sender, batch_size=1048576, source_prefix='hec:', index=None):
+        self._ew = ew
+        self.sender = sender
+        self.batch_size = batch_size
+        self.source_prefix = source_prefix
+        self.index = index
+
+        self._batch = list()
+        self._batch_length = 0
+        self._failures = sender.failures
+        # JSON of fields other than time and event by EventTemplate
+        self._prefixes = dict()
+
+    def write_event(self, event):
+        fields = self._render_fields(event.host, event.source, event.stanza, event.sourceType, event.index)
+        self._append(fields, json.dumps(event.data), event.time)
+
+    def write_template(self, template, data, time=None):
+        fields = self._prefixes.get(template)
+        if fields is None:
+            fields = self._render_fields(template.host, template.source, template.stanza, template.sourcetype, template.index)
+            self._prefixes[template] = fields
+        self._append(fields, data, time)
+
+    def log(self, severity, message, *args):
+        self._ew.log(severity, message, *args)
+
+    def write_xml_document(self, document):
+        self._ew.write_xml_document(document)
+
+    def flush(self):
+        # Send batched events and wait for all batches of the sender
+        self._send_batch()
+        self.sender.flush()
+        if self.sender.failures != self._failures:
+            raise IOError('Failed to send events to HTTP Event Collector url=%s: %s' \
+                % (self.sender.url, self.sender.last_error))
+        if hasattr(self._ew, 'flush'):
+            self._ew.flush()
+
+    def close(self):
+        self.flush()
+
+    def _render_fields(self, host, source, stanza, sourcetype, index):
+        # Events from HEC have a source of their own, as they are not parsed
+        # with INDEXED_EXTRACTIONS like the XML stream
+        if source is None and stanza is not None:
+            source = self.source_prefix + stanza
+        if index is None:
+            index = self.index
+        fields = [('host', host), ('source', source), ('sourcetype', sourcetype), ('index', index)]
+        return ''.join('"%s": %s, ' % (name, json.dumps(value)) for name, value in fields if value is not None)
+
+    def _append(self, fields, event, time):
+        if time is not None:
+            fields += '"time": %s, ' % str(time)
+        self._batch.append('{%s"event": %s}' % (fields, event))
+        self._batch_length += len(self._batch[-1]) + 1
+        if self.batch_size <= self._batch_length:
+            self._send_batch()
+
+    def _send_batch(self):
+        if self._batch:
+            batch = self._batch
+            self._batch = list()
+            self._batch_length = 0
+            self.sender.send('\n'.join(batch), len(batch))
+
+    def __getattr__(self, name):
+        return getattr(self._ew, name)
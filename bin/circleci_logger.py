@@ -0,0 +1,123 @@
+"""Leveled logging for the CircleCI modular input.
+
+``LeveledLogger`` wraps the event writer of a run. Log lines below ``level``
+are dropped before their message is formatted, so that hot loops pass a
+format and its arguments to ``log`` instead of a formatted message. Lines of
+the same format below ERROR are suppressed beyond ``repeat_limit`` per
+``repeat_interval`` seconds, as are exceptions logged without a format by
+their type. ``summary`` writes a single line of the events written and log
+lines dropped in the run. ``metrics`` of the run, if
+any, are counted by functions which get the logger as their event writer.
+"""
+
+from __future__ import absolute_import
+import json, threading, time
+
+# Severities of EventWriter.log in order
+LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARN': 30, 'ERROR': 40, 'FATAL': 50}
+
+
+class JSONArg(object):
+    """Log argument rendered as JSON only when its line is written."""
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __str__(self):
+        return json.dumps(self.value)
+
+
+class LeveledLogger(object):
+    """Event writer proxy which filters and rate limits log lines of ``ew``.
+
+    ``repeat_limit`` of 0 writes every line at or above ``level``.
+    """
+    def __init__(self, ew, level='INFO', repeat_limit=100, repeat_interval=60, metrics=None):
+        self.ew = ew
+        self.metrics = metrics
+        self.level = level
+        self.repeat_limit = repeat_limit
+        self.repeat_interval = repeat_interval
+        self._threshold = LEVELS[level]
+
+        # [start, count, suppressed] of the current window by (severity, format)
+        self._repeats = dict()
+        self._lock = threading.Lock()
+
+        self.started = time.time()
+        self.events = dict()
+        self.dropped = 0
+        self.suppressed = 0
+
+    def is_enabled(self, severity):
+        return self._threshold <= LEVELS.get(severity, LEVELS['FATAL'])
+
+    def log(self, severity, message, *args):
+        level = LEVELS.get(severity, LEVELS['FATAL'])
+        if level < self._threshold:
+            self.dropped += 1
+            return
+
+        if self.repeat_limit and level < LEVELS['ERROR']:
+            now = time.time()
+            with self._lock:
+                # An exception passed as message is limited by its type, as
+                # its text differs by request
+                key = (severity, message if isinstance(message, str) else type(message))
+                window = self._repeats.get(key)
+                if window is None or self.repeat_interval <= now - window[0]:
+                    if window is not None and 0 < window[2]:
+                        self._log_suppressed(severity, message, window[2])
+                    window = [now, 0, 0]
+                    self._repeats[key] = window
+                window[1] += 1
+                if self.repeat_limit < window[1]:
+                    window[2] += 1
+                    self.suppressed += 1
+                    return
+
+        if args:
+            message = message % args
+        self.ew.log(severity, message)
+
+    def summary(self, input_name):
+        # Write suppressed counts of the last windows and a summary of the
+        # run, regardless of level
+        with self._lock:
+            for (severity, message), window in self._repeats.items():
+                if 0 < window[2]:
+                    self._log_suppressed(severity, message, window[2])
+            self._repeats.clear()
+
+        self.ew.log('INFO', 'Run summary: input=%s elapsed=%.1fs events=%s workflows=%s jobs=%s steps=%s ' \
+            'log_level=%s dropped_logs=%s suppressed_logs=%s' \
+            % (input_name, time.time() - self.started, str(sum(self.events.values())),
+                str(self.events.get('circleci:workflow', 0)), str(self.events.get('circleci:job', 0)),
+                str(self.events.get('circleci:step', 0)), self.level, str(self.dropped), str(self.suppressed)))
+
+    def _log_suppressed(self, severity, message, suppressed):
+        if isinstance(message, type):
+            message = message.__name__
+        self.ew.log(severity, 'Suppressed %s log lines like: %s' % (str(suppressed), message))
+
+    def write_event(self, event):
+        self.events[event.sourceType] = self.events.get(event.sourceType, 0) + 1
+        self.ew.write_event(event)
+
+    def write_template(self, template, data, time=None):
+        self.events[template.sourcetype] = self.events.get(template.sourcetype, 0) + 1
+        self.ew.write_template(template, data, time)
+
+    def write_xml_document(self, document):
+        self.ew.write_xml_document(document)
+
+    def flush(self):
+        if hasattr(self.ew, 'flush'):
+            self.ew.flush()
+
+    def close(self):
+        self.ew.close()
+
+    def __getattr__(self, name):
+        return getattr(self.ew, name)
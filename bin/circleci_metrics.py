@@ -0,0 +1,122 @@
+"""Per-run metrics of the CircleCI modular input.
+
+``RunMetrics`` counts CircleCI API requests by endpoint with their bytes and
+latency, KV Store reads and writes, and items skipped by checkpoints in a run
+of an input. ``to_dict`` returns them with events written by sourcetype, and
+the input writes them as a single ``circleci:collector:metrics`` event at the
+end of each run.
+"""
+
+from __future__ import absolute_import
+import re, threading, time
+
+from splunklib.six.moves.urllib.parse import urlsplit
+
+# Upper bounds of latency buckets of API requests in milliseconds
+LATENCY_BUCKETS = (50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# Endpoint names of CircleCI API by path pattern
+ENDPOINTS = (
+    (re.compile(r'/v2/pipeline$'), 'pipelines'),
+    (re.compile(r'/v2/pipeline/[^/]+/workflow$'), 'workflows'),
+    (re.compile(r'/v2/workflow/[^/]+/job$'), 'jobs'),
+    (re.compile(r'/v1\.1/project/'), 'job_detail'),
+    (re.compile(r'/v2/project/.+/job/[^/]+$'), 'job_summary')
+)
+
+
+def get_endpoint_name(url):
+    path = urlsplit(url).path.rstrip('/')
+    for pattern, name in ENDPOINTS:
+        if pattern.search(path):
+            return name
+    return 'other'
+
+
+class RunMetrics(object):
+    """Counters and timings of a run, shared by threads of the run."""
+    def __init__(self):
+        self.started = time.time()
+        self._lock = threading.Lock()
+        # [requests, errors, bytes, seconds] by endpoint name
+        self._endpoints = dict()
+        # Requests by latency bucket, the last one is over LATENCY_BUCKETS
+        self._latency = [0] * (len(LATENCY_BUCKETS) + 1)
+        self._counters = dict()
+
+    def record_request(self, url, status_code, num_bytes, seconds):
+        # Record a response of CircleCI API, including retried ones
+        name = get_endpoint_name(url)
+        millis = seconds * 1000
+        bucket = next((i for i, bound in enumerate(LATENCY_BUCKETS) if millis <= bound), len(LATENCY_BUCKETS))
+        with self._lock:
+            stats = self._endpoints.get(name)
+            if stats is None:
+                stats = [0, 0, 0, 0.0]
+                self._endpoints[name] = stats
+            stats[0] += 1
+            # 304 answers a conditional request with the cached body
+            if status_code not in (200, 304):
+                stats[1] += 1
+            stats[2] += num_bytes
+            stats[3] += seconds
+            self._latency[bucket] += 1
+
+    def count(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def get_count(self, name):
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def get_requests(self):
+        # Returns responses of CircleCI API recorded so far
+        with self._lock:
+            return sum(stats[0] for stats in self._endpoints.values())
+
+    def to_dict(self, input_name, events, status):
+        # Returns metrics of the run with events written by sourcetype, named
+        # without the circleci: prefix (e.g. job)
+        with self._lock:
+            endpoints = dict((name, {'requests': stats[0], 'errors': stats[1], 'bytes': stats[2],
+                'seconds': round(stats[3], 3)}) for name, stats in self._endpoints.items())
+            latency = dict(('le_%dms' % bound, count) for bound, count in zip(LATENCY_BUCKETS, self._latency))
+            latency['gt_%dms' % LATENCY_BUCKETS[-1]] = self._latency[-1]
+            counters = dict(self._counters)
+
+        return {
+            'input': input_name,
+            'status': status,
+            # Cut off at max_run_seconds or by a stop
+            'cut_off': 0 < counters.get('cut_off', 0),
+            'duration_seconds': round(time.time() - self.started, 3),
+            'api': {
+                'requests': sum(stats['requests'] for stats in endpoints.values()),
+                'errors': sum(stats['errors'] for stats in endpoints.values()),
+                'bytes': sum(stats['bytes'] for stats in endpoints.values()),
+                'connections': counters.get('api_connections', 0),
+                'throttled': counters.get('api_throttled', 0),
+                'retried': counters.get('api_retried', 0),
+                'not_modified': counters.get('api_not_modified', 0),
+                'endpoints': endpoints,
+                'latency': latency
+            },
+            'kvstore': {
+                'reads': counters.get('kvstore_reads', 0),
+                'read_keys': counters.get('kvstore_read_keys', 0),
+                'writes': counters.get('kvstore_writes', 0),
+                'written_documents': counters.get('kvstore_written_documents', 0),
+                'failures': counters.get('kvstore_failures', 0)
+            },
+            'events': dict([(sourcetype.split(':')[-1], count) for sourcetype, count in events.items()], 
+                total=sum(events.values())),
+            'skipped': {
+                'pipelines_below_high_water_mark': counters.get('skipped_pipelines', 0),
+                'workflows_by_cache': counters.get('skipped_workflows_by_cache', 0),
+                'workflows_by_checkpoint': counters.get('skipped_workflows_by_checkpoint', 0),
+                'jobs_by_cache': counters.get('skipped_jobs_by_cache', 0),
+                'jobs_by_checkpoint': counters.get('skipped_jobs_by_checkpoint', 0),
+                'job_details_by_cache': counters.get('skipped_job_details_by_cache', 0)
+            }
+        }
@@ -0,0 +1,106 @@
+"""Per-run profiling of the CircleCI modular input.
+
+``RunProfiler`` profiles a run of an input with ``cProfile`` when ``profile``
+of the input is true or ``CIRCLECI_PROFILE`` is set in the environment. The
+profile of each run is written as a ``pstats`` file under ``directory``, which
+keeps the latest ``keep`` files per input, and ``top`` returns the hot
+functions of the run by their own time.
+
+cProfile follows only the thread of the run. Requests in the thread pool or on
+the event loop of the async engine show up as waits on their results.
+"""
+
+from __future__ import absolute_import
+import cProfile, os, pstats, re, threading, time
+
+# Environment variable which profiles runs of all inputs
+PROFILE_ENV = 'CIRCLECI_PROFILE'
+
+# Profiles kept per input
+PROFILE_KEEP = 10
+
+# Hot functions logged at the end of a profiled run
+PROFILE_TOP = 20
+
+# A single profiler can be active at a time in the process
+_active_lock = threading.Lock()
+
+
+def is_profile_env_enabled():
+    return os.environ.get(PROFILE_ENV, '').strip().lower() in ('1', 'true')
+
+
+class RunProfiler(object):
+    """cProfile of a run of an input, written under ``directory``."""
+    def __init__(self, directory, input_name, keep=PROFILE_KEEP):
+        self.directory = directory
+        self.keep = keep
+        # Profiles of circleci://org are named
+        # circleci_org_<YYYYmmddTHHMMSS.ffffff>[_<n>].pstats
+        self.prefix = re.sub(r'[^0-9A-Za-z_.-]+', '_', input_name) + '_'
+        # Profiles of circleci://org_x are not those of circleci://org
+        self.pattern = re.compile(r'^%s(\d{8}T\d{6}\.\d{6})(?:_(\d+))?\.pstats$' % re.escape(self.prefix))
+        self.path = None
+        self._profile = None
+
+    def start(self):
+        # Returns False if another run is being profiled
+        if not _active_lock.acquire(False):
+            return False
+        self._profile = cProfile.Profile()
+        try:
+            self._profile.enable()
+        except Exception:
+            self._profile = None
+            _active_lock.release()
+            raise
+        return True
+
+    def stop(self):
+        # Writes the profile, removes old ones of the input, and returns the
+        # path it is written to
+        if self._profile is None:
+            return None
+        try:
+            self._profile.disable()
+        finally:
+            _active_lock.release()
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        now = time.time()
+        name = '%s%s.%06d' % (self.prefix, time.strftime('%Y%m%dT%H%M%S', time.gmtime(now)), int(now % 1 * 1000000))
+        self.path = os.path.join(self.directory, name + '.pstats')
+        # Runs of the same input stopped within a microsecond
+        count = 0
+        while os.path.exists(self.path):
+            count += 1
+            self.path = os.path.join(self.directory, '%s_%d.pstats' % (name, count))
+        self._profile.dump_stats(self.path)
+        self.remove_old_profiles()
+        return self.path
+
+    def remove_old_profiles(self):
+        # Oldest first by time and counter of the name
+        profiles = list()
+        for name in os.listdir(self.directory):
+            match = self.pattern.match(name)
+            if match:
+                profiles.append((match.group(1), int(match.group(2) or 0), name))
+        profiles.sort()
+        for _, _, name in profiles[:-self.keep] if 0 < self.keep else []:
+            os.remove(os.path.join(self.directory, name))
+
+    def top(self, limit=PROFILE_TOP):
+        # Returns (ncalls, tottime, cumtime, function) of hot functions by
+        # their own time, where function is file:line(name)
+        if self._profile is None:
+            return []
+        stats = pstats.Stats(self._profile)
+        functions = list()
+        for (filename, line, name), (primitive_calls, ncalls, tottime, cumtime, callers) in stats.stats.items():
+            # Built-in functions have no file
+            function = name if filename == '~' else '%s:%d(%s)' % (os.path.basename(filename), line, name)
+            functions.append((tottime, cumtime, ncalls, function))
+        functions.sort(key=lambda function: function[0], reverse=True)
+        return [(ncalls, tottime, cumtime, function) for tottime, cumtime, ncalls, function in functions[:limit]]
@@ -0,0 +1,131 @@
+"""Rate limit aware request scheduling for the CircleCI modular input.
+
+``RateLimitScheduler`` is shared by every input with the same API token in
+the process. Each request takes a token from a token bucket, and responses
+with 429 or 5xx, and requests failed without a response (connection errors
+and timeouts), are retried with jittered exponential backoff. Retry-After
+and X-RateLimit-* headers pause all requests of the API token until the
+limit is reset.
+"""
+
+from __future__ import absolute_import
+import random, threading, time
+
+from email.utils import parsedate_tz, mktime_tz
+
+# Status codes which are retried
+RETRY_STATUS_CODES = frozenset([429, 500, 502, 503, 504])
+
+# Schedulers by API token, shared by all inputs in the process
+_schedulers = dict()
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(api_token, rate=None, max_retries=None):
+    # Get or create the scheduler of api_token
+    # rate and max_retries update the scheduler if given
+    with _schedulers_lock:
+        scheduler = _schedulers.get(api_token)
+        if scheduler is None:
+            scheduler = RateLimitScheduler()
+            _schedulers[api_token] = scheduler
+    scheduler.configure(rate=rate, max_retries=max_retries)
+    return scheduler
+
+
+def parse_retry_after(value, now=None):
+    # Returns seconds to wait from Retry-After in seconds or HTTP-date
+    if value is None:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    date = parsedate_tz(value)
+    if date is None:
+        return None
+    return max(mktime_tz(date) - (now or time.time()), 0.0)
+
+
+class RateLimitScheduler(object):
+    """Token bucket of ``rate`` requests per second with a burst of ``burst``
+    requests. ``rate`` of 0 disables the bucket, but responses are still
+    retried and rate limit headers are still honored.
+    """
+    def __init__(self, rate=0, burst=None, max_retries=3, backoff=1.0, max_backoff=60.0):
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self._tokens = None
+        self._updated = time.time()
+        # All requests wait until this time after Retry-After or an exhausted
+        # X-RateLimit-Remaining
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def configure(self, rate=None, max_retries=None):
+        with self._lock:
+            if rate is not None and rate != self.rate:
+                self.rate = rate
+                self._tokens = None
+            if max_retries is not None:
+                self.max_retries = max_retries
+
+    def acquire(self):
+        # Reserve a request and returns seconds to wait before sending it
+        with self._lock:
+            now = time.time()
+            delay = max(self._paused_until - now, 0.0)
+
+            if 0 < self.rate:
+                burst = self.burst or max(self.rate, 1)
+                if self._tokens is None:
+                    self._tokens = burst
+                else:
+                    self._tokens = min(self._tokens + (now - self._updated) * self.rate, burst)
+                self._updated = now
+                # Tokens can be negative to queue reservations in order
+                self._tokens -= 1
+                if self._tokens < 0:
+                    delay = max(delay, -self._tokens / self.rate)
+
+            return delay
+
+    def retry_delay(self, status_code, headers, attempt):
+        # Observe a response, and returns seconds to wait before retrying it,
+        # or None if the response is final
+        now = time.time()
+        headers = dict((name.lower(), value) for name, value in headers.items())
+        pause = parse_retry_after(headers.get('retry-after'), now)
+        if pause is None and headers.get('x-ratelimit-remaining') == '0':
+            reset = headers.get('x-ratelimit-reset')
+            if reset is not None and reset.isdigit():
+                # Either epoch seconds or seconds until reset
+                pause = float(reset)
+                if 1000000000 < pause:
+                    pause = max(pause - now, 0.0)
+
+        if pause is not None:
+            with self._lock:
+                self._paused_until = max(self._paused_until, now + pause)
+
+        if status_code not in RETRY_STATUS_CODES or self.max_retries <= attempt:
+            return None
+
+        # Full jitter, but not earlier than the server asks
+        delay = self._backoff(attempt)
+        if pause is not None:
+            delay = max(delay, pause)
+        return delay
+
+    def error_delay(self, attempt):
+        # Returns seconds to wait before retrying a request which failed
+        # without a response, or None if it is not retried any more
+        if self.max_retries <= attempt:
+            return None
+        return self._backoff(attempt)
+
+    def _backoff(self, attempt):
+        return random.uniform(0, min(self.backoff * (2 ** attempt), self.max_backoff))
@@ -0,0 +1,263 @@
+"""Event writers for the CircleCI modular input.
+
+``BufferedEventWriter`` serializes events into an in-memory buffer and writes
+it to splunkd in large chunks, instead of flushing stdout after every event
+and stderr after every log line. ``serialize_event`` renders the same XML as
+``Event.write_to`` with string templates instead of ElementTree, and
+``EventTemplate`` encodes fields other than data and time once per stanza and
+sourcetype.
+``SynchronizedEventWriter`` serializes writes of inputs collected in parallel
+threads to the single writer of the process, so that their XML documents and
+log lines are never interleaved.
+"""
+
+from __future__ import absolute_import
+import io, sys, threading, time
+
+from splunklib import six
+from splunklib.modularinput import Event, EventWriter
+from splunklib.modularinput.event import ET
+
+
+def _probe_escapes(characters, render):
+    # Returns (character, escaped) pairs as ElementTree of this Python
+    # escapes them, starting with '&' so that entities are not escaped again
+    escapes = list()
+    for character in characters:
+        escaped = render(character)
+        if escaped != character:
+            escapes.append((character, escaped))
+    return escapes
+
+
+def _render_attrib(value):
+    return ET.tostring(ET.Element('e', {'a': value})).decode('ascii')[len('<e a="'):-len('" />')]
+
+
+def _render_cdata(value):
+    element = ET.Element('e')
+    element.text = value
+    return ET.tostring(element).decode('ascii')[len('<e>'):-len('</e>')]
+
+
+_ATTRIB_ESCAPES = _probe_escapes('&<>"\r\n\t', _render_attrib)
+_CDATA_ESCAPES = _probe_escapes('&<>"\r\n\t', _render_cdata)
+
+# Start, end and empty tags of sub-elements in the order of Event.write_to
+_EVENT_TAGS = [
+    ('<%s>' % tag, '</%s>' % tag, '<%s />' % tag) \
+        for tag in ('time', 'source', 'sourcetype', 'index', 'host', 'data')
+]
+
+
+def _escape(text, escapes):
+    for character, escaped in escapes:
+        if character in text:
+            text = text.replace(character, escaped)
+    return text
+
+
+def serialize_event(event):
+    """Returns the XML of ``event`` as ``Event.write_to`` writes it to a text
+    stream, rendered with string templates.
+
+    Events with values which are not text are rendered with ElementTree.
+    """
+    if event.data is None:
+        raise ValueError("Events must have at least the data field set to be written to XML.")
+
+    values = [None if event.time is None else str(event.time), 
+        event.source, event.sourceType, event.index, event.host, event.data]
+    if not six.PY3 or not all(value is None or isinstance(value, str) for value in values + [event.stanza]):
+        stream = io.StringIO()
+        event.write_to(stream)
+        return stream.getvalue()
+
+    parts = ['<event']
+    if event.stanza is not None:
+        parts.append(' stanza="%s"' % _escape(event.stanza, _ATTRIB_ESCAPES))
+    parts.append(' unbroken="%d">' % int(event.unbroken))
+    for (start_tag, end_tag, empty_tag), value in zip(_EVENT_TAGS, values):
+        if value is None:
+            continue
+        if value == '':
+            parts.append(empty_tag)
+        else:
+            parts.append(start_tag)
+            parts.append(_escape(value, _CDATA_ESCAPES))
+            parts.append(end_tag)
+    if event.done:
+        parts.append('<done />')
+    parts.append('</event>')
+
+    return _to_ascii(''.join(parts))
+
+
+def _to_ascii(xml):
+    # ElementTree writes characters out of ASCII as character references
+    try:
+        xml.encode('ascii')
+        return xml
+    except UnicodeEncodeError:
+        return xml.encode('ascii', 'xmlcharrefreplace').decode('ascii')
+
+
+class EventTemplate(object):
+    """Event whose fields other than data and time are fixed.
+
+    The XML of the fixed fields is rendered once, so that ``serialize`` only
+    escapes data (and time) of each event. ``serialize`` returns the same XML
+    as ``serialize_event`` of ``to_event``.
+    """
+    def __init__(self, stanza=None, host=None, index=None, source=None, sourcetype=None, done=True, unbroken=True):
+        self.stanza = stanza
+        self.host = host
+        self.index = index
+        self.source = source
+        self.sourcetype = sourcetype
+        self.done = done
+        self.unbroken = unbroken
+
+        # Render the fixed fields with an empty time and data, then split the
+        # XML around them
+        head_and_fields = serialize_event(self.to_event(data='', time=''))
+        self._head, _, rest = head_and_fields.partition('<time />')
+        self._fields, _, self._tail = rest.rpartition('<data />')
+        self._templated = six.PY3 and all(value is None or isinstance(value, str) \
+            for value in (stanza, host, index, source, sourcetype))
+
+    def to_event(self, data, time=None):
+        return Event(data=data, stanza=self.stanza, time=time, host=self.host, index=self.index, 
+            source=self.source, sourcetype=self.sourcetype, done=self.done, unbroken=self.unbroken)
+
+    def serialize(self, data, time=None):
+        # Returns the XML of an event with data and time
+        if not self._templated or not isinstance(data, str):
+            return serialize_event(self.to_event(data=data, time=time))
+
+        parts = [self._head]
+        if time is not None:
+            time = str(time)
+            parts.append('<time>%s</time>' % _escape(time, _CDATA_ESCAPES) if time != '' else '<time />')
+        parts.append(self._fields)
+        parts.append('<data>%s</data>' % _escape(data, _CDATA_ESCAPES) if data != '' else '<data />')
+        parts.append(self._tail)
+        return _to_ascii(''.join(parts))
+
+
+class BufferedEventWriter(EventWriter):
+    """``EventWriter`` which buffers events and log lines.
+
+    Buffers are written and flushed when they exceed ``flush_size``
+    characters, when ``flush_interval`` seconds have passed since the last
+    flush, on ERROR and FATAL log lines, and on ``flush`` and ``close``.
+    Callers must ``flush`` before saving checkpoints of written events.
+    ``serializer`` is ``template`` to render events with ``serialize_event``,
+    or ``etree`` to render them with ``Event.write_to``.
+    """
+    def __init__(self, output=sys.stdout, error=sys.stderr, flush_size=65536, flush_interval=1.0, serializer='template'):
+        super(BufferedEventWriter, self).__init__(output, error)
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.serializer = serializer
+
+        self._out_buffer = io.StringIO()
+        self._err_buffer = io.StringIO()
+        self._flushed = time.time()
+
+    def write_event(self, event):
+        if not self.header_written:
+            self._out_buffer.write("<stream>")
+            self.header_written = True
+
+        if self.serializer == 'template':
+            self._out_buffer.write(serialize_event(event))
+        else:
+            event.write_to(self._out_buffer)
+        self._flush_if_due()
+
+    def write_template(self, template, data, time=None):
+        # Write an event of an EventTemplate with data and time
+        if self.serializer != 'template':
+            self.write_event(template.to_event(data=data, time=time))
+            return
+
+        if not self.header_written:
+            self._out_buffer.write("<stream>")
+            self.header_written = True
+
+        self._out_buffer.write(template.serialize(data, time))
+        self._flush_if_due()
+
+    def log(self, severity, message):
+        self._err_buffer.write("%s %s\n" % (severity, message))
+        if severity in (self.ERROR, self.FATAL):
+            self.flush()
+        else:
+            self._flush_if_due()
+
+    def write_xml_document(self, document):
+        self.flush()
+        super(BufferedEventWriter, self).write_xml_document(document)
+
+    def flush(self):
+        # Write buffered events and log lines, then flush their streams
+        if self._out_buffer.tell() > 0:
+            self._out.write(self._out_buffer.getvalue())
+            self._out.flush()
+            self._out_buffer = io.StringIO()
+        if self._err_buffer.tell() > 0:
+            self._err.write(self._err_buffer.getvalue())
+            self._err.flush()
+            self._err_buffer = io.StringIO()
+        self._flushed = time.time()
+
+    def close(self):
+        self.flush()
+        super(BufferedEventWriter, self).close()
+
+    def _flush_if_due(self):
+        if self.flush_size <= self._out_buffer.tell() + self._err_buffer.tell() \
+            or self.flush_interval <= time.time() - self._flushed:
+            self.flush()
+
+
+class SynchronizedEventWriter(object):
+    """Thread-safe proxy of an ``EventWriter``."""
+    def __init__(self, ew):
+        self._ew = ew
+        self._lock = threading.RLock()
+
+    def write_event(self, event):
+        with self._lock:
+            self._ew.write_event(event)
+
+    def write_template(self, template, data, time=None):
+        with self._lock:
+            if hasattr(self._ew, 'write_template'):
+                self._ew.write_template(template, data, time)
+            else:
+                self._ew.write_event(template.to_event(data=data, time=time))
+
+    def log(self, severity, message, *args):
+        # Formats message with args like LeveledLogger.log
+        if args:
+            message = message % args
+        with self._lock:
+            self._ew.log(severity, message)
+
+    def write_xml_document(self, document):
+        with self._lock:
+            self._ew.write_xml_document(document)
+
+    def flush(self):
+        with self._lock:
+            if hasattr(self._ew, 'flush'):
+                self._ew.flush()
+
+    def close(self):
+        with self._lock:
+            self._ew.close()
+
+    def __getattr__(self, name):
+        return getattr(self._ew, name)